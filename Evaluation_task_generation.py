@@ -5,43 +5,40 @@ LaQual - Evaluation_task_generation
 日期：2025-01-27
 """
 
+import asyncio
+import glob
 import json
 import os
-import requests
-import time
 import sys
-from typing import Dict, List, Any
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Any, Iterator, Tuple
+from instrumentation import metrics
+from siliconflow_client import SiliconFlowAPIError, SiliconFlowClient, get_client
+from storage import load_tag_metrics
+from structured_logging import fields, get_logger, item
 
-# SiliconFlow API配置
-SILICONFLOW_API_KEY = os.getenv('SILICONFLOW_API_KEY') or 'your_api_key_here'
-SILICONFLOW_API_URL = os.getenv('SILICONFLOW_API_URL') or 'https://api.siliconflow.cn/v1/chat/completions'
+logger = get_logger("task_generation")
 
 class QuestionGenerator:
-    def __init__(self):
-        self.api_key = SILICONFLOW_API_KEY
-        self.api_url = SILICONFLOW_API_URL
-        self.headers = {
-            "Authorization": f"Bearer {self.api_key}",
-            "Content-Type": "application/json"
-        }
+    def __init__(self, client: SiliconFlowClient = None):
+        self.client = client or get_client()
 
     def ensure_output_dir(self, output_dir: str):
         """确保输出目录存在"""
         if not os.path.exists(output_dir):
             os.makedirs(output_dir)
-            print(f"创建输出目录: {output_dir}")
+            logger.info(f"创建输出目录: {output_dir}")
 
     def load_metrics(self, file_path: str) -> Dict[str, Any]:
-        """加载指标数据"""
+        """加载指标数据（格式由扩展名决定，见 storage.load_tag_metrics）"""
         try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                return json.load(f)
+            return load_tag_metrics(file_path)
         except Exception as e:
-            print(f"读取指标文件时出错: {str(e)}")
+            logger.error(f"读取指标文件时出错: {str(e)}", extra=fields(file=file_path))
             return {}
 
-    def call_siliconflow_api(self, prompt: str) -> str:
-        """调用SiliconFlow API生成问题"""
+    def call_siliconflow_api(self, prompt: str, refresh: bool = False) -> str:
+        """调用SiliconFlow API生成问题（refresh=True 时不读取缓存）"""
         data = {
             "model": "Qwen/QwQ-32B",
             "messages": [
@@ -65,50 +62,26 @@ class QuestionGenerator:
         }
         
         try:
-            print("正在调用SiliconFlow API...")
-            response = requests.post(self.api_url, headers=self.headers, json=data)
-            
-            if response.status_code == 400:
-                print("API请求格式错误，请检查请求参数")
-                print(f"错误详情: {response.text}")
-                return None
-            elif response.status_code == 401:
-                print("API密钥无效或未授权")
-                return None
-            elif response.status_code == 429:
-                print("API调用频率超限，请稍后重试")
-                return None
-            elif response.status_code != 200:
-                print(f"API调用失败，状态码: {response.status_code}")
-                print(f"错误详情: {response.text}")
-                return None
-                
-            response.raise_for_status()
-            result = response.json()
-            
-            if 'choices' not in result or not result['choices']:
-                print("API返回数据格式错误")
-                return None
-                
-            content = result['choices'][0]['message']['content']
+            content = self.client.chat(data, refresh=refresh)
             
             # 验证生成的内容是否完整
             if content and len(content) > 0:
                 # 检查是否以完整句子结束
                 if not any(content.endswith(end) for end in ['。', '！', '？', '.', '!', '?']):
-                    print("警告：生成的内容可能不完整，尝试重新生成")
+                    logger.warning("生成的内容可能不完整，尝试重新生成")
                     return None
                     
             return content
             
-        except requests.exceptions.RequestException as e:
-            print(f"API请求异常: {str(e)}")
-            return None
-        except json.JSONDecodeError as e:
-            print(f"API响应解析错误: {str(e)}")
+        except SiliconFlowAPIError as e:
+            logger.error(f"API调用失败: {str(e)}", extra=fields(status_code=e.status_code,
+                                                              response_text=e.response_text))
+            if not e.is_content_error:
+                # 传输层错误客户端已重试过，交由调用方直接放弃，不再叠加重试
+                raise
             return None
         except Exception as e:
-            print(f"调用API时发生未知错误: {str(e)}")
+            logger.error(f"调用API时发生未知错误: {str(e)}")
             return None
 
     def generate_question(self, category: str, metric_name: str, metric_data: Dict[str, Any]) -> Dict[str, Any]:
@@ -148,59 +121,43 @@ class QuestionGenerator:
 问题：[问题内容]
 """
 
+        # 只在生成的问题不可用时重新请求；API调用失败（客户端重试已用尽）时直接抛出
         max_retries = 10
-        retry_delay = 2
 
         for attempt in range(max_retries):
-            try:
-                print(f"\n正在尝试第 {attempt + 1} 次生成问题...")
-                ai_response = self.call_siliconflow_api(prompt)
-                if not ai_response:
-                    print(f"第 {attempt + 1} 次API调用失败，准备重试...")
-                    time.sleep(retry_delay)
-                    retry_delay = min(retry_delay * 2, 60)
-                    continue
-
-                # 解析问题
-                lines = [line.strip() for line in ai_response.split('\n') if line.strip()]
-                question = next((line.replace('问题：', '').replace('问题:', '').strip() for line in lines if line.startswith('问题')), '')
-
-                if not question:
-                    print(f"第 {attempt + 1} 次生成的问题格式不完整，准备重试...")
-                    time.sleep(retry_delay)
-                    retry_delay = min(retry_delay * 2, 60)
-                    continue
-
-                if len(question) < 10:
-                    print(f"第 {attempt + 1} 次生成的问题过于简单，准备重试...")
-                    time.sleep(retry_delay)
-                    retry_delay = min(retry_delay * 2, 60)
-                    continue
-                    
-                # 验证问题是否完整
-                if not any(question.endswith(end) for end in ['。', '！', '？', '.', '!', '?']):
-                    print(f"第 {attempt + 1} 次生成的问题可能不完整，准备重试...")
-                    time.sleep(retry_delay)
-                    retry_delay = min(retry_delay * 2, 60)
-                    continue
-
-                print(f"\n✅ 成功生成问题！")
-                print(f"问题: {question}")
-
-                return {
-                    "category": category,
-                    "metric_name": metric_name,
-                    "description": description,
-                    "question": question,
-                    "scoring_criteria": scoring_criteria
-                }
+            logger.info(f"正在尝试第 {attempt + 1} 次生成问题...", extra=item(tag=category, metric=metric_name))
+            ai_response = self.call_siliconflow_api(prompt, refresh=attempt > 0)
+            if not ai_response:
+                logger.warning(f"第 {attempt + 1} 次生成的内容不可用，准备重试...", extra=fields(metric=metric_name))
+                continue
 
-            except Exception as e:
-                print(f"第 {attempt + 1} 次生成失败: {str(e)}")
-                time.sleep(retry_delay)
-                retry_delay = min(retry_delay * 2, 60)
+            # 解析问题
+            lines = [line.strip() for line in ai_response.split('\n') if line.strip()]
+            question = next((line.replace('问题：', '').replace('问题:', '').strip() for line in lines if line.startswith('问题')), '')
+
+            if not question:
+                logger.warning(f"第 {attempt + 1} 次生成的问题格式不完整，准备重试...", extra=fields(metric=metric_name))
                 continue
 
+            if len(question) < 10:
+                logger.warning(f"第 {attempt + 1} 次生成的问题过于简单，准备重试...", extra=fields(metric=metric_name))
+                continue
+                
+            # 验证问题是否完整
+            if not any(question.endswith(end) for end in ['。', '！', '？', '.', '!', '?']):
+                logger.warning(f"第 {attempt + 1} 次生成的问题可能不完整，准备重试...", extra=fields(metric=metric_name))
+                continue
+
+            logger.info("成功生成问题", extra=item(tag=category, metric=metric_name, question=question))
+
+            return {
+                "category": category,
+                "metric_name": metric_name,
+                "description": description,
+                "question": question,
+                "scoring_criteria": scoring_criteria
+            }
+
         raise Exception(f"在 {max_retries} 次尝试后仍未能生成满意的问题")
 
     def process_metrics(self, metrics_data: Dict[str, Any]) -> List[Dict[str, Any]]:
@@ -211,15 +168,13 @@ class QuestionGenerator:
         tag = metrics_data.get("标签", "")
         evaluation_metrics = metrics_data.get("评估指标", {})
         
-        print(f"\n{'='*50}")
-        print(f"正在处理标签: {tag}")
-        print(f"{'='*50}")
+        logger.info(f"正在处理标签: {tag}", extra=fields(metrics=len(evaluation_metrics)))
         
         for metric_name, metric_data in evaluation_metrics.items():
             try:
-                print(f"处理指标: {metric_name}")
+                logger.info(f"处理指标: {metric_name}", extra=item(tag=tag))
                 
-                # 生成问题（会一直重试直到成功）
+                # 生成问题（问题不可用时重新生成，API调用失败时跳过该指标）
                 question_data = self.generate_question(tag, metric_name, metric_data)
                 
                 # 添加基本信息
@@ -230,11 +185,10 @@ class QuestionGenerator:
                 }
                 
                 processed_metrics.append(question_data)
-                print(f"✅ 已完成指标: {metric_name}")
+                logger.info(f"已完成指标: {metric_name}", extra=item(tag=tag))
                 
             except Exception as e:
-                print(f"\n❌ 处理指标 {metric_name} 时出错: {str(e)}")
-                print("跳过当前指标，继续处理下一个...")
+                logger.error(f"处理指标 {metric_name} 时出错，跳过当前指标: {str(e)}", extra=fields(tag=tag))
                 continue
         
         return processed_metrics
@@ -246,35 +200,170 @@ class QuestionGenerator:
             output_dir = os.path.dirname(filename)
             self.ensure_output_dir(output_dir)
             
-            with open(filename, "w", encoding="utf-8") as f:
+            with metrics.timer("report_write_seconds", report="questions"), \
+                    open(filename, "w", encoding="utf-8") as f:
                 json.dump(data, f, ensure_ascii=False, indent=2)
-            print(f"结果已保存到: {filename}")
+            logger.info(f"结果已保存到: {filename}")
         except Exception as e:
-            print(f"保存文件时出错: {str(e)}")
+            logger.error(f"保存文件时出错: {str(e)}", extra=fields(file=filename))
 
+    @metrics.staged("task")
     def generate_questions_for_all_tags(self, input_file: str, output_file: str):
         """为所有标签生成问题"""
         # 加载指标数据
-        print(f"正在加载指标数据: {input_file}")
+        logger.info(f"正在加载指标数据: {input_file}")
         metrics_data = self.load_metrics(input_file)
         
         if not metrics_data:
-            print("未能加载指标数据，程序退出")
+            logger.error("未能加载指标数据，程序退出")
             return None
         
         # 处理指标数据
-        print("正在处理指标数据并生成问题...")
+        logger.info("正在处理指标数据并生成问题...")
         processed_metrics = self.process_metrics(metrics_data)
         
         # 保存结果
-        print("正在保存结果...")
         self.save_to_json(processed_metrics, output_file)
         
-        print(f"处理完成，共生成 {len(processed_metrics)} 个问题")
-        print(f"结果文件位置: {output_file}")
+        logger.info(f"处理完成，共生成 {len(processed_metrics)} 个问题", extra=fields(output_file=output_file))
         
         return processed_metrics
 
+    @staticmethod
+    def iter_tag_metrics(metrics_data: Dict[str, Any]) -> Iterator[Tuple[str, Dict[str, Any], Dict[str, Any]]]:
+        """遍历指标数据中的 (标签, 评估指标, 标签信息)
+
+        支持单标签格式 {"标签": ..., "评估指标": {...}} 和多标签格式 {标签: {指标名: {...}}}。
+        """
+        if "评估指标" in metrics_data:
+            yield metrics_data.get("标签", ""), metrics_data.get("评估指标", {}), metrics_data
+            return
+        for tag, evaluation_metrics in metrics_data.items():
+            if isinstance(evaluation_metrics, dict):
+                yield tag, evaluation_metrics, {"标签": tag}
+
+    async def _generate_question_async(self, semaphore: asyncio.Semaphore, executor: ThreadPoolExecutor,
+                                       tag: str, metric_name: str, metric_data: Dict[str, Any],
+                                       tag_info: Dict[str, Any]) -> Dict[str, Any]:
+        """在并发上限内为单个 (标签, 指标) 生成问题，失败时返回 None"""
+        async with semaphore:
+            loop = asyncio.get_running_loop()
+            try:
+                # generate_question 内部的重试等待是阻塞的，放到线程中执行，不阻塞其他指标
+                question_data = await loop.run_in_executor(
+                    executor, metrics.bind_stage(self.generate_question), tag, metric_name, metric_data)
+            except Exception as e:
+                logger.error(f"处理标签 {tag} 的指标 {metric_name} 时出错: {str(e)}")
+                return None
+        
+        question_data["basic_info"] = {
+            "tag": tag,
+            "application_count": tag_info.get("应用数量", 0),
+            "application_descriptions": tag_info.get("应用描述", [])
+        }
+        logger.info(f"已完成标签 {tag} 的指标: {metric_name}", extra=item(tag=tag, metric=metric_name))
+        return question_data
+
+    @staticmethod
+    def metric_definition_key(metric_name: str, metric_data: Dict[str, Any]) -> str:
+        """指标定义的键：指标名与内容完全相同（如去重后同簇标签共用的指标）时相同"""
+        return json.dumps([metric_name, metric_data], ensure_ascii=False, sort_keys=True)
+
+    @staticmethod
+    def load_tag_clusters(metrics_file: str) -> Dict[str, str]:
+        """读取指标生成阶段写出的 <指标文件>_clusters.json 中按标签名称聚类的结果，没有时返回空字典"""
+        clusters_file = os.path.splitext(metrics_file)[0] + "_clusters.json"
+        if not os.path.exists(clusters_file):
+            return {}
+        try:
+            with open(clusters_file, 'r', encoding='utf-8') as f:
+                return json.load(f).get("name_clusters", {})
+        except Exception as e:
+            logger.warning(f"读取标签聚类结果失败: {str(e)}", extra=fields(file=clusters_file))
+            return {}
+
+    async def generate_questions_for_all_tags_async(self, input_files: List[str], output_file: str,
+                                                    max_concurrency: int = 8, reuse_duplicates: bool = False,
+                                                    tag_clusters: Dict[str, str] = None) -> List[Dict[str, Any]]:
+        """并发为多个指标文件中所有 (标签, 指标) 生成问题
+
+        最多同时处理 max_concurrency 个指标，单个指标的慢速重试不会阻塞其他指标；
+        结果按 文件 → 标签 → 指标 的输入顺序保存。
+        reuse_duplicates=True 时，被标签去重（MetricGeneration.cluster_tags）合并到同一簇的标签之间，
+        定义完全相同的指标只生成一次问题，簇内其余标签复用该问题；未被合并的标签始终单独生成。
+        tag_clusters 为 标签 → 代表标签，未指定时读取各指标文件旁的 _clusters.json。
+        """
+        jobs = []
+        clusters = dict(tag_clusters or {})
+        for input_file in input_files:
+            logger.info(f"正在加载指标数据: {input_file}")
+            metrics_data = self.load_metrics(input_file)
+            if reuse_duplicates and tag_clusters is None:
+                clusters.update(self.load_tag_clusters(input_file))
+            for tag, evaluation_metrics, tag_info in self.iter_tag_metrics(metrics_data):
+                for metric_name, metric_data in evaluation_metrics.items():
+                    jobs.append((tag, metric_name, metric_data, tag_info))
+        
+        if not jobs:
+            logger.error("未能加载指标数据，程序退出")
+            return None
+        
+        # 同簇且定义相同的指标对应簇内首个出现它的任务
+        sources = {}
+        job_sources = []
+        for index, (tag, metric_name, metric_data, tag_info) in enumerate(jobs):
+            if reuse_duplicates:
+                # 未被合并的标签自成一簇，不与其他标签共用问题
+                key = (clusters.get(tag, tag), self.metric_definition_key(metric_name, metric_data))
+            else:
+                key = index
+            job_sources.append(sources.setdefault(key, index))
+        unique_jobs = sorted(set(job_sources))
+        
+        logger.info(f"共 {len(jobs)} 个指标（{len(unique_jobs)} 个不同定义），并发上限: {max_concurrency}")
+        semaphore = asyncio.Semaphore(max_concurrency)
+        with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+            unique_results = await asyncio.gather(*(
+                self._generate_question_async(semaphore, executor, *jobs[index])
+                for index in unique_jobs
+            ))
+        generated = dict(zip(unique_jobs, unique_results))
+        
+        results = []
+        for index, (tag, metric_name, metric_data, tag_info) in enumerate(jobs):
+            source = generated[job_sources[index]]
+            if source is None or job_sources[index] == index:
+                results.append(source)
+                continue
+            results.append(dict(source, category=tag, basic_info={
+                "tag": tag,
+                "application_count": tag_info.get("应用数量", 0),
+                "application_descriptions": tag_info.get("应用描述", [])
+            }))
+        if len(unique_jobs) < len(jobs):
+            metrics.increment("questions_reused_total", len(jobs) - len(unique_jobs))
+        processed_metrics = [result for result in results if result is not None]
+        
+        self.save_to_json(processed_metrics, output_file)
+        
+        logger.info(f"处理完成，共生成 {len(processed_metrics)}/{len(jobs)} 个问题",
+                    extra=fields(output_file=output_file))
+        
+        return processed_metrics
+
+    @metrics.staged("task")
+    def generate_questions_for_many_tags(self, inputs: List[str], output_file: str, max_concurrency: int = 8,
+                                         reuse_duplicates: bool = False) -> List[Dict[str, Any]]:
+        """并发模式入口：inputs 可以是指标文件或目录（目录下递归查找 *_metrics.json）"""
+        input_files = []
+        for path in inputs:
+            if os.path.isdir(path):
+                input_files.extend(sorted(glob.glob(os.path.join(path, "**", "*_metrics.json"), recursive=True)))
+            else:
+                input_files.append(path)
+        return asyncio.run(self.generate_questions_for_all_tags_async(input_files, output_file, max_concurrency,
+                                                                      reuse_duplicates=reuse_duplicates))
+
 def main():
     """主函数"""
     generator = QuestionGenerator()
@@ -283,8 +372,15 @@ def main():
     input_file = "../data/tag_metrics.json"
     output_file = "../data/output/tag_evaluation_questions.json"
     
-    # 生成问题
-    generator.generate_questions_for_all_tags(input_file, output_file)
+    # 生成问题；设置 LAQUAL_QUESTION_CONCURRENCY 时并发生成
+    max_concurrency = int(os.getenv('LAQUAL_QUESTION_CONCURRENCY', '0'))
+    # LAQUAL_QUESTION_REUSE=1 时，标签去重合并的同簇标签共用问题（仅并发模式）
+    reuse_duplicates = (os.getenv('LAQUAL_QUESTION_REUSE') or '').lower() in ('1', 'true', 'yes')
+    if max_concurrency > 0:
+        generator.generate_questions_for_many_tags([input_file], output_file, max_concurrency,
+                                                   reuse_duplicates=reuse_duplicates)
+    else:
+        generator.generate_questions_for_all_tags(input_file, output_file)
 
 if __name__ == "__main__":
     main()
@@ -5,63 +5,221 @@ LaQual - Metric_generation
 日期：2025-01-27
 """
 
+import glob
 import json
 import os
 from collections import Counter, defaultdict
-from typing import Dict, List, Set, Tuple
-import requests
-import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Dict, List, Set, Tuple
 import sys
-from sentence_transformers import SentenceTransformer, util
-import torch
 import re
+from embedding_store import EmbeddingStore, get_embedding_store
+from instrumentation import metrics
+from siliconflow_client import SiliconFlowClient, get_client
+from storage import read_records, save_tag_metrics
+from structured_logging import fields, get_logger, item
+from similarity_model import SimilarityModelMixin
 
-SILICONFLOW_API_KEY = os.getenv('SILICONFLOW_API_KEY') or 'your_api_key_here'
-SILICONFLOW_API_URL = os.getenv('SILICONFLOW_API_URL') or 'https://api.siliconflow.cn/v1/chat/completions'
+logger = get_logger("metric_generation")
 
-class MetricGeneration:
-    def __init__(self):
+# 去重阈值：标签名称向量的余弦相似度 / 两组指标描述的平均最佳匹配相似度
+TAG_DEDUP_THRESHOLD = 0.9
+METRIC_SET_DEDUP_THRESHOLD = 0.95
+
+
+def greedy_clusters(similarity: List[List[float]], threshold: float) -> List[int]:
+    """按输入顺序贪心聚类，返回每一项所属簇的代表项下标
+
+    每一项并入第一个与之相似度不低于 threshold 的代表项，否则自成一簇；
+    只与代表项比较，避免 A≈B、B≈C 时把不相似的 A、C 链接到一起。
+    """
+    representatives = []
+    assignment = []
+    for index, row in enumerate(similarity):
+        representative = next((rep for rep in representatives if row[rep] >= threshold), None)
+        if representative is None:
+            representatives.append(index)
+            representative = index
+        assignment.append(representative)
+    return assignment
+
+class MetricGeneration(SimilarityModelMixin):
+    def __init__(self, client: SiliconFlowClient = None, embedding_store: EmbeddingStore = None):
+        """embedding_store 为去重时使用的向量库；未指定且使用共享相似度模型时使用共享向量库"""
         self.data = None
         self.tags = defaultdict(lambda: {
             "apps": [],
             "count": 0
         })
-        # API配置
-        self.api_url = SILICONFLOW_API_URL
-        self.headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {SILICONFLOW_API_KEY}"
-        }
+        # API客户端
+        self.client = client or get_client()
+        # 最近一次生成指标时的 标签 → 代表标签（去重后同簇标签共用代表标签的指标）
+        self.tag_clusters = {}
         
-        # 加载相似度模型
-        print("正在加载中文相似度模型...")
-        try:
-            # 设置本地缓存目录
-            cache_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "model_cache")
-            os.makedirs(cache_dir, exist_ok=True)
-            
-            # 使用专门的中文预训练模型
-            self.similarity_model = SentenceTransformer(
-                'shibing624/text2vec-base-chinese',
-                cache_folder=cache_dir,
-                local_files_only=True  # 只使用本地文件
-            )
-            print("中文相似度模型加载成功（使用本地缓存）")
-        except Exception as e:
-            print(f"本地模型加载失败: {str(e)}")
+        self.embedding_store = embedding_store
+
+    def _encode_normalized(self, texts: List[str]):
+        """批量编码并做 L2 归一化；相似度模型不可用时返回 None"""
+        model = self.similarity_model
+        if model is None or not texts:
+            return None
+        import torch
+        store = self.embedding_store
+        if store is None and self.uses_shared_similarity_model:
+            store = get_embedding_store()
+        if store is not None:
+            # 向量库中的向量已归一化
+            return torch.from_numpy(store.encode(texts, model, kind="metric_dedup"))
+        with metrics.timer("embedding_encode_seconds", kind="metric_dedup"):
+            embeddings = model.encode(texts, convert_to_tensor=True)
+        return torch.nn.functional.normalize(embeddings.float(), dim=-1)
+
+    def cluster_tags(self, tags: List[str], threshold: float = TAG_DEDUP_THRESHOLD) -> Dict[str, str]:
+        """按标签名称的语义相似度聚类，返回 标签 → 代表标签（tags 中靠前的标签优先作为代表）"""
+        embeddings = self._encode_normalized(tags)
+        if embeddings is None:
+            logger.warning("相似度模型未加载，跳过标签去重")
+            return {tag: tag for tag in tags}
+        similarity = (embeddings @ embeddings.T).tolist()
+        return {tag: tags[rep] for tag, rep in zip(tags, greedy_clusters(similarity, threshold))}
+
+    def cluster_metric_sets(self, all_metrics: Dict[str, Dict],
+                            threshold: float = METRIC_SET_DEDUP_THRESHOLD) -> Dict[str, str]:
+        """按指标描述聚类内容几乎相同的指标集，返回 标签 → 代表标签
+
+        所有指标描述一次批量编码；两组指标的相似度为双向“每个描述与对方最相近描述”的平均相似度。
+        描述相似度矩阵只计算一次，再按所属标签分组取最大值、求平均，得到整个标签相似度矩阵。
+        """
+        tags = list(all_metrics)
+        descriptions, owners = [], []
+        for index, tag in enumerate(tags):
+            for metric in all_metrics[tag].values():
+                descriptions.append(metric.get("描述", "") if isinstance(metric, dict) else str(metric))
+                owners.append(index)
+        
+        embeddings = self._encode_normalized(descriptions)
+        if embeddings is None:
+            logger.warning("相似度模型未加载，跳过指标集去重")
+            return {tag: tag for tag in tags}
+        import torch
+        description_similarity = embeddings @ embeddings.T
+        
+        # best[d, t]：描述 d 与标签 t 的各描述的最大相似度
+        owner = torch.tensor(owners, dtype=torch.long, device=description_similarity.device)
+        best = torch.full((len(descriptions), len(tags)), float("-inf"),
+                          dtype=description_similarity.dtype, device=description_similarity.device)
+        best.scatter_reduce_(1, owner.expand(len(descriptions), -1), description_similarity, reduce="amax")
+        # mean_best[a, b]：标签 a 的各描述与标签 b 最相近描述的平均相似度
+        counts = torch.bincount(owner, minlength=len(tags)).to(best.dtype)
+        mean_best = torch.zeros((len(tags), len(tags)), dtype=best.dtype, device=best.device)
+        mean_best.index_add_(0, owner, best)
+        mean_best /= counts.clamp(min=1).unsqueeze(1)
+        
+        similarity = (mean_best + mean_best.T) / 2
+        # 没有指标描述的标签与其他标签不相似
+        empty = counts == 0
+        similarity[empty, :] = 0.0
+        similarity[:, empty] = 0.0
+        similarity.fill_diagonal_(1.0)
+        return {tag: tags[rep] for tag, rep in zip(tags, greedy_clusters(similarity.tolist(), threshold))}
+
+    def _add_tag_record(self, record: Dict[str, Any]):
+        """登记一条标签记录（标签生成结果或 *_metrics.json 文件）"""
+        tag = str(record.get("标签", "")).strip()
+        if not tag:
+            return
+        descriptions = record.get("应用描述", [])
+        self.tags[tag]["apps"].extend({"description": description} for description in descriptions)
+        self.tags[tag]["count"] += record.get("应用数量", len(descriptions))
+
+    def _add_app(self, app: Dict[str, Any], tag: str = None):
+        """按标签登记一个应用（标签取自参数或应用的“标签”字段）"""
+        tag_value = tag if tag is not None else app.get("标签", "")
+        tags = tag_value if isinstance(tag_value, list) else [tag_value]
+        for tag in tags:
+            tag = str(tag).strip() if tag is not None else ""
+            if not tag:
+                continue
+            self.tags[tag]["apps"].append(app)
+            self.tags[tag]["count"] += 1
+
+    def load_data(self, path: str, exclude_dirs: List[str] = None) -> bool:
+        """加载标签数据并一次性按标签分组应用
+
+        path 可以是：
+        - 目录：递归读取其中的标签文件（如 data/*/…_metrics.json，包含 标签 / 应用数量 / 应用描述），
+          跳过 exclude_dirs 下的文件（如本阶段的输出目录）和标签聚类结果文件 *_clusters.json；
+        - 按标签分组的应用文件：{标签: [应用, ...]}；
+        - 应用列表：每个应用带“标签”字段（字符串或列表）；
+        - 单条或多条标签记录（列表，或 流水线 labels.json 形式的 {分组: 标签记录}）。
+        单个文件的格式由扩展名决定（JSON / JSONL(.gz/.zst) / Parquet / Arrow）。
+        """
+        if os.path.isdir(path):
+            excluded = [os.path.abspath(directory) for directory in exclude_dirs or []]
+            files = [
+                file_path for file_path in sorted(glob.glob(os.path.join(path, "**", "*.json"), recursive=True))
+                if not file_path.endswith("_clusters.json")
+                and not any(os.path.commonpath([os.path.abspath(file_path), directory]) == directory
+                            for directory in excluded)
+            ]
+        else:
+            files = [path]
+
+        self.data = []
+        self.tags.clear()
+        for file_path in files:
             try:
-                # 如果本地加载失败，尝试在线下载
-                print("尝试在线下载中文模型...")
-                self.similarity_model = SentenceTransformer(
-                    'shibing624/text2vec-base-chinese',
-                    cache_folder=cache_dir
-                )
-                print("中文相似度模型下载并加载成功")
+                data = read_records(file_path)
             except Exception as e:
-                print(f"模型加载失败: {str(e)}")
-                print("将跳过相似度验证")
-                self.similarity_model = None
-        
+                logger.error(f"加载数据失败: {str(e)}", extra=fields(file=file_path))
+                if len(files) == 1:
+                    return False
+                continue
+            self.data.append(data)
+
+            if isinstance(data, dict) and "标签" in data:
+                self._add_tag_record(data)
+            elif isinstance(data, dict):
+                for key, value in data.items():
+                    if isinstance(value, list):
+                        for app in value:
+                            if isinstance(app, dict):
+                                self._add_app(app, key)
+                    elif isinstance(value, dict) and "标签" in value:
+                        self._add_tag_record(value)
+            elif isinstance(data, list):
+                for entry in data:
+                    if not isinstance(entry, dict):
+                        continue
+                    if "应用描述" in entry and "标签" in entry:
+                        self._add_tag_record(entry)
+                    else:
+                        self._add_app(entry)
+
+        if not self.tags:
+            logger.error("未在数据中找到任何标签", extra=fields(path=path))
+            return False
+
+        logger.info(f"数据加载完成，共 {len(self.tags)} 个标签", extra=fields(path=path, files=len(files)))
+        return True
+
+    def analyze_all_tags(self) -> Dict[str, Any]:
+        """统计所有标签的应用数量，按数量从多到少排列"""
+        all_tags = [
+            {"标签名称": tag, "应用数量": info["count"]}
+            for tag, info in sorted(self.tags.items(), key=lambda entry: -entry[1]["count"])
+        ]
+        return {
+            "标签总数": len(all_tags),
+            "应用总数": sum(tag_info["应用数量"] for tag_info in all_tags),
+            "all_tags": all_tags
+        }
+
+    @staticmethod
+    def tag_file_name(tag: str) -> str:
+        """单个标签结果文件名（去掉路径分隔符等不能出现在文件名中的字符）"""
+        return re.sub(r'[\\/:*?"<>|\s]+', '_', tag) + "_metrics.json"
+
     def generate_metrics_prompt_for_tag(self, tag: str) -> str:
         original_tag = tag
             
@@ -123,11 +281,7 @@ class MetricGeneration:
         }
         
         try:
-            response = requests.post(self.api_url, headers=self.headers, json=data, timeout=30)
-            response.raise_for_status()
-            
-            result = response.json()
-            content = result['choices'][0]['message']['content']
+            content = self.client.chat(data, timeout=30)
             
             # 尝试解析JSON
             try:
@@ -139,63 +293,169 @@ class MetricGeneration:
                     metrics = json.loads(json_content)
                     return metrics
                 else:
-                    print(f"无法找到JSON内容: {content}")
+                    logger.warning("无法找到JSON内容", extra=fields(tag=tag, content=content))
+                    self.client.invalidate(data)
                     return {}
             except json.JSONDecodeError as e:
-                print(f"JSON解析失败: {str(e)}")
-                print(f"原始内容: {content}")
+                logger.warning(f"JSON解析失败: {str(e)}", extra=fields(tag=tag, content=content))
+                self.client.invalidate(data)
                 return {}
                 
         except Exception as e:
-            print(f"API调用失败: {str(e)}")
+            logger.error(f"API调用失败: {str(e)}", extra=fields(tag=tag))
             return {}
 
-    def generate_metrics_for_all_tags(self, output_file: str = None):
-        """为所有标签生成指标"""
+    def _save_tag_metrics(self, tag: str, tag_metrics: Dict, output_dir: str):
+        """写出单个标签的结果文件（格式与 data/*/…_metrics.json 相同）"""
+        descriptions = [app.get("description", "") for app in self.tags[tag]["apps"]]
+        tag_file = os.path.join(output_dir, self.tag_file_name(tag))
+        temp_file = tag_file + ".tmp"
+        with open(temp_file, 'w', encoding='utf-8') as f:
+            json.dump({
+                "标签": tag,
+                "应用数量": self.tags[tag]["count"],
+                "应用描述": [description for description in descriptions if description],
+                "评估指标": tag_metrics
+            }, f, ensure_ascii=False, indent=2)
+        os.replace(temp_file, tag_file)
+
+    def _load_tag_metrics(self, tag: str, output_dir: str) -> Dict:
+        """读取已写出的单个标签结果（不存在或无效时返回空字典）"""
+        tag_file = os.path.join(output_dir, self.tag_file_name(tag))
+        if not os.path.exists(tag_file):
+            return {}
+        try:
+            with open(tag_file, 'r', encoding='utf-8') as f:
+                return json.load(f).get("评估指标") or {}
+        except Exception as e:
+            logger.warning(f"读取已有指标失败: {str(e)}", extra=fields(file=tag_file))
+            return {}
+
+    @metrics.staged("metric")
+    def generate_metrics_for_all_tags(self, output_file: str = None, output_dir: str = None,
+                                      max_workers: int = 8, resume: bool = True,
+                                      dedupe_threshold: float = None, metric_dedupe_threshold: float = None):
+        """为所有标签并发生成指标
+
+        最多同时为 max_workers 个标签调用API；每个标签完成后立即写出 output_dir 下的单标签文件，
+        resume=True 时直接复用 output_dir 中已有的结果，中断后重新运行只处理剩余标签。
+        全部完成后按标签应用数量顺序写出汇总文件 output_file。
+        
+        指定 dedupe_threshold 时先按标签名称聚类近似重复的标签，每簇只为代表标签（应用最多者）生成指标；
+        指定 metric_dedupe_threshold 时再按指标描述合并内容几乎相同的指标集。
+        同簇标签共用同一组指标（汇总文件中内容完全相同）；
+        标签 → 代表标签的对应关系保存在 self.tag_clusters 和 <output_file>_clusters.json 中
+        （文件中 name_clusters 为只按标签名称聚类的结果，问题生成阶段可据此在同簇标签之间复用问题）。
+        """
         if not self.data:
-            print("请先加载数据")
+            logger.error("请先加载数据")
             return
         
         all_tags_analysis = self.analyze_all_tags()
-        all_metrics = {}
+        tags = [tag_info["标签名称"] for tag_info in all_tags_analysis["all_tags"]]
+        results = {}
+        clusters = self.cluster_tags(tags, dedupe_threshold) if dedupe_threshold else {tag: tag for tag in tags}
+        name_clusters = dict(clusters)
+        members = defaultdict(list)
+        for tag in tags:
+            members[clusters[tag]].append(tag)
         
-        for tag_info in all_tags_analysis["all_tags"]:
-            tag = tag_info["标签名称"]
-            print(f"正在为标签 '{tag}' 生成指标...")
-            
-            metrics = self.call_api_for_metrics_for_tag(tag)
-            if metrics:
-                all_metrics[tag] = metrics
-                print(f"✅ 成功为标签 '{tag}' 生成指标")
-            else:
-                print(f"❌ 为标签 '{tag}' 生成指标失败")
-            
-            # 添加延迟避免API限制
-            time.sleep(1)
+        if output_dir:
+            os.makedirs(output_dir, exist_ok=True)
+            if resume:
+                for tag in tags:
+                    tag_metrics = self._load_tag_metrics(tag, output_dir)
+                    if tag_metrics:
+                        results[tag] = tag_metrics
+                if results:
+                    logger.info(f"复用 {len(results)} 个标签的已有指标", extra=fields(output_dir=output_dir))
+        
+        pending = [tag for tag in members if tag not in results]
+        logger.info(f"共 {len(tags)} 个标签（{len(members)} 个簇），待生成 {len(pending)} 个，并发上限: {max_workers}")
+        
+        with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+            call = metrics.bind_stage(self.call_api_for_metrics_for_tag)
+            futures = {executor.submit(call, tag): tag for tag in pending}
+            for future in as_completed(futures):
+                tag = futures[future]
+                tag_metrics = future.result()
+                if not tag_metrics:
+                    logger.warning(f"为标签 '{tag}' 生成指标失败", extra=fields(tag=tag))
+                    continue
+                for member in members[tag]:
+                    results[member] = tag_metrics
+                    if output_dir:
+                        self._save_tag_metrics(member, tag_metrics, output_dir)
+                logger.info(f"成功为标签 '{tag}' 生成指标", extra=item(tag=tag, cluster_size=len(members[tag])))
+        
+        # 续跑时已有结果的簇成员同样改为共用代表标签的指标
+        for tag in tags:
+            representative = clusters[tag]
+            if representative in results and results.get(tag) != results[representative]:
+                results[tag] = results[representative]
+                if output_dir:
+                    self._save_tag_metrics(tag, results[tag], output_dir)
+        
+        if metric_dedupe_threshold:
+            representatives = {tag: results[tag] for tag in members if tag in results}
+            metric_clusters = self.cluster_metric_sets(representatives, metric_dedupe_threshold)
+            for tag in tags:
+                representative = metric_clusters.get(clusters[tag])
+                if representative is None:
+                    continue
+                clusters[tag] = representative
+                if results[tag] != results[representative]:
+                    results[tag] = results[representative]
+                    if output_dir:
+                        self._save_tag_metrics(tag, results[tag], output_dir)
+        
+        self.tag_clusters = clusters
+        all_metrics = {tag: results[tag] for tag in tags if tag in results}
         
         # 保存结果
         if output_file is None:
             output_file = "../data/tag_metrics.json"
         
-        os.makedirs(os.path.dirname(output_file), exist_ok=True)
-        with open(output_file, 'w', encoding='utf-8') as f:
-            json.dump(all_metrics, f, ensure_ascii=False, indent=2)
+        with metrics.timer("report_write_seconds", report="tag_metrics"):
+            save_tag_metrics(all_metrics, output_file)
+        
+        if dedupe_threshold or metric_dedupe_threshold:
+            merged = sum(1 for tag in tags if clusters[tag] != tag)
+            metrics.increment("metric_dedup_tags_merged_total", merged)
+            clusters_file = os.path.splitext(output_file)[0] + "_clusters.json"
+            with open(clusters_file, 'w', encoding='utf-8') as f:
+                # name_clusters 为按标签名称聚类的结果（问题生成阶段据此复用问题），clusters 另含指标集合并
+                json.dump({"name_clusters": name_clusters, "clusters": clusters}, f, ensure_ascii=False, indent=2)
+            logger.info(f"标签去重完成，{merged} 个标签复用了其他标签的指标",
+                        extra=fields(clusters=len(set(clusters.values())), clusters_file=clusters_file))
         
-        print(f"✅ 所有指标已保存到: {output_file}")
+        logger.info(f"所有指标已保存到: {output_file}", extra=fields(tags=len(all_metrics)))
         return all_metrics
 
 def main():
     """主函数"""
     generator = MetricGeneration()
+    output_dir = "../data/tag_metrics"
     
-    # 加载数据
-    data_file = "../data/apps_by_tags.json"
-    if not generator.load_data(data_file):
-        print("数据加载失败，程序退出")
+    # 加载数据（也可以是包含各标签文件的目录，跳过本阶段的输出目录）
+    data_file = os.getenv('LAQUAL_METRIC_INPUT') or "../data/apps_by_tags.json"
+    if not generator.load_data(data_file, exclude_dirs=[output_dir]):
+        logger.error("数据加载失败，程序退出")
         return
     
+    # 并发生成指标的标签数
+    max_workers = int(os.getenv('LAQUAL_METRIC_CONCURRENCY') or 8)
+    
+    # 近似重复标签的去重阈值（未设置时不去重）
+    dedupe_threshold = float(os.getenv('LAQUAL_TAG_DEDUP_THRESHOLD') or 0) or None
+    
+    # 指标集去重阈值（未设置时不去重；与标签去重分别开启），推荐值为 METRIC_SET_DEDUP_THRESHOLD
+    metric_dedupe_threshold = float(os.getenv('LAQUAL_METRIC_SET_DEDUP_THRESHOLD') or 0) or None
+    
     # 生成指标
-    generator.generate_metrics_for_all_tags()
+    generator.generate_metrics_for_all_tags(output_dir=output_dir, max_workers=max_workers,
+                                            dedupe_threshold=dedupe_threshold,
+                                            metric_dedupe_threshold=metric_dedupe_threshold)
 
 if __name__ == "__main__":
     main()
@@ -5,27 +5,161 @@ LaQual - Response_quality_evaluation
 日期：2025-01-27
 """
 
+import argparse
+import hashlib
 import json
 import os
 from typing import List, Dict, Any
-import requests
 from datetime import datetime
-import time
 import re
+import statistics
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from instrumentation import metrics
+from siliconflow_client import SiliconFlowAPIError, SiliconFlowClient, SiliconFlowTimeoutError, get_client
+from storage import is_columnar, load_tag_metrics, read_records, write_records
+from structured_logging import fields, get_logger, item
 
-# API配置
-SILICONFLOW_API_KEY = os.getenv('SILICONFLOW_API_KEY') or 'your_api_key_here'
-SILICONFLOW_API_URL = os.getenv('SILICONFLOW_API_URL') or 'https://api.siliconflow.cn/v1/chat/completions'
+logger = get_logger("response_evaluation")
 
-class ResponseEvaluator:
-    def __init__(self):
-        """初始化评估器"""
-        self.api_key = SILICONFLOW_API_KEY
-        self.api_url = SILICONFLOW_API_URL
-        self.headers = {
-            "Authorization": f"Bearer {self.api_key}",
-            "Content-Type": "application/json"
+def evaluation_rows(app_evaluations: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """把逐应用的评估结果展开为每个 evaluation_detail 一行（列式格式输出用）
+
+    应用级字段加 app_ 前缀，performance_metrics 展开为 performance_ 前缀的列。
+    """
+    rows = []
+    for evaluation in app_evaluations:
+        app_fields = {
+            "app_name": evaluation["app_name"],
+            "app_url": evaluation["app_url"],
+            "app_total_score": evaluation["total_score"],
+            "app_content_score": evaluation["content_score"],
+            "app_performance_score": evaluation["performance_score"],
         }
+        for detail in evaluation["evaluation_details"]:
+            row = dict(app_fields)
+            for key, value in detail.items():
+                if key == "performance_metrics":
+                    row.update({f"performance_{name}": metric for name, metric in value.items()})
+                else:
+                    row[key] = value
+            rows.append(row)
+    return rows
+
+class EvaluationJournal:
+    """评估断点日志：以追加方式（JSONL）记录已完成的 evaluation_detail，用于中断后续跑"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.completed = {}
+        self._lock = threading.Lock()
+        self._needs_newline = False
+        self._load()
+
+    def _load(self):
+        """读取已有日志，忽略中断时写了一半的最后一行"""
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                # 最后一行未写完整时，下一条记录需另起一行
+                self._needs_newline = not line.endswith("\n")
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    logger.warning(f"跳过无法解析的断点记录: {line[:50]}...")
+                    continue
+                self.completed[record['key']] = record['detail']
+
+    @staticmethod
+    def make_key(task: Dict[str, Any]) -> str:
+        """(应用, 标签, 指标, 问题) 加上 问题文本、回答和评分标准的哈希唯一确定一条评估记录
+
+        问题或回答重新生成后名称不变、内容变化，哈希不同，不会复用旧的评估。
+        """
+        content = json.dumps([task['question'], task['response'], task['metric_criteria']], ensure_ascii=False)
+        return json.dumps([
+            task['app_index'], task['app_name'], task['app_url'],
+            task['tag'], task['metric_name'], task['question_name'],
+            hashlib.sha1(content.encode('utf-8')).hexdigest()
+        ], ensure_ascii=False)
+
+    def get(self, key: str):
+        return self.completed.get(key)
+
+    def record(self, key: str, detail: Dict[str, Any]):
+        """追加一条记录并立即落盘"""
+        line = json.dumps({"key": key, "detail": detail}, ensure_ascii=False)
+        with self._lock:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(self.path, 'a', encoding='utf-8') as f:
+                if self._needs_newline:
+                    f.write("\n")
+                    self._needs_newline = False
+                f.write(line + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            self.completed[key] = detail
+
+    def complete(self):
+        """批次成功完成后把日志轮转为 <path>.done，下次运行从头开始"""
+        with self._lock:
+            if os.path.exists(self.path):
+                os.replace(self.path, self.path + ".done")
+            self.completed = {}
+
+# 评估结果中必须包含的段落，及每个段落至少需要的要点数
+EVALUATION_SECTIONS = ["优点：", "不足：", "改进建议："]
+MIN_SECTION_ITEMS = 2
+
+
+def is_evaluation_complete(text: str) -> bool:
+    """判断（流式输出中的）评估文本是否已包含分数和全部必需段落
+
+    最后一个段落需已有 MIN_SECTION_ITEMS 条以换行结束的要点，之后的输出不再需要。
+    """
+    if not re.search(r'分数：\s*\d+(?:\.\d+)?\s*\n', text):
+        return False
+    positions = [text.find(section) for section in EVALUATION_SECTIONS]
+    if min(positions) < 0:
+        return False
+    last_section = text[max(positions):]
+    return len(re.findall(r'^\s*[-•]\s*\S.*\n', last_section, re.MULTILINE)) >= MIN_SECTION_ITEMS
+
+def extract_score(text: str):
+    """从评估文本中提取1-5之间的分数，文本不完整或没有分数时返回 None"""
+    if len(text) < 50 or "分数：" not in text:
+        return None
+    score_match = re.search(r'分数：(\d+(?:\.\d+)?)', text)
+    if not score_match:
+        return None
+    return min(max(float(score_match.group(1)), 1), 5)
+
+class ResponseEvaluator:
+    def __init__(self, client: SiliconFlowClient = None, stream_judge: bool = False,
+                 judge_samples: int = 1, samples_per_call: int = 3,
+                 agreement_tolerance: float = 1.0, sample_temperature: float = 0.7,
+                 reuse_judgements: bool = False):
+        """初始化评估器
+
+        stream_judge=True 时以流式方式调用评估模型，分数和各段落齐全后立即停止生成（默认关闭）。
+        judge_samples > 1 时启用多样本投票：每次调用请求 samples_per_call 个样本（payload 中的 n），
+        已有样本的分数极差不超过 agreement_tolerance 时不再追加调用，最多采样 judge_samples 个。
+        reuse_judgements=True 时，同一批次内问题、回答和评分标准完全相同的任务只调用一次评估模型
+        （只复用评估成功的结果，失败的任务各自重新评估）。
+        """
+        self.client = client or get_client()
+        self.stream_judge = stream_judge
+        self.judge_samples = judge_samples
+        self.samples_per_call = samples_per_call
+        self.agreement_tolerance = agreement_tolerance
+        self.sample_temperature = sample_temperature
+        self.reuse_judgements = reuse_judgements
         
         # 性能评估阈值
         self.performance_thresholds = {
@@ -48,9 +182,14 @@ class ResponseEvaluator:
             "content_score": 0.8,    # 内容评分权重
             "performance_score": 0.2  # 性能评分权重
         }
+        
+        # 批次内成功的内容评估结果（reuse_judgements=True 时使用）
+        self._judge_results = {}
+        self._judge_lock = threading.Lock()
 
-    def evaluate_response(self, question: str, response: str, scoring_criteria: List[str]) -> Dict[str, Any]:
-        """使用LLM API评估单个响应的质量"""
+    def _build_judge_payload(self, question: str, response: str, scoring_criteria: List[str],
+                             n: int = 1, temperature: float = 0) -> Dict[str, Any]:
+        """构造评估模型的请求体"""
         prompt = f"""请根据以下评分标准对回答进行详细评估：
 
 问题：{question}
@@ -71,83 +210,55 @@ class ResponseEvaluator:
 
 请确保评估客观、专业，并严格遵循评分标准。"""
 
-        max_retries = 20  # 增加最大重试次数，确保多次评估直至成功
-        retry_delay = 5
+        return {
+            "model": "Qwen/QwQ-32B",
+            "messages": [
+                {
+                    "role": "system",
+                    "content": "你是一个专业的评估专家，负责评估AI助手的回答质量。请根据评分标准给出1-5分的评分，并提供详细的评估理由和改进建议。"
+                },
+                {
+                    "role": "user",
+                    "content": prompt
+                }
+            ],
+            "stream": False,
+            "max_tokens": 5000,
+            "temperature": temperature,
+            "top_p": 0.7,
+            "top_k": 50,
+            "frequency_penalty": 0.5,
+            "n": n,
+            "response_format": {"type": "text"}
+        }
+
+    def evaluate_response(self, question: str, response: str, scoring_criteria: List[str]) -> Dict[str, Any]:
+        """使用LLM API评估单个响应的质量"""
+        if self.judge_samples > 1:
+            return self.evaluate_response_voting(question, response, scoring_criteria)
+
+        # 只在评估内容不可用（不完整或无法提取分数）时重新请求；
+        # 超时、连接错误、429 和 5xx 由客户端统一退避重试，重试耗尽后直接判为评估失败
+        max_retries = 20
         timeout = 60  # 增加超时时间到60秒
 
         for attempt in range(max_retries):
             try:
-                payload = {
-                    "model": "Qwen/QwQ-32B",
-                    "messages": [
-                        {
-                            "role": "system",
-                            "content": "你是一个专业的评估专家，负责评估AI助手的回答质量。请根据评分标准给出1-5分的评分，并提供详细的评估理由和改进建议。"
-                        },
-                        {
-                            "role": "user",
-                            "content": prompt
-                        }
-                    ],
-                    "stream": False,
-                    "max_tokens": 5000,
-                    "temperature": 0,
-                    "top_p": 0.7,
-                    "top_k": 50,
-                    "frequency_penalty": 0.5,
-                    "n": 1,
-                    "response_format": {"type": "text"}
-                }
-                
-                print(f"正在尝试第 {attempt + 1} 次评估...")
-                response = requests.post(
-                    self.api_url,
-                    headers=self.headers,
-                    json=payload,
-                    timeout=timeout
-                )
-            
-                if response.status_code == 400:
-                    print("API请求格式错误，请检查请求参数")
-                    print(f"错误详情: {response.text}")
-                    if attempt < max_retries - 1:
-                        time.sleep(retry_delay)
-                        continue
-                    return {"score": 0, "evaluation": "评估失败"}
-                elif response.status_code == 401:
-                    print("API密钥无效或未授权")
-                    return {"score": 0, "evaluation": "评估失败"}
-                elif response.status_code == 429:
-                    print("API调用频率超限，请稍后重试")
-                    if attempt < max_retries - 1:
-                        time.sleep(retry_delay * 2)  # 对于频率限制，等待更长时间
-                        continue
-                    return {"score": 0, "evaluation": "评估失败"}
-                elif response.status_code != 200:
-                    print(f"API调用失败，状态码: {response.status_code}")
-                    print(f"错误详情: {response.text}")
-                    if attempt < max_retries - 1:
-                        time.sleep(retry_delay)
-                        continue
-                    return {"score": 0, "evaluation": "评估失败"}
+                payload = self._build_judge_payload(question, response, scoring_criteria)
                 
-                response.raise_for_status()
-                result = response.json()
-                
-                if 'choices' not in result or not result['choices']:
-                    print("API返回数据格式错误")
-                    if attempt < max_retries - 1:
-                        time.sleep(retry_delay)
-                        continue
-                    return {"score": 0, "evaluation": "评估失败"}
-                    
-                evaluation_text = result['choices'][0]['message']['content'].strip()
+                logger.info(f"正在尝试第 {attempt + 1} 次评估...", extra=item(attempt=attempt + 1))
+                if self.stream_judge:
+                    evaluation_text = self.client.stream_chat_completion(
+                        payload, timeout=timeout, refresh=attempt > 0,
+                        stop_when=is_evaluation_complete
+                    ).content.strip()
+                else:
+                    evaluation_text = self.client.chat(payload, timeout=timeout, refresh=attempt > 0).strip()
                 
                 # 验证响应是否完整
                 if len(evaluation_text) < 50 or "分数：" not in evaluation_text:
-                    print("响应内容不完整，正在重试...")
+                    logger.warning("响应内容不完整，正在重试...", extra=fields(attempt=attempt + 1))
                     if attempt < max_retries - 1:
-                        time.sleep(retry_delay)
                         continue
                     return {"score": 0, "evaluation": "评估失败：响应不完整"}
                 
@@ -161,62 +272,138 @@ class ResponseEvaluator:
                         "evaluation": evaluation_text
                     }
                 else:
-                    print("未能从响应中提取分数")
+                    logger.warning("未能从响应中提取分数", extra=fields(attempt=attempt + 1))
                     if attempt < max_retries - 1:
-                        time.sleep(retry_delay)
                         continue
                     return {"score": 0, "evaluation": "评估失败"}
                     
-            except requests.exceptions.Timeout:
-                print(f"请求超时（{timeout}秒），正在重试...")
-                if attempt < max_retries - 1:
-                    time.sleep(retry_delay)
-                    continue
+            except SiliconFlowTimeoutError:
+                logger.warning(f"请求超时（{timeout}秒），客户端重试已用尽", extra=fields(attempt=attempt + 1))
                 return {"score": 0, "evaluation": "评估超时"}
-            except requests.exceptions.RequestException as e:
-                print(f"API请求错误: {str(e)}")
-                if hasattr(e.response, 'text'):
-                    print(f"错误详情: {e.response.text}")
-                if attempt < max_retries - 1:
-                    time.sleep(retry_delay)
+            except SiliconFlowAPIError as e:
+                logger.warning(f"API请求错误: {str(e)}", extra=fields(attempt=attempt + 1, status_code=e.status_code,
+                                                                    response_text=e.response_text))
+                if e.is_content_error and attempt < max_retries - 1:
                     continue
                 return {"score": 0, "evaluation": "评估失败"}
             except Exception as e:
-                print(f"评估出错: {str(e)}")
-                if attempt < max_retries - 1:
-                    time.sleep(retry_delay)
-                    continue
+                logger.warning(f"评估出错: {str(e)}", extra=fields(attempt=attempt + 1))
                 return {"score": 0, "evaluation": "评估失败"}
         
         return {"score": 0, "evaluation": "评估失败，已达到最大重试次数"}
 
+    def evaluate_response_voting(self, question: str, response: str, scoring_criteria: List[str]) -> Dict[str, Any]:
+        """多样本投票评估：一次调用获取多个评估样本，取分数中位数并报告均值与方差
+
+        样本分数达成一致（极差不超过 agreement_tolerance）后提前停止采样；
+        返回的 evaluation 为分数最接近中位数的样本文本。
+        """
+        # 连续 max_failures 次采样没有可用结果时停止；API错误已由客户端重试过，直接停止
+        max_failures = 3
+        timeout = 60
+
+        samples = []
+        calls = 0
+        failures = 0
+        agreed = False
+        while len(samples) < self.judge_samples and failures < max_failures:
+            n = min(self.samples_per_call, self.judge_samples - len(samples))
+            payload = self._build_judge_payload(question, response, scoring_criteria,
+                                                n=n, temperature=self.sample_temperature)
+            logger.info(f"正在进行第 {calls + 1} 次采样评估（{n} 个样本）...", extra=item())
+            try:
+                # 追加采样的请求体与首次相同，需跳过缓存才能得到新样本
+                result = self.client.create_chat_completion(payload, timeout=timeout, refresh=calls > 0)
+            except SiliconFlowAPIError as e:
+                logger.warning(f"API请求错误: {str(e)}", extra=fields(status_code=e.status_code))
+                if not e.is_content_error:
+                    break
+                failures += 1
+                continue
+            calls += 1
+
+            valid = 0
+            for choice in result['choices']:
+                text = ((choice.get('message') or {}).get('content') or "").strip()
+                score = extract_score(text)
+                if score is not None:
+                    samples.append((score, text))
+                    valid += 1
+            if not valid:
+                logger.warning("本次采样没有可用的评估结果")
+                failures += 1
+
+            scores = [score for score, _ in samples]
+            if len(scores) >= 2 and max(scores) - min(scores) <= self.agreement_tolerance:
+                agreed = True
+                break
+
+        if not samples:
+            return {"score": 0, "evaluation": "评估失败"}
+
+        scores = [score for score, _ in samples]
+        median = statistics.median(scores)
+        evaluation = min(samples, key=lambda sample: abs(sample[0] - median))[1]
+        logger.info("多样本评估完成", extra=item(scores=scores, median=median, agreement=agreed))
+        return {
+            "score": median,
+            "evaluation": evaluation,
+            "score_mean": round(statistics.mean(scores), 4),
+            "score_variance": round(statistics.pvariance(scores), 4),
+            "score_samples": scores,
+            "api_calls": calls,
+            "agreement": agreed
+        }
+
+    def probe_app_response(self, question: str, payload: Dict[str, Any],
+                           client: SiliconFlowClient = None) -> Dict[str, Any]:
+        """以流式方式向应用（OpenAI 兼容的对话接口）提问，自行测量响应时延
+
+        payload 为应用接口的请求体模板（模型、系统提示等），question 作为最后一条用户消息追加；
+        client 为该应用接口的客户端（默认使用评估模型的客户端）。返回 test_results 中
+        单个问题的格式 {"question", "response", "metrics"}，其中 metrics 含首Token时延和Token间隔，
+        可直接交给 evaluate_performance。测量时不读取缓存。
+        """
+        client = client or self.client
+        messages = list(payload.get("messages", [])) + [{"role": "user", "content": question}]
+        result = client.stream_chat_completion(dict(payload, messages=messages), refresh=True)
+        return {"question": question, "response": result.content, "metrics": result.performance_metrics()}
+
     def evaluate_performance(self, metrics: Dict) -> Dict:
         """只评估响应效率（tokens_per_second），并返回三项性能指标"""
         try:
             total_time = metrics.get("total_time", 0)
             token_count = metrics.get("token_count", 0)
             tokens_per_second = metrics.get("tokens_per_second", 0)
+            rate = tokens_per_second or 0
+            # 由 probe_app_response（StreamResult.performance_metrics()）测得时一并保留
+            time_to_first_token = metrics.get("time_to_first_token")
+            mean_inter_token_latency = metrics.get("mean_inter_token_latency")
 
             # 响应效率评分分档（可后续调整）
-            if tokens_per_second >= 25:
+            if rate >= 25:
                 eff_score = 5
-            elif tokens_per_second >= 20:
+            elif rate >= 20:
                 eff_score = 4
-            elif tokens_per_second >= 15:
+            elif rate >= 15:
                 eff_score = 3
-            elif tokens_per_second >= 10:
+            elif rate >= 10:
                 eff_score = 2
             else:
                 eff_score = 1
 
-            return {
+            performance = {
                 "total_time": total_time,
                 "token_count": token_count,
                 "tokens_per_second": tokens_per_second,
                 "eff_score": eff_score
             }
+            if time_to_first_token is not None:
+                performance["time_to_first_token"] = time_to_first_token
+                performance["mean_inter_token_latency"] = mean_inter_token_latency
+            return performance
         except Exception as e:
-            print(f"性能评估出错: {str(e)}")
+            logger.warning(f"性能评估出错: {str(e)}")
             return {
                 "total_time": 0,
                 "token_count": 0,
@@ -224,125 +411,247 @@ class ResponseEvaluator:
                 "eff_score": 1
             }
 
-    def evaluate_batch(self, test_results_file: str, metrics_file: str, output_file: str):
-        """批量评估测试结果"""
+    def _collect_app_tasks(self, app_result: Dict, metrics_data: Dict, app_index: int = 0) -> List[Dict[str, Any]]:
+        """按 标签 → 指标 → 问题 的顺序收集单个应用的待评估任务"""
+        tasks = []
+        app_info = app_result.get('app_info', {})
+        responses = app_result.get('responses', {})
+        
+        for tag, tag_responses in responses.items():
+            if tag not in metrics_data:
+                continue
+            
+            tag_metrics = metrics_data[tag]
+            
+            for metric_name, metric_responses in tag_responses.items():
+                if metric_name not in tag_metrics:
+                    continue
+                
+                metric_criteria = tag_metrics[metric_name].get('评分标准', [])
+                metric_description = tag_metrics[metric_name].get('描述', '')
+                
+                for question_name, question_data in metric_responses.items():
+                    tasks.append({
+                        "app_index": app_index,
+                        "app_name": app_info.get('title', 'Unknown'),
+                        "app_url": app_info.get('url', ''),
+                        "tag": tag,
+                        "metric_name": metric_name,
+                        "metric_description": metric_description,
+                        "metric_criteria": metric_criteria,
+                        "question_name": question_name,
+                        "question": question_data.get('question', ''),
+                        "response": question_data.get('response', ''),
+                        "metrics": question_data.get('metrics', {})
+                    })
+        
+        return tasks
+
+    def _evaluate_task(self, task: Dict[str, Any]) -> Dict[str, Any]:
+        """评估单个问题的回答，返回 evaluation_detail"""
+        logger.info("评估问题", extra=item(app=task['app_name'], tag=task['tag'], metric=task['metric_name'],
+                                           question=task['question_name']))
+        
+        # 评估响应内容
+        content_evaluation = self._judge_once(task)
+        content_score = content_evaluation.get('score', 3)
+        
+        # 评估性能
+        performance_metrics = self.evaluate_performance(task['metrics'])
+        performance_score = performance_metrics.get('eff_score', 1)
+        
+        # 计算综合评分
+        final_score = (
+            content_score * self.weights['content_score'] +
+            performance_score * self.weights['performance_score']
+        )
+        
+        detail = {
+            "metric": task['metric_name'],
+            "description": task['metric_description'],
+            "scoring_criteria": task['metric_criteria'],
+            "question": task['question'],
+            "response": task['response'],
+            "content_score": content_score,
+            "performance_score": performance_score,
+            "final_score": round(final_score, 2),
+            "content_evaluation": content_evaluation.get('evaluation', ''),
+            "performance_metrics": performance_metrics
+        }
+        if "score_samples" in content_evaluation:
+            detail["content_score_stats"] = {
+                key: content_evaluation[key]
+                for key in ("score_mean", "score_variance", "score_samples", "api_calls", "agreement")
+            }
+        return detail
+
+    def _judge(self, task: Dict[str, Any]) -> Dict[str, Any]:
+        with metrics.timer("judge_seconds"):
+            return self.evaluate_response(task['question'], task['response'], task['metric_criteria'])
+
+    def _judge_once(self, task: Dict[str, Any]) -> Dict[str, Any]:
+        """评估回答内容
+
+        reuse_judgements=True 时，并发执行的相同评估输入等待首个任务的结果；
+        首个任务评估失败（分数为 0 或抛出异常）时不缓存，等待的任务重新评估。
+        """
+        if not self.reuse_judgements:
+            return self._judge(task)
+        
+        key = json.dumps([task['question'], task['response'], task['metric_criteria']], ensure_ascii=False)
+        while True:
+            with self._judge_lock:
+                future = self._judge_results.get(key)
+                owner = future is None
+                if owner:
+                    future = self._judge_results[key] = Future()
+            if owner:
+                break
+            content_evaluation = future.result()
+            if content_evaluation is not None:
+                metrics.increment("judge_reused_total")
+                return content_evaluation
+        
+        content_evaluation = None
+        try:
+            content_evaluation = self._judge(task)
+        finally:
+            succeeded = content_evaluation is not None and content_evaluation.get('score', 0) > 0
+            if not succeeded:
+                with self._judge_lock:
+                    self._judge_results.pop(key, None)
+            future.set_result(content_evaluation if succeeded else None)
+        return content_evaluation
+
+    def _run_task(self, task: Dict[str, Any], journal: EvaluationJournal = None) -> Dict[str, Any]:
+        """评估单个任务；启用断点日志时跳过已完成的任务，完成后立即写入日志"""
+        if journal is None:
+            return self._evaluate_task(task)
+        
+        key = journal.make_key(task)
+        detail = journal.get(key)
+        if detail is not None:
+            return detail
+        
+        detail = self._evaluate_task(task)
+        # 评估失败（0分）的结果不写入日志，续跑时重新评估
+        if detail['content_score'] > 0:
+            journal.record(key, detail)
+        return detail
+
+    def evaluate_app(self, app_result: Dict, metrics_data: Dict, journal: EvaluationJournal = None,
+                     app_index: int = 0) -> Dict[str, Any]:
+        """评估单个应用的全部回答并汇总（串行）
+
+        指定 journal 时跳过日志中已完成的问题，新完成的问题立即写入日志；
+        评估失败（content_score 为 0）的问题不写入日志，再次调用时只重新评估这些问题。
+        """
+        tasks = self._collect_app_tasks(app_result, metrics_data, app_index)
+        evaluation_details = [self._run_task(task, journal) for task in tasks]
+        return self._summarize_app(app_result.get('app_info', {}), evaluation_details)
+
+    def _summarize_app(self, app_info: Dict, evaluation_details: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """按原有顺序汇总单个应用的评估结果"""
+        total_content_score = 0
+        total_performance_score = 0
+        evaluation_count = 0
+        
+        for detail in evaluation_details:
+            total_content_score += detail['content_score']
+            total_performance_score += detail['performance_score']
+            evaluation_count += 1
+        
+        if evaluation_count > 0:
+            avg_content_score = total_content_score / evaluation_count
+            avg_performance_score = total_performance_score / evaluation_count
+            total_score = (
+                avg_content_score * self.weights['content_score'] +
+                avg_performance_score * self.weights['performance_score']
+            )
+        else:
+            avg_content_score = 0
+            avg_performance_score = 0
+            total_score = 0
+        
+        return {
+            "app_name": app_info.get('title', 'Unknown'),
+            "app_url": app_info.get('url', ''),
+            "total_score": round(total_score, 2),
+            "content_score": round(avg_content_score, 2),
+            "performance_score": round(avg_performance_score, 2),
+            "evaluation_details": evaluation_details
+        }
+
+    @metrics.staged("evaluation")
+    def evaluate_batch(self, test_results_file: str, metrics_file: str, output_file: str,
+                       max_workers: int = 1, checkpoint_file: str = None):
+        """批量评估测试结果
+        
+        max_workers > 1 时使用线程池并发调用评估API（评估调用基本为网络等待），
+        各应用的得分汇总与结果写出顺序与串行模式完全一致。
+        指定 checkpoint_file 时，每完成一个问题的评估即追加写入断点日志；
+        重新运行时跳过日志中已完成的问题，最终结果由日志记录组装；结果写出后日志轮转为 <checkpoint_file>.done。
+        输入输出文件的格式由扩展名决定（JSON / JSONL(.gz/.zst) / Parquet / Arrow），
+        output_file 为 Parquet / Arrow 时按 evaluation_rows 每个评估明细写一行。
+        """
         # 加载测试结果
         try:
-            with open(test_results_file, 'r', encoding='utf-8') as f:
-                test_results = json.load(f)
+            test_results = read_records(test_results_file)
         except Exception as e:
-            print(f"加载测试结果失败: {str(e)}")
+            logger.error(f"加载测试结果失败: {str(e)}", extra=fields(file=test_results_file))
             return
         
         # 加载指标数据
         try:
-            with open(metrics_file, 'r', encoding='utf-8') as f:
-                metrics_data = json.load(f)
+            metrics_data = load_tag_metrics(metrics_file)
         except Exception as e:
-            print(f"加载指标数据失败: {str(e)}")
+            logger.error(f"加载指标数据失败: {str(e)}", extra=fields(file=metrics_file))
             return
         
+        app_tasks = [self._collect_app_tasks(app_result, metrics_data, app_index)
+                     for app_index, app_result in enumerate(test_results)]
         app_evaluations = []
+        self._judge_results = {}
         
-        for app_result in test_results:
-            app_info = app_result.get('app_info', {})
-            responses = app_result.get('responses', {})
-            
-            app_name = app_info.get('title', 'Unknown')
-            app_url = app_info.get('url', '')
-            
-            print(f"\n正在评估应用: {app_name}")
-            
-            evaluation_details = []
-            total_content_score = 0
-            total_performance_score = 0
-            evaluation_count = 0
-            
-            for tag, tag_responses in responses.items():
-                if tag not in metrics_data:
-                    continue
-                
-                tag_metrics = metrics_data[tag]
-                
-                for metric_name, metric_responses in tag_responses.items():
-                    if metric_name not in tag_metrics:
-                        continue
-                    
-                    metric_criteria = tag_metrics[metric_name].get('评分标准', [])
-                    metric_description = tag_metrics[metric_name].get('描述', '')
-                    
-                    for question_name, question_data in metric_responses.items():
-                        question = question_data.get('question', '')
-                        response = question_data.get('response', '')
-                        metrics = question_data.get('metrics', {})
-                        
-                        print(f"评估标签 '{tag}' 指标 '{metric_name}' 问题 '{question_name}'")
-                        
-                        # 评估响应内容
-                        content_evaluation = self.evaluate_response(question, response, metric_criteria)
-                        content_score = content_evaluation.get('score', 3)
-                        
-                        # 评估性能
-                        performance_metrics = self.evaluate_performance(metrics)
-                        performance_score = performance_metrics.get('eff_score', 1)
-                        
-                        # 计算综合评分
-                        final_score = (
-                            content_score * self.weights['content_score'] +
-                            performance_score * self.weights['performance_score']
-                        )
-                        
-                        evaluation_detail = {
-                            "metric": metric_name,
-                            "description": metric_description,
-                            "scoring_criteria": metric_criteria,
-                            "question": question,
-                            "response": response,
-                            "content_score": content_score,
-                            "performance_score": performance_score,
-                            "final_score": round(final_score, 2),
-                            "content_evaluation": content_evaluation.get('evaluation', ''),
-                            "performance_metrics": performance_metrics
-                        }
-                        
-                        evaluation_details.append(evaluation_detail)
-                        total_content_score += content_score
-                        total_performance_score += performance_score
-                        evaluation_count += 1
-            
-            if evaluation_count > 0:
-                avg_content_score = total_content_score / evaluation_count
-                avg_performance_score = total_performance_score / evaluation_count
-                total_score = (
-                    avg_content_score * self.weights['content_score'] +
-                    avg_performance_score * self.weights['performance_score']
-                )
-            else:
-                avg_content_score = 0
-                avg_performance_score = 0
-                total_score = 0
-            
-            app_evaluation = {
-                "app_name": app_name,
-                "app_url": app_url,
-                "total_score": round(total_score, 2),
-                "content_score": round(avg_content_score, 2),
-                "performance_score": round(avg_performance_score, 2),
-                "evaluation_details": evaluation_details
-            }
-            
-            app_evaluations.append(app_evaluation)
+        journal = None
+        if checkpoint_file:
+            journal = EvaluationJournal(checkpoint_file)
+            resumed = sum(1 for tasks in app_tasks for task in tasks
+                          if journal.get(journal.make_key(task)) is not None)
+            if resumed:
+                logger.info(f"从断点日志恢复 {resumed} 条已完成的评估: {checkpoint_file}")
+        
+        if max_workers > 1:
+            logger.info(f"并发评估模式，工作线程数: {max_workers}")
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                # 一次性提交所有应用的任务，使线程池在应用之间也保持满载
+                run_task = metrics.bind_stage(self._run_task)
+                app_futures = [[executor.submit(run_task, task, journal) for task in tasks]
+                               for tasks in app_tasks]
+                for app_result, futures in zip(test_results, app_futures):
+                    app_info = app_result.get('app_info', {})
+                    evaluation_details = [future.result() for future in futures]
+                    logger.info("应用评估完成", extra=item(app=app_info.get('title', 'Unknown')))
+                    app_evaluations.append(self._summarize_app(app_info, evaluation_details))
+        else:
+            for app_index, app_result in enumerate(test_results):
+                app_info = app_result.get('app_info', {})
+                logger.info("正在评估应用", extra=item(app=app_info.get('title', 'Unknown')))
+                app_evaluations.append(self.evaluate_app(app_result, metrics_data, journal, app_index))
         
         # 保存评估结果
-        os.makedirs(os.path.dirname(output_file), exist_ok=True)
-        with open(output_file, 'w', encoding='utf-8') as f:
-            json.dump(app_evaluations, f, ensure_ascii=False, indent=2)
+        with metrics.timer("report_write_seconds", report="evaluation_results"):
+            write_records(evaluation_rows(app_evaluations) if is_columnar(output_file) else app_evaluations,
+                          output_file)
+        if journal is not None:
+            journal.complete()
         
         # 生成详细报告
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         report_file = f"evaluation_report_{timestamp}.txt"
         
-        with open(report_file, 'w', encoding='utf-8') as f:
+        with metrics.timer("report_write_seconds", report="evaluation_report"), \
+                open(report_file, 'w', encoding='utf-8') as f:
             f.write("应用响应质量评估报告\n")
             f.write("=" * 60 + "\n\n")
             
@@ -370,12 +679,17 @@ class ResponseEvaluator:
                 
                 f.write("\n" + "=" * 50 + "\n\n")
 
-        print(f"\n评估报告已生成: {report_file}")
-        print(f"✅ 评估完成，结果已保存到: {output_file}")
+        logger.info(f"评估报告已生成: {report_file}")
+        logger.info(f"评估完成，结果已保存到: {output_file}", extra=fields(apps=len(app_evaluations)))
         return app_evaluations
 
 def main():
     """主函数"""
+    parser = argparse.ArgumentParser(description="批量评估应用的响应质量")
+    parser.add_argument("--checkpoint", default=None,
+                        help="断点日志路径（JSONL），指定时可在中断后续跑，批次成功完成后轮转为 <路径>.done")
+    args = parser.parse_args()
+    
     evaluator = ResponseEvaluator()
     
     # 文件路径
@@ -383,8 +697,15 @@ def main():
     metrics_file = "../data/tag_metrics.json"
     output_file = "../results/evaluation_results.json"
     
+    # 并发评估线程数（1 表示串行）
+    max_workers = int(os.getenv('LAQUAL_EVAL_WORKERS') or 1)
+    
+    # 每个回答的评估样本数（大于 1 时启用多样本投票）
+    evaluator.judge_samples = int(os.getenv('LAQUAL_JUDGE_SAMPLES') or 1)
+    
     # 批量评估
-    evaluator.evaluate_batch(test_results_file, metrics_file, output_file)
+    evaluator.evaluate_batch(test_results_file, metrics_file, output_file,
+                             max_workers=max_workers, checkpoint_file=args.checkpoint)
 
 if __name__ == "__main__":
     main()
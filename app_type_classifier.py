@@ -0,0 +1,102 @@
+"""
+LaQual - app_type_classifier
+功能：基于配置关键词表识别应用类型
+作者：wang yan
+日期：2026-10-16
+
+所有关键词编译为一个正则，一次扫描标签。
+"""
+
+import json
+import os
+import re
+import threading
+from typing import Any, Dict, List, Tuple
+
+DEFAULT_CONFIG_FILE = os.getenv('LAQUAL_APP_TYPE_CONFIG') or os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "config", "app_type_keywords.json")
+
+
+def normalize_tag(tag_value: Any) -> str:
+    """将应用的“标签”字段统一为小写字符串（列表取第一个标签）"""
+    if isinstance(tag_value, list) and tag_value:
+        return str(tag_value[0]).lower()
+    if isinstance(tag_value, str):
+        return tag_value.lower()
+    return str(tag_value).lower()
+
+
+class AppTypeClassifier:
+    def __init__(self, rules: List[Dict[str, Any]], default_app_type: str = "通用型",
+                 default_tool_type: str = ""):
+        """根据规则表构建分类器
+
+        rules 按优先级排列，每条规则包含 app_type、tool_type、keywords；
+        标签命中多条规则的关键词时取排在最前面的规则，与逐条 any(keyword in tag) 判断等价。
+        """
+        self.rules = rules
+        self.default_app_type = default_app_type
+        self.default_tool_type = default_tool_type
+
+        # 关键词 → 所属规则的最高优先级
+        self._priority = {}
+        for index, rule in enumerate(rules):
+            for keyword in rule["keywords"]:
+                if keyword and keyword not in self._priority:
+                    self._priority[keyword] = index
+
+        # 关键词按规则优先级排列，并放入零宽前瞻中：
+        # 每个位置上命中的是该位置最高优先级的关键词，且不同关键词的匹配可以相互重叠
+        keywords = sorted(self._priority, key=lambda keyword: self._priority[keyword])
+        self._pattern = re.compile(
+            "(?=(" + "|".join(re.escape(keyword) for keyword in keywords) + "))"
+        ) if keywords else None
+
+    @classmethod
+    def from_file(cls, file_path: str) -> "AppTypeClassifier":
+        """从JSON配置文件加载规则表"""
+        with open(file_path, 'r', encoding='utf-8') as f:
+            config = json.load(f)
+        return cls(
+            config["rules"],
+            default_app_type=config.get("default_app_type", "通用型"),
+            default_tool_type=config.get("default_tool_type", "")
+        )
+
+    def classify_normalized(self, tag: str) -> Tuple[str, str]:
+        """识别已规范化（小写）标签的类型，返回 (应用类型, 工具类型)"""
+        best = None
+        if self._pattern is not None:
+            for match in self._pattern.finditer(tag):
+                priority = self._priority[match.group(1)]
+                if best is None or priority < best:
+                    best = priority
+                    if best == 0:
+                        break
+        if best is None:
+            return self.default_app_type, self.default_tool_type
+        rule = self.rules[best]
+        return rule["app_type"], rule["tool_type"]
+
+    def classify(self, tag_value: Any) -> Tuple[str, str]:
+        """识别应用“标签”字段的类型，返回 (应用类型, 工具类型)"""
+        return self.classify_normalized(normalize_tag(tag_value))
+
+
+_default_classifier = None
+_default_classifier_lock = threading.Lock()
+
+
+def get_default_classifier() -> AppTypeClassifier:
+    """获取基于默认配置文件的共享分类器（首次调用时编译）"""
+    global _default_classifier
+    if _default_classifier is None:
+        with _default_classifier_lock:
+            if _default_classifier is None:
+                _default_classifier = AppTypeClassifier.from_file(DEFAULT_CONFIG_FILE)
+    return _default_classifier
+
+
+def classify_app_type(tag_value: Any) -> Tuple[str, str]:
+    """使用默认规则识别应用类型，返回 (应用类型, 工具类型)"""
+    return get_default_classifier().classify(tag_value)
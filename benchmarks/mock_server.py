@@ -0,0 +1,239 @@
+"""
+LaQual - mock_server
+功能：本地模拟 SiliconFlow 对话补全接口，用于基准测试
+作者：wang yan
+日期：2026-10-16
+
+可配置时延、错误率、429 比例，支持流式输出与 n 个候选；按提示词类型返回标签、指标JSON、
+“问题：”行和“分数：”评估等固定内容，基准测试不消耗API额度。
+
+单独运行：
+    python benchmarks/mock_server.py --port 8765 --latency 0.2
+    export SILICONFLOW_API_URL=http://127.0.0.1:8765/v1/chat/completions
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from structured_logging import get_logger
+
+logger = get_logger("mock_server")
+
+CANNED_TAG = "法律咨询分析"
+
+CANNED_METRICS = {
+    f"指标{i}": {
+        "描述": f"评估回答在第{i}个维度上的专业程度与完整性",
+        "评分标准": [
+            "5分：内容完全准确，覆盖全部要点，并给出具体可操作的建议",
+            "4分：内容基本准确，覆盖大部分要点",
+            "3分：内容部分准确，遗漏若干要点",
+            "2分：内容存在明显错误或遗漏",
+            "1分：内容与问题无关或完全错误"
+        ]
+    }
+    for i in range(1, 4)
+}
+
+CANNED_QUESTION = "问题：我和房东签了一年的租房合同，现在工作调动需要提前三个月退租，房东要求扣除全部押金，这样合理吗？"
+
+CANNED_EVALUATION = """分数：{score}
+优点：
+- 回答结构清晰，先给出结论再展开分析
+- 引用了相关的法律条款，内容较为专业
+不足：
+- 没有结合提问者的具体情况给出建议
+- 部分表述较为笼统，缺少可操作的步骤
+改进建议：
+- 补充与房东协商的具体步骤和话术
+- 说明在协商不成时可以采取的维权途径
+"""
+
+
+def canned_content(payload: Dict[str, Any]) -> str:
+    """根据提示词判断调用方，返回对应的固定输出"""
+    text = "\n".join(str(message.get("content", "")) for message in payload.get("messages", []))
+    if "分数：[1-5" in text:
+        return CANNED_EVALUATION.format(score=random.choice([3, 4, 4, 4, 5]))
+    if "问题：[问题内容]" in text:
+        return CANNED_QUESTION
+    if "评估指标" in text and "JSON" in text:
+        return json.dumps(CANNED_METRICS, ensure_ascii=False, indent=2)
+    if "标签" in text:
+        return CANNED_TAG
+    return "好的。"
+
+
+class MockSiliconFlowServer:
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: float = 0.0, jitter: float = 0.0,
+                 error_rate: float = 0.0, rate_limit_rate: float = 0.0, token_latency: float = 0.0,
+                 chunk_chars: int = 4):
+        """latency 为每个请求的基础时延（秒），jitter 为额外的均匀随机时延上限；
+        error_rate / rate_limit_rate 为返回 500 / 429 的概率；
+        token_latency 为流式输出中相邻分片的间隔，chunk_chars 为每个分片的字符数。
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.token_latency = token_latency
+        self.chunk_chars = chunk_chars
+        self.stats = {"requests": 0, "errors": 0, "rate_limited": 0, "streams": 0}
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1/chat/completions"
+
+    def _count(self, key: str):
+        with self._lock:
+            self.stats[key] += 1
+
+    def start(self) -> "MockSiliconFlowServer":
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def handle(self):
+                try:
+                    super().handle()
+                except (BrokenPipeError, ConnectionResetError):
+                    # 客户端关闭了长连接（例如流式评估提前终止）
+                    pass
+
+            def _send_json(self, status: int, body: Dict[str, Any]):
+                data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _write_chunk(self, data: bytes):
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                try:
+                    payload = json.loads(self.rfile.read(length) or b"{}")
+                except ValueError:
+                    self._send_json(400, {"error": "invalid json"})
+                    return
+                server._count("requests")
+
+                time.sleep(server.latency + random.uniform(0, server.jitter))
+                roll = random.random()
+                if roll < server.rate_limit_rate:
+                    server._count("rate_limited")
+                    self._send_json(429, {"error": "rate limited"})
+                    return
+                if roll < server.rate_limit_rate + server.error_rate:
+                    server._count("errors")
+                    self._send_json(500, {"error": "internal error"})
+                    return
+
+                contents = [canned_content(payload) for _ in range(int(payload.get("n") or 1))]
+                prompt_tokens = sum(len(str(m.get("content", ""))) for m in payload.get("messages", []))
+                usage = {
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": sum(len(content) for content in contents),
+                    "total_tokens": prompt_tokens + sum(len(content) for content in contents)
+                }
+                if payload.get("stream"):
+                    # 与 OpenAI 兼容接口一致：只有 stream_options.include_usage 时才在流末尾返回用量
+                    include_usage = (payload.get("stream_options") or {}).get("include_usage")
+                    self._stream(contents[0], usage if include_usage else None)
+                    return
+                self._send_json(200, {
+                    "id": "mock",
+                    "object": "chat.completion",
+                    "model": payload.get("model", ""),
+                    "choices": [
+                        {"index": i, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}
+                        for i, content in enumerate(contents)
+                    ],
+                    "usage": usage
+                })
+
+            def _stream(self, content: str, usage: Optional[Dict[str, int]]):
+                server._count("streams")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                pieces: List[str] = [content[i:i + server.chunk_chars]
+                                     for i in range(0, len(content), server.chunk_chars)]
+                for piece in pieces:
+                    chunk = {"choices": [{"index": 0, "delta": {"content": piece}}]}
+                    self._write_chunk(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+                    self.wfile.flush()
+                    if server.token_latency:
+                        time.sleep(server.token_latency)
+                final = {"choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}
+                self._write_chunk(f"data: {json.dumps(final)}\n\n".encode("utf-8"))
+                if usage is not None:
+                    self._write_chunk(f"data: {json.dumps({'choices': [], 'usage': usage})}\n\n".encode("utf-8"))
+                self._write_chunk(b"data: [DONE]\n\n")
+                self._write_chunk(b"")
+
+        return Handler
+
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description="本地模拟 SiliconFlow 对话补全接口")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.1)
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0)
+    parser.add_argument("--token-latency", type=float, default=0.0)
+    args = parser.parse_args()
+
+    server = MockSiliconFlowServer(args.host, args.port, latency=args.latency, jitter=args.jitter,
+                                   error_rate=args.error_rate, rate_limit_rate=args.rate_limit_rate,
+                                   token_latency=args.token_latency)
+    logger.info(f"模拟服务已启动: {server.url}")
+    try:
+        server._server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server._server.server_close()
+
+
+if __name__ == "__main__":
+    main()
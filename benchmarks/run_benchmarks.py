@@ -0,0 +1,459 @@
+"""
+LaQual - run_benchmarks
+功能：基于本地模拟服务的基准测试
+作者：wang yan
+日期：2026-10-16
+
+标签生成、指标生成、问题生成和批量评估在不同并发度下的端到端吞吐，
+以及 check_basic_metrics 与 verify_tag_similarity 在合成数据上的微基准；结果保存为 JSON 便于回归对比。
+
+示例：
+    python benchmarks/run_benchmarks.py --quick
+    python benchmarks/run_benchmarks.py --concurrency 1,8,32 --latency 0.2 --error-rate 0.02 --rate-limit-rate 0.02
+    python benchmarks/run_benchmarks.py --baseline benchmarks/results/benchmark_20261016_120000.json
+"""
+
+import argparse
+import hashlib
+import importlib.metadata
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Callable, Dict, List
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARK_DIR))
+
+from mock_server import CANNED_METRICS, MockSiliconFlowServer
+from structured_logging import configure_logging, fields, get_logger
+from instrumentation import metrics
+from siliconflow_client import SiliconFlowClient
+
+logger = get_logger("benchmarks")
+
+DEFAULT_OUTPUT_DIR = os.path.join(BENCHMARK_DIR, "results")
+
+DOMAINS = ["法律", "医疗", "教育", "写作", "编程", "旅行", "心理", "财务"]
+FUNCTIONS = ["咨询", "诊断", "辅导", "润色", "规划", "分析", "问答", "翻译"]
+
+
+class HashingEncoder:
+    """不依赖预训练权重的字符 n-gram 哈希编码器，接口与 SentenceTransformer.encode 相同，
+    用于在无法下载模型时测量 verify_tag_similarity 除模型推理之外的开销"""
+
+    def __init__(self, dim: int = 768):
+        self.dim = dim
+
+    def _vector(self, text: str):
+        import torch
+        vector = torch.zeros(self.dim)
+        for n in (1, 2):
+            for i in range(max(1, len(text) - n + 1)):
+                digest = hashlib.md5(text[i:i + n].encode('utf-8')).digest()
+                vector[int.from_bytes(digest[:4], 'little') % self.dim] += 1.0
+        return vector
+
+    def encode(self, texts, convert_to_tensor: bool = True, **kwargs):
+        import torch
+        if isinstance(texts, str):
+            return self._vector(texts)
+        return torch.stack([self._vector(text) for text in texts])
+
+
+def synthetic_descriptions(count: int, rng: random.Random) -> List[str]:
+    descriptions = []
+    for i in range(count):
+        domain, function = rng.choice(DOMAINS), rng.choice(FUNCTIONS)
+        sentence = f"一款面向{domain}场景的智能{function}应用，帮助用户快速完成{domain}{function}相关的任务，编号{i}。"
+        descriptions.append(sentence * rng.randint(1, 4))
+    return descriptions
+
+
+def synthetic_catalog(count: int, rng: random.Random) -> List[Dict[str, Any]]:
+    """生成字段分布接近真实抓取数据的应用目录（包含空值、字符串数字和列表形式的组件）"""
+    tags = ["法律咨询", "写作润色", "编程助手", "智能翻译", "旅行规划", "心理辅导", "", "知识问答"]
+    apps = []
+    for i in range(count):
+        app = {
+            "title": f"应用{i}",
+            "url": f"https://example.com/app/{i}",
+            "标签": rng.choice(tags),
+            "发布时间": rng.choice(["", f"2024-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+                                 f"2023/{rng.randint(1, 12):02d}/{rng.randint(1, 28):02d} 10:00:00"]),
+            "浏览量": str(rng.randint(0, 100000)),
+            "使用量": rng.randint(0, 20000),
+            "收藏量": rng.choice([rng.randint(0, 500), "", None]),
+            "被复制": rng.randint(0, 300),
+            "模型配置": rng.choice([["Qwen"], ["Qwen", "DeepSeek"], [], ""]),
+            "知识库数量": rng.randint(0, 3)
+        }
+        if rng.random() < 0.5:
+            app["组件"] = ["搜索"] * rng.randint(0, 4)
+        else:
+            app["组件数量"] = str(rng.randint(0, 4))
+        apps.append(app)
+    return apps
+
+
+def synthetic_test_results(apps: int, tags: List[str], questions: int) -> List[Dict[str, Any]]:
+    """生成 evaluate_batch 所需的测试结果：每个应用对每个标签的每个指标回答 questions 个问题"""
+    response = "根据《民法典》第七百零三条，租赁合同中押金的扣除应以实际损失为限。" * 5
+    results = []
+    for i in range(apps):
+        responses = {
+            tag: {
+                metric: {
+                    f"问题{q + 1}": {
+                        "question": f"关于{tag}的第{q + 1}个问题？",
+                        "response": response,
+                        "metrics": {"total_time": 3.0 + q, "token_count": 300, "tokens_per_second": 100.0 / (q + 1)}
+                    }
+                    for q in range(questions)
+                }
+                for metric in CANNED_METRICS
+            }
+            for tag in tags
+        }
+        results.append({"app_info": {"title": f"应用{i}", "url": f"https://example.com/app/{i}"},
+                        "responses": responses})
+    return results
+
+
+@contextmanager
+def working_directory(path: str):
+    """evaluate_batch 会把文本报告写到当前目录，测试期间切换到临时目录"""
+    previous = os.getcwd()
+    os.chdir(path)
+    try:
+        yield
+    finally:
+        os.chdir(previous)
+
+
+def run_concurrently(func: Callable[[Any], Any], items: List[Any], concurrency: int) -> List[Any]:
+    if concurrency <= 1:
+        return [func(entry) for entry in items]
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        return list(executor.map(func, items))
+
+
+class BenchmarkRunner:
+    def __init__(self, args: argparse.Namespace):
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.results = []
+        self.server = None
+        self.temp_dir = None
+
+    def make_client(self) -> SiliconFlowClient:
+        """每个场景使用独立客户端：不缓存、不限流，重试退避缩短为毫秒级"""
+        return SiliconFlowClient(api_url=self.server.url, api_key="mock", pool_size=max(self.args.concurrency) * 2,
+                                 backoff_base=0.01, backoff_max=0.1, timeout=30, cache=None, rate_limiters=None)
+
+    def record(self, benchmark: str, items: int, seconds: float, concurrency: int = None,
+               stats_before: Dict[str, int] = None, **extra) -> Dict[str, Any]:
+        result = {
+            "benchmark": benchmark,
+            "concurrency": concurrency,
+            "items": items,
+            "seconds": round(seconds, 4),
+            "items_per_second": round(items / seconds, 3) if seconds > 0 else None
+        }
+        if stats_before is not None:
+            result["server"] = {key: value - stats_before[key] for key, value in self.server.stats.items()}
+            latencies = [series for series in metrics.summary()["histograms"].get("api_call_seconds", [])]
+            if latencies:
+                result["api_call_p50"] = max(series["p50"] for series in latencies)
+                result["api_call_p95"] = max(series["p95"] for series in latencies)
+            # 去重复用的条目不经过客户端，单独列出，items_per_second 只在未复用时反映客户端吞吐
+            reused = {name: sum(series["value"] for series in counters)
+                      for name, counters in metrics.summary()["counters"].items() if name.endswith("_reused_total")}
+            if any(reused.values()):
+                result["reused"] = reused
+        result.update(extra)
+        self.results.append(result)
+        logger.info("基准测试完成", extra=fields(**result))
+        return result
+
+    def throughput(self, benchmark: str, body: Callable[[int], int]):
+        """在每个并发度下运行 body(concurrency)，body 返回完成的条目数"""
+        for concurrency in self.args.concurrency:
+            metrics.reset()
+            stats_before = dict(self.server.stats)
+            started = time.perf_counter()
+            completed = body(concurrency)
+            self.record(benchmark, completed, time.perf_counter() - started, concurrency, stats_before)
+
+    def bench_label(self):
+        from label_generation import LabelGeneration
+
+        groups = [synthetic_descriptions(self.args.group_size, self.rng) for _ in range(self.args.label_groups)]
+
+        def body(concurrency: int) -> int:
+            generator = LabelGeneration(client=self.make_client())
+            # 只测量 API 路径，相似度验证由 similarity 微基准单独测量
+            generator.verify_tag_similarity = lambda tag, descriptions: True
+            labels = run_concurrently(generator.generate_label_for_apps, groups, concurrency)
+            return sum(1 for label in labels if label)
+
+        self.throughput("label_generation", body)
+
+    def bench_metric(self):
+        from Metric_generation import MetricGeneration
+
+        tags = [f"{domain}{function}" for domain in DOMAINS for function in FUNCTIONS][:self.args.tags]
+        apps_file = os.path.join(self.temp_dir, "apps_by_tags.json")
+        with open(apps_file, 'w', encoding='utf-8') as f:
+            json.dump({tag: [{"title": f"{tag}{i}"} for i in range(3)] for tag in tags}, f, ensure_ascii=False)
+
+        def body(concurrency: int) -> int:
+            generator = MetricGeneration(client=self.make_client())
+            generator.load_data(apps_file)
+            output_dir = os.path.join(self.temp_dir, f"tag_metrics_{concurrency}")
+            results = generator.generate_metrics_for_all_tags(os.path.join(output_dir, "tag_metrics.json"),
+                                                              output_dir, max_workers=concurrency)
+            return len(results or {})
+
+        self.throughput("metric_generation", body)
+
+    def bench_question(self):
+        from Evaluation_task_generation import QuestionGenerator
+
+        metrics_file = os.path.join(self.temp_dir, "question_metrics.json")
+        tags = [f"{domain}{function}" for domain in DOMAINS for function in FUNCTIONS][:self.args.tags]
+        with open(metrics_file, 'w', encoding='utf-8') as f:
+            json.dump({tag: CANNED_METRICS for tag in tags}, f, ensure_ascii=False)
+
+        def body(concurrency: int) -> int:
+            generator = QuestionGenerator(client=self.make_client())
+            output_file = os.path.join(self.temp_dir, f"questions_{concurrency}.json")
+            questions = generator.generate_questions_for_many_tags([metrics_file], output_file,
+                                                                   max_concurrency=concurrency)
+            return len(questions or [])
+
+        self.throughput("question_generation", body)
+
+    def bench_evaluation(self):
+        from Response_quality_evaluation import ResponseEvaluator
+
+        tags = ["法律咨询分析", "写作润色"]
+        test_results_file = os.path.join(self.temp_dir, "app_test_results.json")
+        metrics_file = os.path.join(self.temp_dir, "evaluation_metrics.json")
+        with open(test_results_file, 'w', encoding='utf-8') as f:
+            json.dump(synthetic_test_results(self.args.eval_apps, tags, self.args.eval_questions), f,
+                      ensure_ascii=False)
+        with open(metrics_file, 'w', encoding='utf-8') as f:
+            json.dump({tag: CANNED_METRICS for tag in tags}, f, ensure_ascii=False)
+
+        def body(concurrency: int) -> int:
+            evaluator = ResponseEvaluator(client=self.make_client(), stream_judge=self.args.stream_judge,
+                                          judge_samples=self.args.judge_samples)
+            output_file = os.path.join(self.temp_dir, f"evaluation_results_{concurrency}.json")
+            with working_directory(self.temp_dir):
+                evaluations = evaluator.evaluate_batch(test_results_file, metrics_file, output_file,
+                                                       max_workers=concurrency)
+            return sum(len(app['evaluation_details']) for app in evaluations or [])
+
+        self.throughput("response_evaluation", body)
+
+    def bench_static(self):
+        from Static_indicator_evaluation import AppTester
+
+        apps = synthetic_catalog(self.args.catalog_size, self.rng)
+        for engine in ("scalar", "vectorized", "process"):
+            tester = AppTester()
+            timings = []
+            for _ in range(self.args.repeat):
+                started = time.perf_counter()
+                # 不设应用数门槛，使进程池引擎在任意目录规模下都实际运行
+                passed = tester.filter_apps_by_metrics(apps, engine=engine, process_min_apps=0)
+                timings.append(time.perf_counter() - started)
+            self.record("check_basic_metrics", len(apps), min(timings), engine=engine, passed=len(passed),
+                        runs=[round(t, 4) for t in timings])
+
+    def bench_similarity(self):
+        try:
+            import torch  # noqa: F401
+        except ImportError:
+            self.results.append({"benchmark": "verify_tag_similarity", "skipped": "未安装 torch"})
+            logger.warning("未安装 torch，跳过相似度微基准")
+            return
+
+        from embedding_store import EmbeddingStore
+        from label_generation import LabelGeneration
+        from similarity_model import get_similarity_model
+
+        model = get_similarity_model() if self.args.real_model else None
+        encoder = "text2vec" if model is not None else "hashing"
+        model = model or HashingEncoder()
+
+        groups = [synthetic_descriptions(self.args.group_size, self.rng) for _ in range(self.args.similarity_groups)]
+        cold, warm, persisted = [], [], []
+        store = EmbeddingStore(os.path.join(self.temp_dir, "embedding_store"), model_name=encoder)
+        for descriptions in groups:
+            generator = LabelGeneration(client=self.make_client())
+            generator.similarity_model = model
+            # 首次验证需要编码全部描述分段，重试时只编码新的候选标签
+            started = time.perf_counter()
+            generator.verify_tag_similarity("法律咨询分析", descriptions)
+            cold.append(time.perf_counter() - started)
+            started = time.perf_counter()
+            generator.verify_tag_similarity("医疗诊断问答", descriptions)
+            warm.append(time.perf_counter() - started)
+            # 新的生成器相当于新一次运行：第一次写入向量库，第二次分段向量直接从向量库映射
+            for run in range(2):
+                generator = LabelGeneration(client=self.make_client(), embedding_store=store)
+                generator.similarity_model = model
+                started = time.perf_counter()
+                generator.verify_tag_similarity("法律咨询分析", descriptions)
+            persisted.append(time.perf_counter() - started)
+        store.close()
+        self.record("verify_tag_similarity", len(groups), sum(cold), encoder=encoder, phase="cold",
+                    group_size=self.args.group_size)
+        self.record("verify_tag_similarity", len(groups), sum(warm), encoder=encoder, phase="warm",
+                    group_size=self.args.group_size)
+        self.record("verify_tag_similarity", len(groups), sum(persisted), encoder=encoder, phase="embedding_store",
+                    group_size=self.args.group_size)
+
+    def run(self) -> Dict[str, Any]:
+        benchmarks = {
+            "label": self.bench_label,
+            "metric": self.bench_metric,
+            "question": self.bench_question,
+            "evaluation": self.bench_evaluation,
+            "static": self.bench_static,
+            "similarity": self.bench_similarity
+        }
+        started_at = datetime.now().isoformat(timespec="seconds")
+        server = MockSiliconFlowServer(latency=self.args.latency, jitter=self.args.jitter,
+                                       error_rate=self.args.error_rate, rate_limit_rate=self.args.rate_limit_rate,
+                                       token_latency=self.args.token_latency)
+        with server, tempfile.TemporaryDirectory(prefix="laqual_bench_") as temp_dir:
+            self.server, self.temp_dir = server, temp_dir
+            for name in self.args.only:
+                logger.info(f"开始基准测试: {name}")
+                benchmarks[name]()
+
+        return {
+            "started_at": started_at,
+            "environment": environment_info(),
+            "config": vars(self.args),
+            "results": self.results
+        }
+
+
+def environment_info() -> Dict[str, Any]:
+    info = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "packages": {}
+    }
+    for package in ("requests", "numpy", "pandas", "torch", "sentence-transformers"):
+        try:
+            info["packages"][package] = importlib.metadata.version(package)
+        except importlib.metadata.PackageNotFoundError:
+            info["packages"][package] = None
+    return info
+
+
+def result_key(result: Dict[str, Any]) -> tuple:
+    return (result.get("benchmark"), result.get("concurrency"), result.get("engine"),
+            result.get("encoder"), result.get("phase"))
+
+
+def compare_with_baseline(report: Dict[str, Any], baseline_file: str, tolerance: float) -> List[Dict[str, Any]]:
+    """按 (基准, 并发度, 引擎, 阶段) 对比吞吐，低于基线 (1 - tolerance) 倍的记为回退"""
+    with open(baseline_file, 'r', encoding='utf-8') as f:
+        baseline = {result_key(result): result for result in json.load(f).get("results", [])}
+
+    comparisons = []
+    for result in report["results"]:
+        previous = baseline.get(result_key(result))
+        if not previous or not previous.get("items_per_second") or not result.get("items_per_second"):
+            continue
+        ratio = result["items_per_second"] / previous["items_per_second"]
+        comparisons.append({
+            "benchmark": result["benchmark"],
+            "key": [value for value in result_key(result)[1:] if value is not None],
+            "baseline_items_per_second": previous["items_per_second"],
+            "items_per_second": result["items_per_second"],
+            "ratio": round(ratio, 3),
+            "regression": ratio < 1 - tolerance
+        })
+    return comparisons
+
+
+def parse_args(argv: List[str] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="LaQual 基准测试（使用本地模拟 SiliconFlow 服务）")
+    parser.add_argument("--only", default="label,metric,question,evaluation,static,similarity",
+                        help="逗号分隔的基准测试：label,metric,question,evaluation,static,similarity")
+    parser.add_argument("--concurrency", default="1,4,16", help="逗号分隔的并发度")
+    parser.add_argument("--latency", type=float, default=0.05, help="模拟服务的基础时延（秒）")
+    parser.add_argument("--jitter", type=float, default=0.02, help="模拟服务的随机时延上限（秒）")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="模拟服务返回 500 的概率")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="模拟服务返回 429 的概率")
+    parser.add_argument("--token-latency", type=float, default=0.001, help="流式输出相邻分片的间隔（秒）")
+    parser.add_argument("--label-groups", type=int, default=32)
+    parser.add_argument("--group-size", type=int, default=16, help="每组应用描述数")
+    parser.add_argument("--tags", type=int, default=32)
+    parser.add_argument("--eval-apps", type=int, default=8)
+    parser.add_argument("--eval-questions", type=int, default=2, help="每个指标的问题数")
+    parser.add_argument("--judge-samples", type=int, default=1)
+    parser.add_argument("--stream-judge", action="store_true", help="以流式方式调用评估模型并提前停止")
+    parser.add_argument("--catalog-size", type=int, default=20000)
+    parser.add_argument("--similarity-groups", type=int, default=20)
+    parser.add_argument("--real-model", action="store_true", help="相似度微基准使用真实的 text2vec 模型")
+    parser.add_argument("--repeat", type=int, default=3, help="微基准重复次数（取最快一次）")
+    parser.add_argument("--seed", type=int, default=2026)
+    parser.add_argument("--quick", action="store_true", help="使用小规模参数快速冒烟")
+    parser.add_argument("--output", help="结果 JSON 路径，默认 benchmarks/results/benchmark_<时间>.json")
+    parser.add_argument("--baseline", help="与之对比的历史结果 JSON")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="吞吐低于基线的容忍比例")
+    parser.add_argument("--fail-on-regression", action="store_true", help="存在回退时以非零状态退出")
+    parser.add_argument("--log-level", default="WARNING")
+    args = parser.parse_args(argv)
+
+    args.only = [name.strip() for name in args.only.split(",") if name.strip()]
+    args.concurrency = [int(value) for value in args.concurrency.split(",")]
+    if args.quick:
+        args.label_groups, args.tags, args.eval_apps = 4, 4, 2
+        args.catalog_size, args.similarity_groups, args.repeat = 2000, 4, 1
+    return args
+
+
+def main():
+    """主函数"""
+    args = parse_args()
+    # 批量模式：逐条目日志只采样输出，避免日志开销干扰测量
+    configure_logging(level=args.log_level, mode="batch")
+    logger.setLevel("INFO")
+
+    report = BenchmarkRunner(args).run()
+    if args.baseline:
+        report["comparison"] = compare_with_baseline(report, args.baseline, args.tolerance)
+
+    output_file = args.output or os.path.join(
+        DEFAULT_OUTPUT_DIR, f"benchmark_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output_file)), exist_ok=True)
+    with open(output_file, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+    regressions = [entry for entry in report.get("comparison", []) if entry["regression"]]
+    for entry in regressions:
+        logger.warning("吞吐回退", extra=fields(**entry))
+    logger.info(f"基准测试结果已保存到: {output_file}")
+
+    if regressions and args.fail_on_regression:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,257 @@
+"""
+LaQual - embedding_store
+功能：持久化的文本向量库
+作者：wang yan
+日期：2026-10-16
+
+向量按行追加存放在 NumPy memmap 文件中（默认 float32），文本哈希 → 行号的索引存放在 SQLite 中；
+标签生成与指标生成共用，同一文本只编码一次，任何进程都可以直接映射已有向量（不整体读入内存），
+并支持全库最近邻查询。
+"""
+
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from instrumentation import metrics
+from similarity_model import SIMILARITY_MODEL_NAME
+from structured_logging import fields, get_logger
+
+logger = get_logger("embedding_store")
+
+DEFAULT_STORE_DIR = os.getenv('LAQUAL_EMBEDDING_STORE') or os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "embedding_store")
+
+# 最近邻查询时每次参与矩阵乘法的行数，控制峰值内存
+NEAREST_BLOCK_ROWS = 65536
+
+# SQLite 单条语句的参数个数上限（旧版本为 999）
+_SQL_BATCH = 500
+
+
+def text_hash(text: str) -> str:
+    """文本的索引键"""
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+def _to_numpy(encoded) -> np.ndarray:
+    """模型输出（torch.Tensor 或 ndarray）→ float32 二维数组"""
+    if hasattr(encoded, "detach"):
+        encoded = encoded.detach().float().cpu().numpy()
+    return np.atleast_2d(np.asarray(encoded, dtype=np.float32))
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+class EmbeddingStore:
+    def __init__(self, path: str = DEFAULT_STORE_DIR, model_name: str = SIMILARITY_MODEL_NAME,
+                 dtype: str = "float32"):
+        """打开（或创建）model_name 对应的向量库，path 下每个模型一个子目录
+
+        向量写入前做 L2 归一化，点积即余弦相似度；dtype 只在新建时生效，已有向量库沿用原有精度。
+        float32 库的读取不做类型转换（最近邻查询直接使用映射的数据）；float16 可将文件大小减半，
+        但量化误差约 1e-3，相似度恰好落在阈值附近（如标签校验的 0.7）的判定可能与不使用向量库时不同，
+        需要显式选用。
+        """
+        self.model_name = model_name
+        self.directory = os.path.join(path, re.sub(r'[^\w.-]+', '_', model_name))
+        self.vectors_file = os.path.join(self.directory, "vectors.bin")
+        os.makedirs(self.directory, exist_ok=True)
+
+        self._lock = threading.Lock()
+        # 自动提交模式，写入时用 BEGIN IMMEDIATE 在进程之间互斥
+        self._conn = sqlite3.connect(os.path.join(self.directory, "index.sqlite"),
+                                     check_same_thread=False, isolation_level=None, timeout=60)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS texts ("
+            "hash TEXT PRIMARY KEY, row INTEGER NOT NULL, text TEXT NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_row ON texts (row)")
+        self._conn.execute("INSERT OR IGNORE INTO meta (name, value) VALUES ('dtype', ?)", (np.dtype(dtype).name,))
+        self._conn.execute("INSERT OR IGNORE INTO meta (name, value) VALUES ('count', '0')")
+        self.dtype = np.dtype(self._meta('dtype'))
+        if self.dtype != np.dtype(dtype):
+            logger.warning(f"向量库已按 {self.dtype.name} 创建，忽略指定的精度 {np.dtype(dtype).name}",
+                           extra=fields(directory=self.directory))
+        # 当前映射；其他进程追加向量后行数可能落后，按需重新映射
+        self._vectors = None
+
+    def _meta(self, name: str) -> Optional[str]:
+        row = self._conn.execute("SELECT value FROM meta WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else None
+
+    @property
+    def dim(self) -> Optional[int]:
+        """向量维度，写入第一批向量前为 None"""
+        with self._lock:
+            value = self._meta('dim')
+        return int(value) if value else None
+
+    def __len__(self) -> int:
+        with self._lock:
+            return int(self._meta('count'))
+
+    def _mapped(self, rows_needed: int) -> np.ndarray:
+        """只读映射向量文件，保证至少覆盖 rows_needed 行"""
+        if self._vectors is None or len(self._vectors) < rows_needed:
+            count, dim = len(self), self.dim
+            if not count:
+                return np.empty((0, dim or 0), dtype=self.dtype)
+            self._vectors = np.memmap(self.vectors_file, dtype=self.dtype, mode='r', shape=(count, dim))
+        return self._vectors
+
+    def _lookup_locked(self, hashes: Sequence[str]) -> dict:
+        found = {}
+        for start in range(0, len(hashes), _SQL_BATCH):
+            batch = hashes[start:start + _SQL_BATCH]
+            found.update(self._conn.execute(
+                f"SELECT hash, row FROM texts WHERE hash IN ({','.join('?' * len(batch))})", batch).fetchall())
+        return found
+
+    def lookup(self, texts: Sequence[str]) -> List[Optional[int]]:
+        """文本 → 行号，未入库的文本为 None"""
+        hashes = [text_hash(text) for text in texts]
+        with self._lock:
+            found = self._lookup_locked(list(set(hashes)))
+        return [found.get(digest) for digest in hashes]
+
+    def vectors(self, rows: Sequence[int]) -> np.ndarray:
+        """按行号读取向量（float32 数组，float32 库只做一次按行复制）"""
+        if not len(rows):
+            return np.empty((0, self.dim or 0), dtype=np.float32)
+        return np.asarray(self._mapped(max(rows) + 1)[list(rows)], dtype=np.float32)
+
+    def add(self, texts: Sequence[str], embeddings) -> List[int]:
+        """写入一批文本的向量，返回各文本的行号（已入库的文本保留原有向量）"""
+        embeddings = _normalize(_to_numpy(embeddings)).astype(self.dtype)
+        hashes = [text_hash(text) for text in texts]
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                dim = self._meta('dim')
+                if dim is None:
+                    self._conn.execute("INSERT INTO meta (name, value) VALUES ('dim', ?)", (str(embeddings.shape[1]),))
+                elif int(dim) != embeddings.shape[1]:
+                    raise ValueError(f"向量维度 {embeddings.shape[1]} 与向量库的维度 {dim} 不一致")
+
+                rows = self._lookup_locked(list(set(hashes)))
+                count = int(self._meta('count'))
+                new = []
+                for i, digest in enumerate(hashes):
+                    if digest not in rows:
+                        rows[digest] = count + len(new)
+                        new.append(i)
+                if new:
+                    # 从索引记录的行数处写入（覆盖上次中断时可能残留的未登记数据）
+                    with open(self.vectors_file, 'r+b' if os.path.exists(self.vectors_file) else 'wb') as f:
+                        f.seek(count * embeddings.shape[1] * self.dtype.itemsize)
+                        f.write(embeddings[new].tobytes())
+                    self._conn.executemany("INSERT INTO texts (hash, row, text) VALUES (?, ?, ?)",
+                                           [(hashes[i], rows[hashes[i]], texts[i]) for i in new])
+                    self._conn.execute("UPDATE meta SET value = ? WHERE name = 'count'", (str(count + len(new)),))
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return [rows[digest] for digest in hashes]
+
+    def encode(self, texts: Sequence[str], model, kind: str = "store") -> np.ndarray:
+        """返回 texts 的归一化向量（float32），只用 model 编码尚未入库的文本"""
+        rows = self.lookup(texts)
+        missing = list(dict.fromkeys(text for text, row in zip(texts, rows) if row is None))
+        metrics.increment("embedding_store_lookups_total", len(texts) - sum(row is None for row in rows),
+                          result="hit")
+        if missing:
+            metrics.increment("embedding_store_lookups_total", sum(row is None for row in rows), result="miss")
+            metrics.increment("embedding_texts_encoded_total", len(missing))
+            with metrics.timer("embedding_encode_seconds", kind=kind):
+                encoded = model.encode(missing, convert_to_tensor=True)
+            added = dict(zip(missing, self.add(missing, encoded)))
+            rows = [added[text] if row is None else row for text, row in zip(texts, rows)]
+        return self.vectors(rows)
+
+    def texts(self, rows: Sequence[int]) -> List[str]:
+        """按行号读取原文"""
+        found = {}
+        with self._lock:
+            unique = list(set(rows))
+            for start in range(0, len(unique), _SQL_BATCH):
+                batch = unique[start:start + _SQL_BATCH]
+                found.update(self._conn.execute(
+                    f"SELECT row, text FROM texts WHERE row IN ({','.join('?' * len(batch))})", batch).fetchall())
+        return [found[row] for row in rows]
+
+    def nearest(self, queries, k: int = 10) -> List[List[Tuple[str, float]]]:
+        """全库最近邻：每个查询向量返回余弦相似度最高的 k 个 (文本, 相似度)，按相似度降序
+
+        向量库按 NEAREST_BLOCK_ROWS 行分块参与计算，内存占用与库大小无关。
+        """
+        queries = _normalize(_to_numpy(queries))
+        vectors = self._mapped(len(self))
+        best_scores = np.empty((len(queries), 0), dtype=np.float32)
+        best_rows = np.empty((len(queries), 0), dtype=np.int64)
+        for start in range(0, len(vectors), NEAREST_BLOCK_ROWS):
+            scores = queries @ np.asarray(vectors[start:start + NEAREST_BLOCK_ROWS], dtype=np.float32).T
+            best_scores = np.concatenate([best_scores, scores], axis=1)
+            best_rows = np.concatenate([best_rows, np.broadcast_to(
+                np.arange(start, start + scores.shape[1]), scores.shape)], axis=1)
+            if best_scores.shape[1] > k:
+                keep = np.argpartition(-best_scores, k - 1, axis=1)[:, :k]
+                best_scores = np.take_along_axis(best_scores, keep, axis=1)
+                best_rows = np.take_along_axis(best_rows, keep, axis=1)
+
+        order = np.argsort(-best_scores, axis=1, kind="stable")
+        best_scores = np.take_along_axis(best_scores, order, axis=1)
+        best_rows = np.take_along_axis(best_rows, order, axis=1)
+        texts = dict(zip(best_rows.ravel().tolist(), self.texts(best_rows.ravel().tolist())))
+        return [[(texts[row], float(score)) for row, score in zip(row_ids, row_scores)]
+                for row_ids, row_scores in zip(best_rows.tolist(), best_scores.tolist())]
+
+    def search(self, texts: Sequence[str], model, k: int = 10) -> List[List[Tuple[str, float]]]:
+        """用 model 编码查询文本（不写入向量库）后做最近邻查询"""
+        with metrics.timer("embedding_encode_seconds", kind="query"):
+            queries = model.encode(list(texts), convert_to_tensor=True)
+        return self.nearest(queries, k)
+
+    def close(self):
+        with self._lock:
+            self._vectors = None
+            self._conn.close()
+
+
+_shared_store = None
+_shared_store_pid = None
+_shared_store_lock = threading.Lock()
+
+
+def get_embedding_store() -> Optional[EmbeddingStore]:
+    """共享相似度模型对应的向量库（每个进程一个连接）
+
+    LAQUAL_EMBEDDING_STORE_DISABLE=1 时或向量库无法打开时返回 None；
+    LAQUAL_EMBEDDING_DTYPE 指定新建向量库的精度：默认 float32，结果与不使用向量库时一致；
+    float16 为可选项，节省一半空间，但可能改变阈值附近的相似度判定。
+    """
+    global _shared_store, _shared_store_pid
+    if (os.getenv('LAQUAL_EMBEDDING_STORE_DISABLE') or '').lower() in ('1', 'true', 'yes'):
+        return None
+    with _shared_store_lock:
+        # 子进程不能复用父进程的 SQLite 连接
+        if _shared_store_pid != os.getpid():
+            _shared_store_pid = os.getpid()
+            try:
+                _shared_store = EmbeddingStore(dtype=os.getenv('LAQUAL_EMBEDDING_DTYPE') or "float32")
+            except (OSError, sqlite3.Error) as e:
+                logger.warning(f"向量库无法打开，将不持久化向量: {str(e)}")
+                _shared_store = None
+        return _shared_store
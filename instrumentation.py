@@ -0,0 +1,248 @@
+"""
+LaQual - instrumentation
+功能：进程内的轻量级性能统计
+作者：wang yan
+日期：2026-10-16
+
+计时器 / 计数器 / 直方图按阶段归类，运行结束时输出 JSON 或 Prometheus textfile 格式的汇总。
+"""
+
+import atexit
+import contextvars
+import functools
+import json
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, List, Tuple
+
+from structured_logging import get_logger
+
+logger = get_logger("instrumentation")
+
+# 设置后在进程退出时自动写出汇总
+METRICS_JSON_FILE = os.getenv('LAQUAL_METRICS_FILE')
+METRICS_PROM_FILE = os.getenv('LAQUAL_METRICS_PROM_FILE')
+
+# 直方图每个序列最多保留的观测值数量，超出后按蓄水池抽样保留
+MAX_SAMPLES = 100000
+QUANTILES = [0.5, 0.9, 0.95, 0.99]
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+class Histogram:
+    def __init__(self, max_samples: int = MAX_SAMPLES):
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+        self.samples = []
+        self.max_samples = max_samples
+
+    def observe(self, value: float):
+        self.count += 1
+        self.sum += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+        if len(self.samples) < self.max_samples:
+            self.samples.append(value)
+        else:
+            index = random.randrange(self.count)
+            if index < self.max_samples:
+                self.samples[index] = value
+
+    def quantile(self, q: float, ordered: List[float] = None) -> float:
+        ordered = ordered if ordered is not None else sorted(self.samples)
+        if not ordered:
+            return 0.0
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def summary(self) -> Dict[str, Any]:
+        ordered = sorted(self.samples)
+        result = {
+            "count": self.count,
+            "sum": round(self.sum, 6),
+            "mean": round(self.sum / self.count, 6) if self.count else 0.0,
+            "min": self.min,
+            "max": self.max
+        }
+        for q in QUANTILES:
+            result[f"p{int(q * 100)}"] = round(self.quantile(q, ordered), 6)
+        return result
+
+
+class MetricsRegistry:
+    def __init__(self):
+        """计数器与直方图均以 (名称, 标签) 区分序列；未显式指定 stage 标签时使用当前阶段
+
+        当前阶段保存在 ContextVar 中，并行运行的阶段（线程或协程）互不覆盖。
+        """
+        self.counters = {}
+        self.histograms = {}
+        self._stage = contextvars.ContextVar(f"laqual_stage_{id(self)}", default="default")
+        self.started_at = time.time()
+        self._lock = threading.Lock()
+
+    @property
+    def current_stage(self) -> str:
+        return self._stage.get()
+
+    def _key(self, labels: Dict[str, Any]) -> LabelKey:
+        labels = dict(labels)
+        labels.setdefault("stage", self.current_stage)
+        return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+    def increment(self, name: str, value: float = 1, **labels):
+        """计数器加 value"""
+        key = (name, self._key(labels))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels):
+        """向直方图记录一个观测值"""
+        key = (name, self._key(labels))
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(value)
+
+    @contextmanager
+    def timer(self, name: str, **labels):
+        """记录代码块耗时（秒）到直方图 name"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    @contextmanager
+    def stage(self, name: str):
+        """在代码块内把统计归入阶段 name，并记录阶段耗时"""
+        token = self._stage.set(name)
+        try:
+            with self.timer("stage_seconds"):
+                yield
+        finally:
+            self._stage.reset(token)
+
+    def staged(self, name: str):
+        """装饰器：函数运行期间的统计归入阶段 name"""
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.stage(name):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def bind_stage(self, func):
+        """把 func 绑定到调用时的阶段，用于提交到线程池的任务（工作线程不继承调用方的上下文）"""
+        name = self._stage.get()
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            token = self._stage.set(name)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self._stage.reset(token)
+        return wrapper
+
+    def summary(self) -> Dict[str, Any]:
+        """按 名称 → 序列 汇总所有统计"""
+        with self._lock:
+            counters = dict(self.counters)
+            histograms = {key: histogram.summary() for key, histogram in self.histograms.items()}
+
+        result = {
+            "started_at": self.started_at,
+            "duration_seconds": round(time.time() - self.started_at, 3),
+            "counters": {},
+            "histograms": {}
+        }
+        for (name, labels), value in sorted(counters.items()):
+            result["counters"].setdefault(name, []).append({"labels": dict(labels), "value": value})
+        for (name, labels), value in sorted(histograms.items()):
+            result["histograms"].setdefault(name, []).append({"labels": dict(labels), **value})
+        return result
+
+    def write_json(self, file_path: str):
+        directory = os.path.dirname(file_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(file_path, 'w', encoding='utf-8') as f:
+            json.dump(self.summary(), f, ensure_ascii=False, indent=2)
+
+    @staticmethod
+    def _escape_label(value: str) -> str:
+        """按 Prometheus 文本格式转义标签值中的反斜杠、双引号和换行"""
+        return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+    @classmethod
+    def _prom_labels(cls, labels: Dict[str, str], extra: Dict[str, str] = None) -> str:
+        labels = dict(labels, **(extra or {}))
+        if not labels:
+            return ""
+        escaped = (f'{name}="{cls._escape_label(value)}"' for name, value in sorted(labels.items()))
+        return "{" + ",".join(escaped) + "}"
+
+    def to_prometheus(self) -> str:
+        """转换为 Prometheus textfile 格式：计数器为 counter，直方图为带分位数的 summary"""
+        summary = self.summary()
+        lines = []
+        for name, series in summary["counters"].items():
+            metric = f"laqual_{name}"
+            lines.append(f"# TYPE {metric} counter")
+            for item in series:
+                lines.append(f"{metric}{self._prom_labels(item['labels'])} {item['value']}")
+        for name, series in summary["histograms"].items():
+            metric = f"laqual_{name}"
+            lines.append(f"# TYPE {metric} summary")
+            for item in series:
+                for q in QUANTILES:
+                    labels = self._prom_labels(item['labels'], {"quantile": str(q)})
+                    lines.append(f"{metric}{labels} {item[f'p{int(q * 100)}']}")
+                lines.append(f"{metric}_sum{self._prom_labels(item['labels'])} {item['sum']}")
+                lines.append(f"{metric}_count{self._prom_labels(item['labels'])} {item['count']}")
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, file_path: str):
+        """写入 textfile（先写临时文件再替换，避免采集到半个文件）"""
+        directory = os.path.dirname(file_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temp_file = file_path + ".tmp"
+        with open(temp_file, 'w', encoding='utf-8') as f:
+            f.write(self.to_prometheus())
+        os.replace(temp_file, file_path)
+
+    def reset(self):
+        with self._lock:
+            self.counters.clear()
+            self.histograms.clear()
+            self.started_at = time.time()
+
+
+metrics = MetricsRegistry()
+
+
+def write_run_summary(json_file: str = None, prom_file: str = None):
+    """写出本次运行的汇总（默认写到环境变量指定的文件）"""
+    json_file = json_file or METRICS_JSON_FILE
+    prom_file = prom_file or METRICS_PROM_FILE
+    try:
+        if json_file:
+            metrics.write_json(json_file)
+            logger.info(f"性能统计已保存到: {json_file}")
+        if prom_file:
+            metrics.write_prometheus(prom_file)
+    except Exception as e:
+        logger.error(f"保存性能统计失败: {str(e)}")
+
+
+if METRICS_JSON_FILE or METRICS_PROM_FILE:
+    atexit.register(write_run_summary)
@@ -5,77 +5,99 @@ LaQual - Label Generation
 日期：2025-01-27
 """
 
+import hashlib
 import json
-import os
 import time
-import requests
 from collections import Counter, defaultdict
-from typing import Dict, List, Set, Tuple
-from sentence_transformers import SentenceTransformer, util
-import torch
+from typing import Dict, List, Optional, Set, Tuple
 import re
+from embedding_store import EmbeddingStore, get_embedding_store
+from instrumentation import metrics
+from siliconflow_client import SiliconFlowAPIError, SiliconFlowClient, SiliconFlowTimeoutError, get_client
+from similarity_model import SIMILARITY_MODEL_NAME, SimilarityModelMixin
+from storage import read_records
+from structured_logging import fields, get_logger
 
-# SiliconFlow API配置
-SILICONFLOW_API_KEY = os.getenv('SILICONFLOW_API_KEY') or 'your_api_key_here'
-SILICONFLOW_API_URL = os.getenv('SILICONFLOW_API_URL') or 'https://api.siliconflow.cn/v1/chat/completions'
+logger = get_logger("label_generation")
 
-class LabelGeneration:
-    def __init__(self):
-        """初始化标签生成器"""
+class LabelGeneration(SimilarityModelMixin):
+    def __init__(self, client: SiliconFlowClient = None, embedding_cache_dir: str = None,
+                 embedding_store: EmbeddingStore = None):
+        """初始化标签生成器
+
+        描述分段的向量持久化到向量库（embedding_store），供后续运行和其他进程复用：
+        未指定时，embedding_cache_dir 不为空则在该目录下打开向量库，
+        否则使用共享相似度模型时使用共享向量库（见 embedding_store.get_embedding_store）。
+        """
         self.data = None
-        self.api_url = SILICONFLOW_API_URL
-        self.headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {SILICONFLOW_API_KEY}"
-        }
-        
-        # 加载相似度模型
-        print("正在加载中文相似度模型...")
-        try:
-            # 设置本地缓存目录
-            cache_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "model_cache")
-            os.makedirs(cache_dir, exist_ok=True)
-            
-            # 使用专门的中文预训练模型
-            self.similarity_model = SentenceTransformer(
-                'shibing624/text2vec-base-chinese',
-                cache_folder=cache_dir,
-                local_files_only=True  # 只使用本地文件
-            )
-            print("中文相似度模型加载成功（使用本地缓存）")
-        except Exception as e:
-            print(f"本地模型加载失败: {str(e)}")
-            try:
-                # 如果本地加载失败，尝试在线下载
-                print("尝试在线下载中文模型...")
-                self.similarity_model = SentenceTransformer(
-                    'shibing624/text2vec-base-chinese',
-                    cache_folder=cache_dir
-                )
-                print("中文相似度模型下载并加载成功")
-            except Exception as e:
-                print(f"模型加载失败: {str(e)}")
-                print("将跳过相似度验证")
-                self.similarity_model = None
+        self.client = client or get_client()
+        self.embedding_cache_dir = embedding_cache_dir
+        if embedding_store is None and embedding_cache_dir:
+            embedding_store = EmbeddingStore(embedding_cache_dir)
+        self.embedding_store = embedding_store
+        # 描述分段向量的进程内缓存：同一组描述在标签重试之间只编码一次
+        self._description_embeddings = {}
 
     def load_apps_data(self, file_path: str) -> bool:
-        """加载应用数据"""
+        """加载应用数据（JSON / JSONL(.gz/.zst) / Parquet / Arrow，按扩展名选择）"""
         try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                self.data = json.load(f)
-                print(f"成功加载应用数据文件: {file_path}")
-                return True
+            self.data = read_records(file_path)
+            logger.info(f"成功加载应用数据文件: {file_path}")
+            return True
         except Exception as e:
-            print(f"加载应用数据文件失败: {str(e)}")
+            logger.error(f"加载应用数据文件失败: {str(e)}", extra=fields(file=file_path))
             return False
 
+    @staticmethod
+    def _description_cache_key(chunks: List[str]) -> str:
+        """由模型名和分段文本计算缓存键"""
+        digest = hashlib.sha256(SIMILARITY_MODEL_NAME.encode('utf-8'))
+        for chunk in chunks:
+            digest.update(b'\0')
+            digest.update(chunk.encode('utf-8'))
+        return digest.hexdigest()
+
+    def active_embedding_store(self) -> Optional[EmbeddingStore]:
+        """当前使用的向量库：显式指定的向量库，或使用共享相似度模型时的共享向量库"""
+        if self.embedding_store is not None:
+            return self.embedding_store
+        if self.uses_shared_similarity_model:
+            return get_embedding_store()
+        return None
+
+    def encode_description_chunks(self, chunks: List[str]):
+        """批量编码描述分段，结果按文本哈希缓存（进程内 + 向量库）"""
+        import torch
+        
+        key = self._description_cache_key(chunks)
+        embeddings = self._description_embeddings.get(key)
+        if embeddings is not None:
+            metrics.increment("embedding_cache_lookups_total", result="memory_hit")
+            return embeddings
+        
+        metrics.increment("embedding_cache_lookups_total", result="miss")
+        store = self.active_embedding_store()
+        if store is not None:
+            # 向量库只编码其中尚未入库的分段
+            embeddings = torch.from_numpy(store.encode(chunks, self.similarity_model, kind="description"))
+        else:
+            metrics.increment("embedding_texts_encoded_total", len(chunks))
+            with metrics.timer("embedding_encode_seconds", kind="description"):
+                embeddings = self.similarity_model.encode(chunks, convert_to_tensor=True)
+        
+        self._description_embeddings[key] = embeddings
+        return embeddings
+
     def verify_tag_similarity(self, tag: str, descriptions: List[str]) -> bool:
         """使用中文预训练模型验证标签与描述的语义相似度"""
         if self.similarity_model is None:
-            print("相似度模型未加载，跳过相似度验证")
+            logger.info("相似度模型未加载，跳过相似度验证")
             return True
             
         try:
+            import torch
+            from sentence_transformers import util
+            
             # 预处理标签和描述
             def preprocess_text(text):
                 # 移除标点符号
@@ -87,41 +109,45 @@ class LabelGeneration:
             tag = preprocess_text(tag)
             processed_descriptions = [preprocess_text(desc) for desc in descriptions]
             
-            # 编码标签
-            tag_embedding = self.similarity_model.encode(tag, convert_to_tensor=True)
-            
-            # 计算与每个描述的相似度
-            similarities = []
+            # 将长描述分段，每段最多100个字符，记录每个描述的分段数
+            chunks = []
+            chunk_counts = []
             for desc in processed_descriptions:
-                # 将长描述分段，每段最多100个字符
                 desc_chunks = [desc[i:i+100] for i in range(0, len(desc), 100)]
-                chunk_similarities = []
-                
-                for chunk in desc_chunks:
-                    chunk_embedding = self.similarity_model.encode(chunk, convert_to_tensor=True)
-                    similarity = util.pytorch_cos_sim(tag_embedding, chunk_embedding)
-                    chunk_similarities.append(similarity.item())
-                
-                # 取每个描述中最高的相似度
-                max_chunk_similarity = max(chunk_similarities)
-                similarities.append(max_chunk_similarity)
+                chunks.extend(desc_chunks)
+                chunk_counts.append(len(desc_chunks))
+            
+            if not all(chunk_counts):
+                raise ValueError("存在空的应用描述，无法计算相似度")
+            
+            # 描述分段批量编码并缓存，重试时只需编码新的候选标签
+            chunk_embeddings = self.encode_description_chunks(chunks)
+            with metrics.timer("embedding_encode_seconds", kind="tag"):
+                tag_embedding = self.similarity_model.encode(tag, convert_to_tensor=True)
+            chunk_embeddings = chunk_embeddings.to(tag_embedding.device)
+            
+            # 一次计算标签与全部分段的相似度，再按描述分段取最大值
+            chunk_similarities = util.pytorch_cos_sim(tag_embedding, chunk_embeddings)[0]
+            lengths = torch.tensor(chunk_counts, device=chunk_similarities.device)
+            similarities = torch.segment_reduce(chunk_similarities, "max", lengths=lengths).tolist()
             
             # 计算平均相似度
             avg_similarity = sum(similarities) / len(similarities)
-            print(f"标签相似度: {avg_similarity:.3f}")
             
             # 计算最大相似度
             max_similarity = max(similarities)
-            print(f"最大相似度: {max_similarity:.3f}")
             
-            # 输出相似度最高的描述
+            # 记录相似度最高的描述
             max_similarity_index = similarities.index(max_similarity)
-            print(f"相似度最高的描述: {descriptions[max_similarity_index][:100]}...")
+            logger.info("标签相似度", extra=fields(
+                tag=tag, avg_similarity=round(avg_similarity, 3), max_similarity=round(max_similarity, 3),
+                most_similar_description=descriptions[max_similarity_index][:100]
+            ))
             
             # 如果平均相似度超过0.7或最大相似度超过0.7，就认为标签合适
             return avg_similarity >= 0.7 or max_similarity >= 0.7
         except Exception as e:
-            print(f"相似度计算失败: {str(e)}")
+            logger.warning(f"相似度计算失败: {str(e)}", extra=fields(tag=tag))
             return True  # 如果相似度计算失败，默认通过验证
 
     def generate_tag_from_descriptions(self, descriptions: List[str]) -> str:
@@ -157,12 +183,9 @@ class LabelGeneration:
         attempt = 1
         while True:  # 无限循环，直到生成满足要求的标签
             try:
-                print(f"\n正在尝试第 {attempt} 次生成标签...")
-                print("开始调用API...")
-                response = requests.post(
-                    self.api_url,
-                    headers=self.headers,
-                    json={
+                logger.info(f"正在尝试第 {attempt} 次生成标签...", extra=fields(attempt=attempt))
+                content = self.client.chat(
+                    {
                         "model": "Qwen/QwQ-32B",
                         "messages": [{"role": "user", "content": prompt}],
                         "stream": False,
@@ -173,41 +196,34 @@ class LabelGeneration:
                         "n": 1,
                         "response_format": {"type": "text"}
                     },
-                    timeout=120
+                    timeout=120,
+                    refresh=attempt > 1  # 重新生成时不复用上一次的缓存结果
                 )
-                print("API调用完成，开始解析响应...")
-                response.raise_for_status()
-                tag = response.json()['choices'][0]['message']['content'].strip()
+                tag = content.strip()
                 tag = tag.splitlines()[0].strip()  # 只取第一行作为标签
-                print(f"生成的标签: {tag}")
+                logger.info(f"生成的标签: {tag}", extra=fields(attempt=attempt))
                 
-                print("开始验证标签相似度...")
                 # 验证标签相似度
                 if self.verify_tag_similarity(tag, descriptions):
-                    print(f"\n✅ 成功生成标签: {tag}")
+                    logger.info(f"成功生成标签: {tag}", extra=fields(attempt=attempt))
                     return tag
                 else:
-                    print(f"\n⚠️ 标签相似度不足，将重新生成...")
+                    logger.warning("标签相似度不足，将重新生成...", extra=fields(tag=tag, attempt=attempt))
                 
-            except requests.exceptions.Timeout:
-                print(f"\n❌ 第 {attempt} 次尝试超时")
-                print("超时发生在:")
-                import traceback
-                print(traceback.format_exc())
-            except requests.exceptions.RequestException as e:
-                print(f"\n❌ 第 {attempt} 次尝试失败: {str(e)}")
+            except SiliconFlowTimeoutError:
+                logger.warning(f"第 {attempt} 次尝试超时", exc_info=True)
+            except SiliconFlowAPIError as e:
+                logger.warning(f"第 {attempt} 次尝试失败: {str(e)}")
             except Exception as e:
-                print(f"\n❌ 第 {attempt} 次尝试出错: {str(e)}")
-                print("错误发生在:")
-                import traceback
-                print(traceback.format_exc())
+                logger.error(f"第 {attempt} 次尝试出错: {str(e)}", exc_info=True)
             
             # 指数退避重试
             retry_delay = min(2 ** (attempt - 1), 30)
-            print(f"\n⏳ {retry_delay}秒后进行第{attempt + 1}次尝试...")
+            logger.info(f"{retry_delay}秒后进行第{attempt + 1}次尝试...")
             time.sleep(retry_delay)
             attempt += 1
 
+    @metrics.staged("label")
     def generate_label_for_apps(self, apps_data: Dict) -> Dict:
         """根据应用数据生成标签"""
         try:
@@ -220,17 +236,17 @@ class LabelGeneration:
                 # 如果是包含apps字段的对象
                 descriptions = [app.get('description', '') for app in apps_data.get('apps', [])]
             else:
-                print("输入数据格式不正确")
+                logger.error("输入数据格式不正确")
                 return None
 
             if not descriptions:
-                print("未找到应用描述")
+                logger.error("未找到应用描述")
                 return None
 
             # 生成标签
             tag = self.generate_tag_from_descriptions(descriptions)
             if not tag:
-                print("生成标签失败")
+                logger.error("生成标签失败")
                 return None
 
             # 构建结果
@@ -243,7 +259,7 @@ class LabelGeneration:
             return result
 
         except Exception as e:
-            print(f"处理应用数据时出错: {str(e)}")
+            logger.error(f"处理应用数据时出错: {str(e)}")
             return None
 
 
@@ -255,27 +271,25 @@ def main():
     # 加载应用数据
     apps_file = "../sample_apps.json"
     if not generator.load_apps_data(apps_file):
-        print("❌ 应用数据加载失败")
+        logger.error("应用数据加载失败")
         return
     
     # 生成标签
     result = generator.generate_label_for_apps(generator.data)
     
     if result:
-        print(f"\n✅ 标签生成完成")
-        print(f"生成的标签: {result['标签']}")
-        print(f"应用数量: {result['应用数量']}")
+        logger.info("标签生成完成", extra=fields(tag=result['标签'], app_count=result['应用数量']))
         
         # 保存结果
         output_file = "generated_label.json"
         try:
             with open(output_file, 'w', encoding='utf-8') as f:
                 json.dump(result, f, ensure_ascii=False, indent=2)
-            print(f"✅ 标签已保存到: {output_file}")
+            logger.info(f"标签已保存到: {output_file}")
         except Exception as e:
-            print(f"保存结果失败: {str(e)}")
+            logger.error(f"保存结果失败: {str(e)}")
     else:
-        print("❌ 标签生成失败")
+        logger.error("标签生成失败")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,168 @@
+"""
+LaQual - llm_cache
+功能：基于SQLite的LLM响应持久化缓存
+作者：wang yan
+日期：2026-10-16
+
+按 模型 + 消息 + 采样参数 的哈希寻址。
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Optional
+
+DEFAULT_CACHE_PATH = os.getenv('LAQUAL_LLM_CACHE_PATH') or os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "llm_cache", "responses.sqlite")
+
+# 不影响生成结果的请求字段，不参与缓存键计算
+_NON_SEMANTIC_FIELDS = {"stream", "stream_options"}
+
+
+class LLMCache:
+    def __init__(self, path: str = DEFAULT_CACHE_PATH, max_entries: int = 200000,
+                 max_age_seconds: float = None, enabled: bool = True, evict_interval: int = 500):
+        """初始化缓存
+
+        max_entries 超出时按最近访问时间淘汰；max_age_seconds 为空表示条目永不过期；
+        enabled=False 时完全绕过缓存（既不读也不写）。
+        """
+        self.path = path
+        self.max_entries = max_entries
+        self.max_age_seconds = max_age_seconds
+        self.enabled = enabled
+        self.evict_interval = evict_interval
+        self.hits = 0
+        self.misses = 0
+        self._puts_since_evict = 0
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def _connect(self) -> sqlite3.Connection:
+        """首次使用时打开数据库"""
+        if self._conn is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+                "created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_accessed_at ON responses (accessed_at)")
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    @staticmethod
+    def make_key(payload: Dict[str, Any]) -> str:
+        """计算请求的缓存键"""
+        semantic = {k: v for k, v in payload.items() if k not in _NON_SEMANTIC_FIELDS}
+        canonical = json.dumps(semantic, ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+        return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """读取缓存，未命中或已过期时返回 None"""
+        if not self.enabled:
+            return None
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            row = conn.execute("SELECT value, created_at FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None or (self.max_age_seconds is not None and now - row[1] > self.max_age_seconds):
+                self.misses += 1
+                return None
+            conn.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+            conn.commit()
+            self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, key: str, value: Dict[str, Any]):
+        """写入缓存（同键覆盖）"""
+        if not self.enabled:
+            return
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            conn.execute(
+                "INSERT OR REPLACE INTO responses (key, value, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value, ensure_ascii=False), now, now)
+            )
+            conn.commit()
+            self._puts_since_evict += 1
+            if self._puts_since_evict >= self.evict_interval:
+                self._evict_locked()
+
+    def delete(self, key: str):
+        """删除单个缓存条目"""
+        if not self.enabled:
+            return
+        with self._lock:
+            conn = self._connect()
+            conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            conn.commit()
+
+    def _evict_locked(self):
+        conn = self._connect()
+        if self.max_age_seconds is not None:
+            conn.execute("DELETE FROM responses WHERE created_at < ?", (time.time() - self.max_age_seconds,))
+        if self.max_entries is not None:
+            conn.execute(
+                "DELETE FROM responses WHERE key IN ("
+                "SELECT key FROM responses ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            )
+        conn.commit()
+        self._puts_since_evict = 0
+
+    def evict(self):
+        """按过期时间和条目上限淘汰缓存"""
+        if not self.enabled:
+            return
+        with self._lock:
+            self._evict_locked()
+
+    def clear(self):
+        """清空缓存并重置计数"""
+        with self._lock:
+            conn = self._connect()
+            conn.execute("DELETE FROM responses")
+            conn.commit()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self) -> Dict[str, Any]:
+        """返回命中统计"""
+        with self._lock:
+            entries = 0
+            if self.enabled:
+                entries = self._connect().execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+            lookups = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": entries
+            }
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+def cache_from_env() -> LLMCache:
+    """根据环境变量创建缓存，LAQUAL_LLM_CACHE_DISABLE=1 时绕过缓存"""
+    disabled = (os.getenv('LAQUAL_LLM_CACHE_DISABLE') or '').lower() in ('1', 'true', 'yes')
+    max_age = os.getenv('LAQUAL_LLM_CACHE_MAX_AGE')
+    return LLMCache(
+        max_entries=int(os.getenv('LAQUAL_LLM_CACHE_MAX_ENTRIES') or 200000),
+        max_age_seconds=float(max_age) if max_age else None,
+        enabled=not disabled
+    )
@@ -0,0 +1,457 @@
+"""
+LaQual - pipeline
+功能：五个评估阶段的统一流水线
+作者：wang yan
+日期：2026-10-16
+
+标签生成 → 指标生成 → 静态指标筛选 → 评估任务生成 → 响应质量评估，按依赖关系执行，
+根据输入/配置指纹只重跑发生变化的阶段及其中变化的分区（标签 / 应用）。
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+from instrumentation import metrics, write_run_summary
+from storage import file_format, is_columnar, load_tag_metrics, read_records, save_tag_metrics, write_records
+from structured_logging import configure_logging, fields, get_logger, item
+
+logger = get_logger("pipeline")
+
+# 默认文件路径，与各模块 main() 中使用的路径一致，可通过配置文件覆盖；
+# 各文件的格式由扩展名决定（JSON / JSONL(.gz/.zst) / Parquet / Arrow，见 storage）
+DEFAULT_PIPELINE_CONFIG = {
+    "app_groups_file": "../data/app_groups.json",          # {分组名: 应用描述列表 或 {"apps": [...]}}
+    "labels_file": "../data/labels.json",
+    "metrics_file": "../data/tag_metrics.json",
+    "apps_file": "sample_apps.json",
+    "filtered_apps_file": "filtered_apps.json",
+    "questions_file": "../data/output/tag_evaluation_questions.json",
+    "test_results_file": "../results/app_test_results.json",
+    "evaluation_file": "../results/evaluation_results.json",
+    "state_dir": "../results/pipeline_state",
+    "static_engine": "vectorized",
+    "static_index_file": None,                             # 设置后静态筛选只重新检查变化的应用
+    "max_workers": 1
+}
+
+
+def fingerprint(value: Any) -> str:
+    """计算可JSON序列化对象的指纹"""
+    text = json.dumps(value, ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def file_fingerprint(file_path: str) -> Optional[str]:
+    """计算文件内容的指纹，文件不存在时返回 None"""
+    if not os.path.exists(file_path):
+        return None
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def load_labels(file_path: str) -> List[Dict[str, Any]]:
+    """读取标签文件：JSON 为 {分组名: 标签}，其余格式为每个标签一行"""
+    labels = read_records(file_path)
+    return list(labels.values()) if isinstance(labels, dict) else labels
+
+
+def save_labels(labels: Dict[str, Any], file_path: str):
+    """写出 {分组名: 标签}，格式由扩展名决定（非 JSON 格式只保留标签本身）"""
+    write_records(labels if file_format(file_path) == "json" else list(labels.values()), file_path)
+
+
+class Stage:
+    def __init__(self, name: str, inputs: List[str], outputs: List[str], deps: List[str] = None,
+                 version: str = "1", config: Dict[str, Any] = None,
+                 run: Callable[[], None] = None,
+                 partitions: Callable[[], Dict[str, Any]] = None,
+                 run_partition: Callable[[str, Any], Any] = None,
+                 assemble: Callable[[Dict[str, Any]], None] = None):
+        """定义一个流水线阶段
+
+        inputs / outputs 为文件路径；deps 为上游阶段名。
+        不分区的阶段提供 run()；分区阶段提供 partitions()（分区键 → 分区输入）、
+        run_partition(键, 分区输入)（返回分区结果，None 表示失败、下次重跑）
+        以及 assemble(按顺序排列的全部分区结果)（写出阶段输出）。
+        修改阶段逻辑后应提高 version，使已有结果失效。
+        """
+        self.name = name
+        self.inputs = inputs
+        self.outputs = outputs
+        self.deps = deps or []
+        self.version = version
+        self.config = config or {}
+        self.run = run
+        self.partitions = partitions
+        self.run_partition = run_partition
+        self.assemble = assemble
+
+    @property
+    def partitioned(self) -> bool:
+        return self.partitions is not None
+
+    def fingerprint(self) -> str:
+        """阶段指纹：版本 + 配置 + 所有输入文件内容"""
+        return fingerprint({
+            "version": self.version,
+            "config": self.config,
+            "inputs": {path: file_fingerprint(path) for path in self.inputs}
+        })
+
+    def partition_fingerprint(self, partition_input: Any) -> str:
+        return fingerprint({"version": self.version, "config": self.config, "input": partition_input})
+
+
+class PipelineState:
+    """记录每个阶段上次成功运行时的指纹及各分区的结果（每个阶段一个JSON文件）"""
+
+    def __init__(self, state_dir: str):
+        self.state_dir = state_dir
+
+    def _path(self, stage_name: str) -> str:
+        return os.path.join(self.state_dir, f"{stage_name}.json")
+
+    def load(self, stage_name: str) -> Dict[str, Any]:
+        path = self._path(stage_name)
+        if not os.path.exists(path):
+            return {"fingerprint": None, "partitions": {}}
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"阶段状态文件损坏，将重新运行: {path} ({str(e)})")
+            return {"fingerprint": None, "partitions": {}}
+
+    def save(self, stage_name: str, state: Dict[str, Any]):
+        """原子写入：同目录下的临时文件写完并落盘后再替换，中断时保留上一次的完整状态"""
+        path = self._path(stage_name)
+        os.makedirs(self.state_dir, exist_ok=True)
+        fd, temp_file = tempfile.mkstemp(prefix=f".{stage_name}.", suffix=".tmp", dir=self.state_dir)
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(state, f, ensure_ascii=False, indent=2)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_file, path)
+        except BaseException:
+            if os.path.exists(temp_file):
+                os.remove(temp_file)
+            raise
+
+
+class Pipeline:
+    def __init__(self, stages: List[Stage], state_dir: str, max_workers: int = 1):
+        """stages 构成有向无环图，执行时按依赖顺序排列"""
+        self.stages = {stage.name: stage for stage in stages}
+        self.state = PipelineState(state_dir)
+        self.max_workers = max_workers
+        for stage in stages:
+            for dep in stage.deps:
+                if dep not in self.stages:
+                    raise ValueError(f"阶段 {stage.name} 依赖的阶段不存在: {dep}")
+        self.order = self._topological_order()
+
+    def _topological_order(self) -> List[str]:
+        order = []
+        visiting = set()
+
+        def visit(name: str):
+            if name in order:
+                return
+            if name in visiting:
+                raise ValueError(f"阶段依赖存在环: {name}")
+            visiting.add(name)
+            for dep in self.stages[name].deps:
+                visit(dep)
+            visiting.discard(name)
+            order.append(name)
+
+        for name in self.stages:
+            visit(name)
+        return order
+
+    def _select(self, targets: List[str] = None) -> List[str]:
+        """目标阶段及其全部上游阶段（按执行顺序）"""
+        if not targets:
+            return list(self.order)
+        selected = set()
+
+        def add(name: str):
+            if name not in self.stages:
+                raise ValueError(f"未知阶段: {name}")
+            if name not in selected:
+                selected.add(name)
+                for dep in self.stages[name].deps:
+                    add(dep)
+
+        for target in targets:
+            add(target)
+        return [name for name in self.order if name in selected]
+
+    @staticmethod
+    def modified_outputs(stage: Stage, state: Dict[str, Any]) -> List[str]:
+        """内容与上次运行写出时不同的输出文件（已删除的输出不算，会重新生成）"""
+        recorded = state.get("outputs", {})
+        return [path for path in stage.outputs
+                if recorded.get(path) and os.path.exists(path) and file_fingerprint(path) != recorded[path]]
+
+    def is_stale(self, stage: Stage, state: Dict[str, Any]) -> bool:
+        return (state.get("fingerprint") != stage.fingerprint()
+                or not all(os.path.exists(path) for path in stage.outputs))
+
+    def run(self, targets: List[str] = None, force: bool = False, dry_run: bool = False) -> Dict[str, Any]:
+        """执行流水线，返回每个阶段的执行情况
+
+        force=True 时忽略已有指纹重跑所选阶段的全部分区；dry_run=True 时只输出执行计划。
+        阶段输出在上次运行后被修改过（如手工编辑了指标文件）时不覆盖，跳过该阶段并报告
+        outputs_modified；force=True 时照常覆盖。
+        """
+        summary = {}
+        for name in self._select(targets):
+            stage = self.stages[name]
+            state = self.state.load(name)
+            if not force and not self.is_stale(stage, state):
+                logger.info(f"阶段 {name}: 输入未变化，跳过", extra=fields(stage=name))
+                summary[name] = {"status": "skipped"}
+                continue
+
+            modified = self.modified_outputs(stage, state)
+            if modified and not force:
+                logger.error(f"阶段 {name}: 输出文件在上次运行后被修改，不覆盖（确认后使用 --force 重跑）",
+                             extra=fields(stage=name, modified=modified))
+                summary[name] = {"status": "outputs_modified", "modified": modified}
+                continue
+
+            missing = [path for path in stage.inputs if not os.path.exists(path)]
+            if missing:
+                logger.error(f"阶段 {name}: 缺少输入文件，跳过", extra=fields(stage=name, missing=missing))
+                summary[name] = {"status": "missing_inputs", "missing": missing}
+                continue
+
+            with metrics.stage(name):
+                if stage.partitioned:
+                    summary[name] = self._run_partitioned(stage, state, force, dry_run)
+                else:
+                    logger.info(f"阶段 {name}: {'将运行' if dry_run else '运行中'}", extra=fields(stage=name))
+                    if not dry_run:
+                        stage.run()
+                    summary[name] = {"status": "planned" if dry_run else "ran"}
+
+            if dry_run:
+                continue
+            if summary[name].get("failed"):
+                # 存在失败分区时不记录阶段指纹，下次运行时重试这些分区
+                state["fingerprint"] = None
+            else:
+                state["fingerprint"] = stage.fingerprint()
+            state["outputs"] = {path: file_fingerprint(path) for path in stage.outputs}
+            self.state.save(name, state)
+        return summary
+
+    def _run_partitioned(self, stage: Stage, state: Dict[str, Any], force: bool,
+                         dry_run: bool) -> Dict[str, Any]:
+        partitions = stage.partitions()
+        previous = state.get("partitions", {})
+        fingerprints = {key: stage.partition_fingerprint(value) for key, value in partitions.items()}
+        stale = [key for key in partitions
+                 if force or previous.get(key, {}).get("fingerprint") != fingerprints[key]]
+        removed = [key for key in previous if key not in partitions]
+
+        logger.info(f"阶段 {stage.name}: 共 {len(partitions)} 个分区，"
+                    f"{'将重跑' if dry_run else '重跑'} {len(stale)} 个，删除 {len(removed)} 个",
+                    extra=fields(stage=stage.name))
+        if dry_run:
+            return {"status": "planned", "partitions": len(partitions), "stale": stale, "removed": removed}
+
+        current = {key: previous[key] for key in partitions if key in previous and key not in stale}
+        metrics.increment("pipeline_partitions_total", len(current), result="reused")
+        state["partitions"] = current
+        failed = []
+        lock = threading.Lock()
+
+        def run_one(key: str):
+            logger.info("运行分区", extra=item(stage=stage.name, partition=key))
+            try:
+                result = stage.run_partition(key, partitions[key])
+            except Exception as e:
+                logger.error(f"分区运行出错: {str(e)}", extra=fields(stage=stage.name, partition=key))
+                result = None
+            if result is None:
+                failed.append(key)
+                metrics.increment("pipeline_partitions_total", result="failed")
+                return
+            metrics.increment("pipeline_partitions_total", result="ran")
+            with lock:
+                current[key] = {"fingerprint": fingerprints[key], "result": result}
+                # 每完成一个分区即保存状态，中断后只需重跑未完成的分区
+                self.state.save(stage.name, state)
+
+        if self.max_workers > 1 and len(stale) > 1:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                list(executor.map(metrics.bind_stage(run_one), stale))
+        else:
+            for key in stale:
+                run_one(key)
+
+        # 按分区原有顺序汇总结果（失败的分区不写入输出）
+        stage.assemble({key: current[key]["result"] for key in partitions if key in current})
+        return {"status": "ran", "partitions": len(partitions), "rerun": len(stale) - len(failed),
+                "failed": failed, "removed": removed}
+
+
+def _app_partition_key(app_result: Dict[str, Any], seen: Dict[str, int]) -> str:
+    """应用分区键：优先使用URL，重复时追加序号"""
+    app_info = app_result.get('app_info', {}) if isinstance(app_result, dict) else {}
+    key = app_info.get('url') or app_info.get('title') or "Unknown"
+    seen[key] = seen.get(key, 0) + 1
+    return key if seen[key] == 1 else f"{key}#{seen[key]}"
+
+
+def build_laqual_pipeline(config: Dict[str, Any] = None) -> Pipeline:
+    """按配置构建 LaQual 五阶段流水线"""
+    from Static_indicator_evaluation import screening_rules_fingerprint
+
+    config = dict(DEFAULT_PIPELINE_CONFIG, **(config or {}))
+
+    # 标签生成：每个应用分组一个分区
+    def label_partitions():
+        return read_records(config["app_groups_file"])
+
+    def label_run(group, apps_data):
+        from label_generation import LabelGeneration
+        return LabelGeneration().generate_label_for_apps(apps_data)
+
+    def label_assemble(results):
+        save_labels(results, config["labels_file"])
+
+    # 指标生成：每个标签一个分区
+    def metric_partitions():
+        return {label["标签"]: {"标签": label["标签"]} for label in load_labels(config["labels_file"])}
+
+    def metric_run(tag, _):
+        from Metric_generation import MetricGeneration
+        return MetricGeneration().call_api_for_metrics_for_tag(tag) or None
+
+    def metric_assemble(results):
+        save_tag_metrics(results, config["metrics_file"])
+
+    # 静态指标筛选：整体运行
+    def static_run():
+        from Static_indicator_evaluation import AppTester
+        AppTester().process_apps_batch(config["apps_file"], config["filtered_apps_file"],
+                                       engine=config["static_engine"], index_file=config["static_index_file"])
+
+    # 评估任务生成：每个标签一个分区，分区输入为该标签的指标与标签信息
+    def task_partitions():
+        metrics_data = load_tag_metrics(config["metrics_file"])
+        labels = {}
+        if os.path.exists(config["labels_file"]):
+            labels = {label["标签"]: label for label in load_labels(config["labels_file"])}
+        return {
+            tag: {
+                "标签": tag,
+                "应用数量": labels.get(tag, {}).get("应用数量", 0),
+                "应用描述": labels.get(tag, {}).get("应用描述", []),
+                "评估指标": tag_metrics
+            }
+            for tag, tag_metrics in metrics_data.items()
+        }
+
+    def task_run(tag, tag_metrics):
+        from Evaluation_task_generation import QuestionGenerator
+        questions = QuestionGenerator().process_metrics(tag_metrics)
+        # 部分指标失败时不记录该分区，下次运行时重试
+        return questions if len(questions) == len(tag_metrics["评估指标"]) else None
+
+    def task_assemble(results):
+        write_records([question for questions in results.values() for question in questions],
+                      config["questions_file"])
+
+    # 响应质量评估：每个应用一个分区，分区输入为该应用的测试结果及其涉及标签的指标
+    def evaluation_partitions():
+        test_results = read_records(config["test_results_file"])
+        metrics_data = load_tag_metrics(config["metrics_file"])
+        seen = {}
+        partitions = {}
+        for app_result in test_results:
+            tags = app_result.get('responses', {}).keys()
+            partitions[_app_partition_key(app_result, seen)] = {
+                "app_result": app_result,
+                "metrics": {tag: metrics_data[tag] for tag in tags if tag in metrics_data}
+            }
+        return partitions
+
+    def evaluation_run(key, partition):
+        from Response_quality_evaluation import EvaluationJournal, ResponseEvaluator
+        # 每个应用一个断点日志：部分问题评估失败时分区记为失败，下次只重新评估失败的问题
+        journal = EvaluationJournal(os.path.join(
+            config["state_dir"], "evaluation_journal", hashlib.sha1(key.encode('utf-8')).hexdigest() + ".jsonl"))
+        evaluation = ResponseEvaluator().evaluate_app(partition["app_result"], partition["metrics"], journal)
+        if any(detail['content_score'] <= 0 for detail in evaluation['evaluation_details']):
+            return None
+        journal.complete()
+        return evaluation
+
+    def evaluation_assemble(results):
+        from Response_quality_evaluation import evaluation_rows
+        app_evaluations = list(results.values())
+        write_records(evaluation_rows(app_evaluations) if is_columnar(config["evaluation_file"]) else app_evaluations,
+                      config["evaluation_file"])
+
+    stages = [
+        Stage("label", [config["app_groups_file"]], [config["labels_file"]],
+              partitions=label_partitions, run_partition=label_run, assemble=label_assemble),
+        Stage("metric", [config["labels_file"]], [config["metrics_file"]], deps=["label"],
+              partitions=metric_partitions, run_partition=metric_run, assemble=metric_assemble),
+        Stage("static", [config["apps_file"]], [config["filtered_apps_file"]],
+              config={"engine": config["static_engine"], "screening": screening_rules_fingerprint()},
+              run=static_run),
+        Stage("task", [config["metrics_file"], config["labels_file"]], [config["questions_file"]],
+              deps=["metric"], partitions=task_partitions, run_partition=task_run, assemble=task_assemble),
+        Stage("evaluation", [config["test_results_file"], config["metrics_file"]],
+              [config["evaluation_file"]], deps=["metric"],
+              partitions=evaluation_partitions, run_partition=evaluation_run, assemble=evaluation_assemble),
+    ]
+    return Pipeline(stages, config["state_dir"], max_workers=config["max_workers"])
+
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description="LaQual 流水线：增量执行各阶段")
+    parser.add_argument("stages", nargs="*", help="要执行的阶段（同时执行其上游阶段），默认全部")
+    parser.add_argument("--config", default=os.getenv('LAQUAL_PIPELINE_CONFIG'),
+                        help="覆盖默认路径等配置的JSON文件")
+    parser.add_argument("--force", action="store_true",
+                        help="忽略指纹，重跑所选阶段（会覆盖上次运行后被手工修改的输出文件）")
+    parser.add_argument("--dry-run", action="store_true", help="只输出执行计划")
+    parser.add_argument("--workers", type=int, help="分区并发数")
+    parser.add_argument("--batch-log", action="store_true",
+                        help="批量日志模式：逐条目日志采样输出，只保留汇总信息")
+    parser.add_argument("--metrics-file", help="本次运行性能统计（JSON）的保存路径")
+    parser.add_argument("--metrics-prom-file", help="本次运行性能统计（Prometheus textfile）的保存路径")
+    args = parser.parse_args()
+
+    if args.batch_log:
+        configure_logging(mode="batch")
+    
+    config = read_records(args.config) if args.config else {}
+    if args.workers:
+        config["max_workers"] = args.workers
+
+    pipeline = build_laqual_pipeline(config)
+    summary = pipeline.run(args.stages, force=args.force, dry_run=args.dry_run)
+    logger.info("流水线执行完成", extra=fields(summary=summary))
+    if args.metrics_file or args.metrics_prom_file:
+        write_run_summary(args.metrics_file, args.metrics_prom_file)
+
+if __name__ == "__main__":
+    main()
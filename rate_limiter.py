@@ -0,0 +1,205 @@
+"""
+LaQual - rate_limiter
+功能：客户端令牌桶限流
+作者：wang yan
+日期：2026-10-16
+
+按模型配置每分钟请求数 + 每分钟Token数，收到429时自适应降速并逐步恢复；
+未配置限额的模型不预先限流，收到429后按实际观测到的请求速率降速。
+"""
+
+import json
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, List, Optional
+
+# 预估输出Token数时按 max_tokens 的该比例计算（请求完成后按实际用量多退少补），
+# 可通过 LAQUAL_OUTPUT_TOKEN_FRACTION 调整
+OUTPUT_TOKEN_FRACTION = float(os.getenv('LAQUAL_OUTPUT_TOKEN_FRACTION') or 0.25)
+
+
+class TokenBucket:
+    def __init__(self, rate_per_minute: float, burst_seconds: float = 10.0):
+        """rate_per_minute 为稳定速率，桶容量为 burst_seconds 秒内可消耗的量"""
+        self.rate_per_minute = rate_per_minute
+        self.burst_seconds = burst_seconds
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+
+    @property
+    def capacity(self) -> float:
+        return max(1.0, self.rate_per_minute * self.burst_seconds / 60.0)
+
+    def refill(self, now: float, fraction: float = 1.0):
+        """按当前速率（乘以自适应系数）补充令牌"""
+        elapsed = now - self.updated_at
+        self.updated_at = now
+        self.tokens = min(self.capacity, self.tokens + elapsed * self.rate_per_minute * fraction / 60.0)
+
+    def wait_time(self, amount: float, fraction: float = 1.0) -> float:
+        """令牌不足时还需等待的秒数"""
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) * 60.0 / (self.rate_per_minute * fraction)
+
+
+class AdaptiveRateLimiter:
+    def __init__(self, requests_per_minute: float = None, tokens_per_minute: float = None,
+                 burst_seconds: float = 10.0, decrease_factor: float = 0.5, min_fraction: float = 0.05,
+                 recovery_step: float = 0.1, recovery_interval: float = 10.0):
+        """初始化限流器
+
+        收到429时速率乘以 decrease_factor（不低于 min_fraction），
+        之后每 recovery_interval 秒内有成功请求则恢复 recovery_step，直至恢复到配置的速率。
+        requests_per_minute 为 None 时不预先限流：收到429时以最近一分钟实际发出请求的速率
+        作为基准速率降速，完全恢复后再撤销该速率，回到不限流状态。
+        """
+        self.burst_seconds = burst_seconds
+        self.request_bucket = TokenBucket(requests_per_minute, burst_seconds) if requests_per_minute else None
+        self.token_bucket = TokenBucket(tokens_per_minute, burst_seconds) if tokens_per_minute else None
+        # 未配置请求速率时记录最近一分钟的请求时刻，用于收到429时确定基准速率
+        self._recent = deque() if self.request_bucket is None else None
+        self._learned = False
+        self.decrease_factor = decrease_factor
+        self.min_fraction = min_fraction
+        self.recovery_step = recovery_step
+        self.recovery_interval = recovery_interval
+        self.fraction = 1.0
+        self.rate_limited_count = 0
+        self._last_adjusted = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _buckets(self) -> List[TokenBucket]:
+        return [bucket for bucket in (self.request_bucket, self.token_bucket) if bucket is not None]
+
+    def acquire(self, tokens: float = 0):
+        """阻塞直到可以发送一个（预计消耗 tokens 个Token的）请求"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                for bucket in self._buckets():
+                    bucket.refill(now, self.fraction)
+                wait = 0.0
+                if self.request_bucket is not None:
+                    wait = self.request_bucket.wait_time(1, self.fraction)
+                if self.token_bucket is not None and tokens:
+                    wait = max(wait, self.token_bucket.wait_time(tokens, self.fraction))
+                if wait <= 0:
+                    if self.request_bucket is not None:
+                        self.request_bucket.tokens -= 1
+                    else:
+                        self._recent.append(now)
+                        while self._recent[0] < now - 60.0:
+                            self._recent.popleft()
+                    if self.token_bucket is not None and tokens:
+                        self.token_bucket.tokens -= min(tokens, self.token_bucket.capacity)
+                    return
+            time.sleep(wait)
+
+    def settle(self, estimated_tokens: float, actual_tokens: float):
+        """请求完成后按实际Token用量修正预估值（多退少补）"""
+        if self.token_bucket is None or not estimated_tokens:
+            return
+        with self._lock:
+            charged = min(estimated_tokens, self.token_bucket.capacity)
+            self.token_bucket.tokens = min(self.token_bucket.capacity,
+                                           self.token_bucket.tokens + charged - actual_tokens)
+
+    def on_rate_limited(self):
+        """收到429：降低速率并清空当前桶内令牌，避免其他线程继续突发"""
+        with self._lock:
+            self.rate_limited_count += 1
+            if self.request_bucket is None:
+                now = time.monotonic()
+                recent = [started for started in self._recent if started >= now - 60.0]
+                window = max(1.0, now - recent[0]) if recent else 60.0
+                self.request_bucket = TokenBucket(max(1.0, len(recent) * 60.0 / window), self.burst_seconds)
+                self._recent = None
+                self._learned = True
+            self.fraction = max(self.min_fraction, self.fraction * self.decrease_factor)
+            for bucket in self._buckets():
+                bucket.tokens = min(bucket.tokens, 0.0)
+            self._last_adjusted = time.monotonic()
+
+    def on_success(self):
+        """请求成功：距上次调整超过恢复间隔时逐步恢复速率"""
+        if self.fraction >= 1.0 and not self._learned:
+            return
+        with self._lock:
+            now = time.monotonic()
+            if now - self._last_adjusted >= self.recovery_interval:
+                if self.fraction >= 1.0 and self._learned:
+                    # 按观测速率确定的限额已完全恢复：撤销限额，回到不限流状态
+                    self.request_bucket = None
+                    self._recent = deque()
+                    self._learned = False
+                else:
+                    self.fraction = min(1.0, self.fraction + self.recovery_step)
+                self._last_adjusted = now
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "requests_per_minute": self.request_bucket.rate_per_minute * self.fraction if self.request_bucket else None,
+            "tokens_per_minute": self.token_bucket.rate_per_minute * self.fraction if self.token_bucket else None,
+            "fraction": self.fraction,
+            "rate_limited_count": self.rate_limited_count
+        }
+
+
+class RateLimiterRegistry:
+    def __init__(self, limits: Dict[str, Dict[str, float]] = None, default: Optional[Dict[str, float]] = None):
+        """按模型管理限流器
+
+        limits 形如 {"Qwen/QwQ-32B": {"rpm": 1000, "tpm": 50000}}；
+        未配置的模型使用 default，default 为 None 时不预先限流（收到429后自适应降速）。
+        """
+        self.limits = limits or {}
+        self.default = default
+        self._limiters = {}
+        self._lock = threading.Lock()
+
+    def get(self, model: str) -> Optional[AdaptiveRateLimiter]:
+        """获取模型对应的限流器（首次使用时创建）"""
+        limiter = self._limiters.get(model)
+        if limiter is not None:
+            return limiter
+        config = self.limits.get(model, self.default) or {}
+        with self._lock:
+            if model not in self._limiters:
+                self._limiters[model] = AdaptiveRateLimiter(config.get("rpm"), config.get("tpm"))
+            return self._limiters[model]
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        return {model: limiter.stats() for model, limiter in self._limiters.items()}
+
+
+def estimate_tokens(payload: Dict[str, Any], output_fraction: float = OUTPUT_TOKEN_FRACTION) -> int:
+    """粗略估算一次请求的Token用量：消息字符数 + max_tokens × output_fraction × n
+
+    不按 max_tokens 预留最坏情况（大多数回答远短于上限），请求完成后由 settle 按实际用量修正。
+    """
+    prompt_chars = sum(len(str(message.get("content", ""))) for message in payload.get("messages", []))
+    expected_output = int(payload.get("max_tokens") or 0) * output_fraction
+    return prompt_chars + int(expected_output * int(payload.get("n") or 1))
+
+
+def registry_from_env() -> RateLimiterRegistry:
+    """根据环境变量创建限流器注册表
+
+    LAQUAL_RATE_LIMITS 为JSON（或JSON文件路径），形如
+    {"default": {"rpm": 1000, "tpm": 50000}, "Qwen/QwQ-32B": {"rpm": 500}}；
+    未设置或未给出 "default" 时，未配置的模型不预先限流，只在收到429时自适应降速。
+    """
+    raw = os.getenv('LAQUAL_RATE_LIMITS')
+    if not raw:
+        return RateLimiterRegistry(default=None)
+    if os.path.exists(raw):
+        with open(raw, 'r', encoding='utf-8') as f:
+            config = json.load(f)
+    else:
+        config = json.loads(raw)
+    default = config.pop("default", None)
+    return RateLimiterRegistry(config, default=default)
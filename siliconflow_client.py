@@ -0,0 +1,404 @@
+"""
+LaQual - siliconflow_client
+功能：所有模块共享的 SiliconFlow 对话补全客户端
+作者：wang yan
+日期：2026-10-16
+
+连接池复用、统一重试退避、超时与状态码处理。
+"""
+
+import json
+import os
+import random
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from instrumentation import metrics
+from llm_cache import LLMCache, cache_from_env
+from rate_limiter import RateLimiterRegistry, estimate_tokens, registry_from_env
+from structured_logging import fields, get_logger
+
+logger = get_logger("siliconflow_client")
+
+# SiliconFlow API配置
+SILICONFLOW_API_KEY = os.getenv('SILICONFLOW_API_KEY') or 'your_api_key_here'
+SILICONFLOW_API_URL = os.getenv('SILICONFLOW_API_URL') or 'https://api.siliconflow.cn/v1/chat/completions'
+
+# 可重试的状态码：频率限制与服务端临时错误
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class SiliconFlowAPIError(Exception):
+    """API调用失败，status_code 为 None 表示未收到HTTP响应"""
+
+    def __init__(self, message: str, status_code: Optional[int] = None, response_text: str = ""):
+        super().__init__(message)
+        self.status_code = status_code
+        self.response_text = response_text
+
+    @property
+    def is_content_error(self) -> bool:
+        """收到200但响应内容无法解析：调用方可以重新请求（超时、连接错误、429、5xx 已由客户端重试过）"""
+        return self.status_code == 200
+
+
+class SiliconFlowTimeoutError(SiliconFlowAPIError):
+    """API请求超时"""
+
+
+class StreamResult:
+    """流式对话补全的结果与时延统计（时间均为相对请求发出时刻的秒数）"""
+
+    def __init__(self):
+        self.content = ""
+        self.reasoning_content = ""
+        self.finish_reason = None
+        self.usage = None
+        self.aborted = False  # 是否因 stop_when 满足而提前终止
+        self.cached = False   # 是否直接来自响应缓存（此时没有时延数据）
+        self.time_to_first_token = None
+        self.token_times = []  # 每个内容分片到达的时间
+        self.total_time = 0.0
+
+    @property
+    def token_count(self) -> int:
+        """输出Token数：取自流末尾事件中服务端返回的用量（请求时设置了 include_usage），
+        未返回时（如提前终止）按收到的内容分片数估算（一个分片可能包含多个Token，结果偏小）"""
+        if (self.usage or {}).get('completion_tokens') is not None:
+            return self.usage['completion_tokens']
+        return len(self.token_times)
+
+    @property
+    def inter_token_latencies(self) -> List[float]:
+        return [later - earlier for earlier, later in zip(self.token_times, self.token_times[1:])]
+
+    def performance_metrics(self) -> Dict[str, Any]:
+        """转换为 ResponseEvaluator.evaluate_performance 使用的性能指标"""
+        latencies = sorted(self.inter_token_latencies)
+        generation_time = self.total_time - (self.time_to_first_token or 0)
+        return {
+            "total_time": self.total_time,
+            "token_count": self.token_count,
+            "tokens_per_second": self.token_count / self.total_time if self.total_time > 0 else 0,
+            "time_to_first_token": self.time_to_first_token,
+            # 按分片计的生成速率（分片数不等于Token数）
+            "generation_chunks_per_second": len(latencies) / generation_time if generation_time > 0 else 0,
+            "mean_inter_token_latency": sum(latencies) / len(latencies) if latencies else None,
+            "p95_inter_token_latency": latencies[int(0.95 * (len(latencies) - 1))] if latencies else None
+        }
+
+    def to_response(self) -> Dict[str, Any]:
+        """转换为非流式接口的响应格式（用于写入缓存）"""
+        message = {"role": "assistant", "content": self.content}
+        if self.reasoning_content:
+            message["reasoning_content"] = self.reasoning_content
+        return {
+            "choices": [{"index": 0, "message": message, "finish_reason": self.finish_reason}],
+            "usage": self.usage
+        }
+
+    @classmethod
+    def from_response(cls, response: Dict[str, Any]) -> "StreamResult":
+        result = cls()
+        message = response['choices'][0]['message']
+        result.content = message.get('content') or ""
+        result.reasoning_content = message.get('reasoning_content') or ""
+        result.finish_reason = response['choices'][0].get('finish_reason')
+        result.usage = response.get('usage')
+        result.cached = True
+        return result
+
+
+class SiliconFlowClient:
+    def __init__(self, api_url: str = None, api_key: str = None, pool_size: int = 32,
+                 max_retries: int = 3, backoff_base: float = 1.0, backoff_max: float = 30.0,
+                 timeout: float = 120, cache: LLMCache = None,
+                 rate_limiters: RateLimiterRegistry = None):
+        """初始化客户端
+
+        pool_size 为每个主机保持的长连接数量，应不小于并发调用的线程数；
+        max_retries 为超时、连接错误、429 及 5xx 的额外重试次数；
+        cache 为空时不缓存响应；rate_limiters 为空时不做客户端限流。
+        """
+        self.api_url = api_url or SILICONFLOW_API_URL
+        self.cache = cache
+        self.rate_limiters = rate_limiters
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.timeout = timeout
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update({
+            "Authorization": f"Bearer {api_key or SILICONFLOW_API_KEY}",
+            "Content-Type": "application/json"
+        })
+
+    def _backoff_delay(self, attempt: int, status_code: Optional[int] = None) -> float:
+        """计算第 attempt 次失败后的等待时间（指数退避 + 随机抖动）"""
+        delay = self.backoff_base * (2 ** attempt)
+        if status_code == 429:
+            # 对于频率限制，等待更长时间
+            delay *= 2
+        delay = min(delay, self.backoff_max)
+        return delay + random.uniform(0, delay * 0.1)
+
+    @staticmethod
+    def _error_message(status_code: int) -> str:
+        if status_code == 400:
+            return "API请求格式错误，请检查请求参数"
+        if status_code == 401:
+            return "API密钥无效或未授权"
+        if status_code == 429:
+            return "API调用频率超限"
+        return f"API调用失败，状态码: {status_code}"
+
+    def create_chat_completion(self, payload: Dict[str, Any], timeout: float = None,
+                               max_retries: int = None, refresh: bool = False) -> Dict[str, Any]:
+        """发送对话补全请求并返回解析后的响应JSON
+
+        超时、连接错误、429 和 5xx 按统一策略退避重试；其余错误立即抛出 SiliconFlowAPIError。
+        refresh=True 时跳过缓存读取并用新响应覆盖缓存，用于调用方对上次结果不满意的重试。
+        """
+        cache_key = None
+        if self.cache is not None and self.cache.enabled:
+            cache_key = self.cache.make_key(payload)
+            if not refresh:
+                cached = self.cache.get(cache_key)
+                metrics.increment("llm_cache_lookups_total", model=payload.get("model", ""),
+                                  result="hit" if cached is not None else "miss")
+                if cached is not None:
+                    return cached
+
+        with metrics.timer("api_call_seconds", model=payload.get("model", "")):
+            result = self._post_with_retries(payload, timeout, max_retries)
+        self._record_usage(payload, result.get('usage'))
+        if cache_key is not None:
+            self.cache.put(cache_key, result)
+        return result
+
+    @staticmethod
+    def _record_usage(payload: Dict[str, Any], usage: Optional[Dict[str, Any]]):
+        """累计发送 / 接收的Token数（服务端未返回用量时不记录）"""
+        usage = usage or {}
+        model = payload.get("model", "")
+        if usage.get('prompt_tokens') is not None:
+            metrics.increment("api_prompt_tokens_total", usage['prompt_tokens'], model=model)
+        if usage.get('completion_tokens') is not None:
+            metrics.increment("api_completion_tokens_total", usage['completion_tokens'], model=model)
+
+    def _open_with_retries(self, payload: Dict[str, Any], timeout: float, max_retries: int,
+                           limiter, estimated_tokens: float, stream: bool = False) -> requests.Response:
+        """发送请求直到收到200响应（流式请求此时只读取了响应头）"""
+        model = payload.get("model", "")
+        for attempt in range(max_retries + 1):
+            if attempt:
+                metrics.increment("api_retries_total", model=model)
+            if limiter:
+                with metrics.timer("rate_limiter_wait_seconds", model=model):
+                    limiter.acquire(estimated_tokens)
+            started = time.perf_counter()
+            try:
+                response = self.session.post(self.api_url, json=payload, timeout=timeout, stream=stream)
+            except requests.exceptions.Timeout as e:
+                metrics.increment("api_responses_total", model=model, status="timeout")
+                error = SiliconFlowTimeoutError(f"请求超时（{timeout}秒）")
+                if attempt < max_retries:
+                    logger.warning(f"{error}，正在重试...", extra=fields(model=model, attempt=attempt + 1))
+                    time.sleep(self._backoff_delay(attempt))
+                    continue
+                metrics.observe("api_attempts_per_call", attempt + 1, model=model)
+                raise error from e
+            except requests.exceptions.RequestException as e:
+                metrics.increment("api_responses_total", model=model, status="connection_error")
+                error = SiliconFlowAPIError(f"API请求异常: {str(e)}")
+                if attempt < max_retries:
+                    logger.warning(f"{error}，正在重试...", extra=fields(model=model, attempt=attempt + 1))
+                    time.sleep(self._backoff_delay(attempt))
+                    continue
+                metrics.observe("api_attempts_per_call", attempt + 1, model=model)
+                raise error from e
+            # 流式请求此处为收到响应头的时间
+            metrics.observe("api_request_seconds", time.perf_counter() - started, model=model)
+            metrics.increment("api_responses_total", model=model, status=response.status_code)
+
+            if response.status_code == 429 and limiter:
+                limiter.on_rate_limited()
+
+            if response.status_code != 200:
+                error = SiliconFlowAPIError(self._error_message(response.status_code),
+                                            response.status_code, response.text)
+                if response.status_code in RETRYABLE_STATUS_CODES and attempt < max_retries:
+                    logger.warning(f"{error}，正在重试...", extra=fields(model=model, attempt=attempt + 1))
+                    # 429 的等待交给限流器：on_rate_limited 已降速并清空令牌，下次 acquire 会按新速率等待
+                    if not (response.status_code == 429 and limiter):
+                        time.sleep(self._backoff_delay(attempt, response.status_code))
+                    continue
+                metrics.observe("api_attempts_per_call", attempt + 1, model=model)
+                raise error
+
+            metrics.observe("api_attempts_per_call", attempt + 1, model=model)
+            return response
+
+    def _post_with_retries(self, payload: Dict[str, Any], timeout: float = None,
+                           max_retries: int = None) -> Dict[str, Any]:
+        timeout = timeout or self.timeout
+        max_retries = self.max_retries if max_retries is None else max_retries
+        limiter = self.rate_limiters.get(payload.get("model", "")) if self.rate_limiters else None
+        estimated_tokens = estimate_tokens(payload) if limiter else 0
+
+        response = self._open_with_retries(payload, timeout, max_retries, limiter, estimated_tokens)
+        try:
+            result = response.json()
+        except ValueError as e:
+            raise SiliconFlowAPIError(f"API响应解析错误: {str(e)}", 200, response.text) from e
+
+        if 'choices' not in result or not result['choices']:
+            raise SiliconFlowAPIError("API返回数据格式错误", 200, response.text)
+
+        if limiter:
+            limiter.on_success()
+            total_tokens = (result.get('usage') or {}).get('total_tokens')
+            if total_tokens is not None:
+                limiter.settle(estimated_tokens, total_tokens)
+
+        return result
+
+    def stream_chat_completion(self, payload: Dict[str, Any], timeout: float = None,
+                               max_retries: int = None, refresh: bool = False,
+                               stop_when: Callable[[str], bool] = None,
+                               on_delta: Callable[[str], None] = None) -> StreamResult:
+        """以流式（SSE）方式发送对话补全请求，同时记录首Token时延和Token间隔
+
+        每收到一段内容都会以累计文本调用 stop_when，返回 True 时立即断开连接，
+        不再为剩余输出付费；on_delta 接收每段新增内容。
+        完整结束的响应按非流式格式写入缓存；提前终止的响应单独缓存，只供带 stop_when 的调用读取。
+        建立连接阶段的错误按统一策略重试，已开始输出后中断则抛出 SiliconFlowAPIError。
+        """
+        # OpenAI 兼容接口只有设置 include_usage 才会在流末尾返回用量
+        payload = dict(payload, stream=True,
+                       stream_options=dict(payload.get("stream_options") or {}, include_usage=True))
+        cache_key = early_stop_key = None
+        if self.cache is not None and self.cache.enabled:
+            cache_key = self.cache.make_key(payload)
+            if stop_when is not None:
+                early_stop_key = self.cache.make_key(dict(payload, _early_stop=True))
+            if not refresh:
+                for key in (cache_key, early_stop_key):
+                    cached = self.cache.get(key) if key else None
+                    if cached is not None:
+                        metrics.increment("llm_cache_lookups_total", model=payload.get("model", ""),
+                                          result="hit")
+                        return StreamResult.from_response(cached)
+                metrics.increment("llm_cache_lookups_total", model=payload.get("model", ""), result="miss")
+
+        timeout = timeout or self.timeout
+        max_retries = self.max_retries if max_retries is None else max_retries
+        limiter = self.rate_limiters.get(payload.get("model", "")) if self.rate_limiters else None
+        estimated_tokens = estimate_tokens(payload) if limiter else 0
+
+        started = time.monotonic()
+        response = self._open_with_retries(payload, timeout, max_retries, limiter, estimated_tokens,
+                                           stream=True)
+        result = StreamResult()
+        try:
+            # 按字节切分后再以 UTF-8 解码：text/event-stream 未声明 charset 时 requests 会按 ISO-8859-1 解码中文
+            for raw_line in response.iter_lines():
+                line = raw_line.decode("utf-8", errors="replace")
+                if not line or not line.startswith("data:"):
+                    continue
+                data = line[5:].strip()
+                if data == "[DONE]":
+                    break
+                try:
+                    chunk = json.loads(data)
+                except ValueError:
+                    continue
+                if chunk.get('usage'):
+                    result.usage = chunk['usage']
+                if not chunk.get('choices'):
+                    continue
+                choice = chunk['choices'][0]
+                delta = choice.get('delta') or {}
+                if choice.get('finish_reason'):
+                    result.finish_reason = choice['finish_reason']
+                if delta.get('reasoning_content'):
+                    result.reasoning_content += delta['reasoning_content']
+                text = delta.get('content')
+                if not text:
+                    continue
+
+                now = time.monotonic() - started
+                if result.time_to_first_token is None:
+                    result.time_to_first_token = now
+                result.token_times.append(now)
+                result.content += text
+                if on_delta:
+                    on_delta(text)
+                if stop_when is not None and stop_when(result.content):
+                    result.aborted = True
+                    break
+        except requests.exceptions.Timeout as e:
+            raise SiliconFlowTimeoutError(f"流式响应读取超时（{timeout}秒）") from e
+        except requests.exceptions.RequestException as e:
+            raise SiliconFlowAPIError(f"流式响应中断: {str(e)}") from e
+        finally:
+            # 提前终止时关闭连接，服务端随之停止生成
+            response.close()
+        result.total_time = time.monotonic() - started
+
+        model = payload.get("model", "")
+        metrics.observe("api_call_seconds", result.total_time, model=model)
+        if result.time_to_first_token is not None:
+            metrics.observe("api_time_to_first_token_seconds", result.time_to_first_token, model=model)
+        if result.aborted:
+            metrics.increment("api_early_stops_total", model=model)
+        self._record_usage(payload, result.usage)
+
+        if limiter:
+            limiter.on_success()
+            # 服务端未返回用量时保留预估值，不做修正
+            actual_tokens = (result.usage or {}).get('total_tokens')
+            limiter.settle(estimated_tokens, estimated_tokens if actual_tokens is None else actual_tokens)
+
+        if cache_key is not None and result.content:
+            self.cache.put(early_stop_key if result.aborted else cache_key, result.to_response())
+        return result
+
+    def chat(self, payload: Dict[str, Any], timeout: float = None, max_retries: int = None,
+             refresh: bool = False) -> str:
+        """发送对话补全请求并返回第一个候选的文本内容"""
+        result = self.create_chat_completion(payload, timeout=timeout, max_retries=max_retries,
+                                             refresh=refresh)
+        return result['choices'][0]['message']['content']
+
+    def invalidate(self, payload: Dict[str, Any]):
+        """删除某个请求的缓存结果（调用方判定响应不可用时使用）"""
+        if self.cache is not None:
+            self.cache.delete(self.cache.make_key(payload))
+
+    def close(self):
+        """关闭连接池"""
+        self.session.close()
+
+
+_shared_client = None
+_shared_client_lock = threading.Lock()
+
+
+def get_client() -> SiliconFlowClient:
+    """获取进程内共享的客户端实例（首次调用时创建，响应缓存和限流按环境变量配置）"""
+    global _shared_client
+    if _shared_client is None:
+        with _shared_client_lock:
+            if _shared_client is None:
+                _shared_client = SiliconFlowClient(cache=cache_from_env(),
+                                                   rate_limiters=registry_from_env())
+    return _shared_client
@@ -0,0 +1,92 @@
+"""
+LaQual - similarity_model
+功能：进程内共享、按需加载的中文相似度模型
+作者：wang yan
+日期：2026-10-16
+
+首次使用时才导入 torch / sentence_transformers。
+"""
+
+import os
+import threading
+
+from structured_logging import get_logger
+
+logger = get_logger("similarity_model")
+
+SIMILARITY_MODEL_NAME = 'shibing624/text2vec-base-chinese'
+
+# 所有模块共用同一个本地缓存目录
+MODEL_CACHE_DIR = os.getenv('LAQUAL_MODEL_CACHE_DIR') or os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "model_cache")
+
+_model = None
+_model_loaded = False
+_model_lock = threading.Lock()
+
+
+def _load_model():
+    """加载模型：优先使用本地缓存，失败后尝试在线下载，仍失败则返回 None"""
+    logger.info("正在加载中文相似度模型...")
+    try:
+        from sentence_transformers import SentenceTransformer
+    except ImportError as e:
+        logger.warning(f"sentence_transformers 未安装，将跳过相似度验证: {str(e)}")
+        return None
+
+    os.makedirs(MODEL_CACHE_DIR, exist_ok=True)
+    try:
+        model = SentenceTransformer(
+            SIMILARITY_MODEL_NAME,
+            cache_folder=MODEL_CACHE_DIR,
+            local_files_only=True  # 只使用本地文件
+        )
+        logger.info("中文相似度模型加载成功（使用本地缓存）")
+        return model
+    except Exception as e:
+        logger.info(f"本地模型加载失败: {str(e)}")
+
+    try:
+        # 如果本地加载失败，尝试在线下载
+        logger.info("尝试在线下载中文模型...")
+        model = SentenceTransformer(
+            SIMILARITY_MODEL_NAME,
+            cache_folder=MODEL_CACHE_DIR
+        )
+        logger.info("中文相似度模型下载并加载成功")
+        return model
+    except Exception as e:
+        logger.warning(f"模型加载失败，将跳过相似度验证: {str(e)}")
+        return None
+
+
+def get_similarity_model():
+    """获取共享的相似度模型，首次调用时加载；加载失败时返回 None（且不再重复尝试）"""
+    global _model, _model_loaded
+    if not _model_loaded:
+        with _model_lock:
+            if not _model_loaded:
+                _model = _load_model()
+                _model_loaded = True
+    return _model
+
+
+class SimilarityModelMixin:
+    """similarity_model 属性：未注入模型时使用进程内共享的模型（首次访问时加载，加载失败为 None）"""
+
+    _similarity_model = None
+
+    @property
+    def similarity_model(self):
+        if self._similarity_model is None:
+            return get_similarity_model()
+        return self._similarity_model
+
+    @similarity_model.setter
+    def similarity_model(self, model):
+        self._similarity_model = model
+
+    @property
+    def uses_shared_similarity_model(self) -> bool:
+        """是否使用共享模型（此时对应使用共享向量库）"""
+        return self._similarity_model is None
@@ -0,0 +1,347 @@
+"""
+LaQual - static_indicator_engine
+功能：列式（批量）静态指标检查引擎
+作者：wang yan
+日期：2026-10-16
+
+判定逻辑与 Static_indicator_evaluation.check_basic_metrics 保持一致，
+后者作为逐应用的参考实现保留。
+"""
+
+from datetime import datetime
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+import pandas as pd
+
+from app_type_classifier import AppTypeClassifier, get_default_classifier, normalize_tag
+from Static_indicator_evaluation import (
+    BASIC_METRICS,
+    DATE_FORMATS,
+    TYPE_THRESHOLDS,
+    calculate_quarters_fixed,
+    calculate_time_decay,
+    get_reference_now,
+)
+
+APP_TYPES = list(TYPE_THRESHOLDS.keys())
+OTHER_METRICS = ['模型配置', '知识库数量', '组件数量']
+
+# 检查用到的全部字段（title 只用于结果表）
+CATALOG_FIELDS = ['title', '发布时间', '标签'] + BASIC_METRICS + ['模型配置', '知识库数量', '组件', '组件数量']
+
+# 检测发布时间格式时使用的样本数
+FORMAT_DETECT_SAMPLES = 100
+
+
+def extract_columns(apps: List[Any], fields: List[str] = CATALOG_FIELDS) -> Tuple[pd.DataFrame, Dict[str, np.ndarray]]:
+    """一次抽取全部字段（与 DataFrame.from_records 相同的列式构造），返回 (值表, 字段 → 是否存在)
+
+    使用 object 列保留原始取值（None 不会被转换为 NaN），字段缺失时值为 NaN；
+    只有值为 NaN 的单元格需要回到原始记录确认字段是否存在。非字典的应用视为所有字段缺失。
+    """
+    records = [app if isinstance(app, dict) else {} for app in apps]
+    values = pd.DataFrame(records, columns=fields, dtype=object)
+    present = {}
+    for field in fields:
+        column = values[field].to_numpy(dtype=object)
+        field_present = values[field].notna().to_numpy(dtype=bool, copy=True) | (column == None)  # noqa: E711
+        for row in np.flatnonzero(~field_present):
+            field_present[row] = field in records[row]
+        present[field] = field_present
+    return values, present
+
+
+def _types(values: pd.Series) -> np.ndarray:
+    """逐元素的类型（在 pandas 的 C 循环中调用 type，代替逐个 isinstance）"""
+    return values.astype(object).map(type).to_numpy(dtype=object)
+
+
+def _is_number(types: np.ndarray) -> np.ndarray:
+    return (types == int) | (types == float) | (types == bool)
+
+
+def safe_int_array(values: pd.Series) -> np.ndarray:
+    """safe_int_conversion 的批量版本，结果为截断后的浮点数组
+
+    与参考实现一致：无法解析的值按 0 计；无穷大（int() 抛出 OverflowError，
+    参考实现跳过该指标）记为 NaN，与阈值比较时不计入。
+    """
+    if values.dtype.kind in 'biuf':
+        result = values.to_numpy(dtype=np.float64, na_value=np.nan)
+    else:
+        result = np.zeros(len(values), dtype=np.float64)
+        types = _types(values)
+        is_str = types == str
+        is_num = _is_number(types)
+        if is_str.any():
+            # 移除非数字字符，保留数字、小数点和负号；只处理去重后的字符串
+            codes, uniques = pd.factorize(values[is_str].astype(object))
+            texts = pd.Series(uniques, dtype=object)
+            # 纯 ASCII 数字（最常见的情况）无需清洗
+            plain = (texts.str.isascii() & texts.str.isdigit()).to_numpy(dtype=bool)
+            numbers = np.empty(len(texts), dtype=np.float64)
+            # 位数过多的数字串按 float() 解析为无穷大，与参考实现一致
+            numbers[plain] = texts[plain].astype(np.float64).to_numpy()
+            cleaned = texts[~plain].str.replace(r'[^0-9.-]', '', regex=True)
+            numbers[~plain] = pd.to_numeric(cleaned, errors='coerce').to_numpy(dtype=np.float64)
+            result[is_str] = numbers[codes]
+        if is_num.any():
+            result[is_num] = values[is_num].astype(np.float64).to_numpy()
+        # 其他类型（None、列表等）按 0 计
+
+    result[np.isnan(result)] = 0
+    result[np.isinf(result)] = np.nan
+    return np.trunc(result)
+
+
+def detect_date_formats(samples: List[str]) -> List[str]:
+    """按样本命中次数排列日期格式，命中最多的格式最先用于整列解析"""
+    hits = [0] * len(DATE_FORMATS)
+    for text in samples:
+        for index, fmt in enumerate(DATE_FORMATS):
+            try:
+                datetime.strptime(text, fmt)
+            except ValueError:
+                continue
+            hits[index] += 1
+            break
+    order = sorted(range(len(DATE_FORMATS)), key=lambda index: -hits[index])
+    return [DATE_FORMATS[index] for index in order]
+
+
+def compute_quarters(publish_times: pd.Series, now: datetime = None) -> np.ndarray:
+    """批量计算发布时间到 now（默认为本次运行的参考日期）的季度数，无法解析的发布时间按 1 个季度计"""
+    now = now or get_reference_now()
+    quarters = np.ones(len(publish_times), dtype=np.float64)
+
+    is_str = (_types(publish_times) == str) & publish_times.astype(object).ne("").to_numpy(dtype=bool)
+    if not is_str.any():
+        return quarters
+
+    # 发布时间重复度很高，只解析去重后的值；格式按列检测一次
+    codes, uniques = pd.factorize(publish_times[is_str].astype(object))
+    texts = pd.Series(uniques, dtype=object)
+    years = np.full(len(texts), np.nan)
+    months = np.full(len(texts), np.nan)
+    for fmt in detect_date_formats(list(texts[:FORMAT_DETECT_SAMPLES])):
+        missing = np.isnan(years)
+        if not missing.any():
+            break
+        parsed = pd.to_datetime(texts[missing], format=fmt, errors='coerce')
+        years[missing] = parsed.dt.year.to_numpy(dtype=np.float64, na_value=np.nan)
+        months[missing] = parsed.dt.month.to_numpy(dtype=np.float64, na_value=np.nan)
+
+    months_diff = (now.year - years) * 12 + now.month - months
+    unique_quarters = np.maximum(1.0, months_diff / 3.0)
+
+    # 少量批量解析失败的值（如越界年份）交给参考实现处理
+    unresolved = np.isnan(years)
+    if unresolved.any():
+        unique_quarters[unresolved] = [calculate_quarters_fixed(text, now) for text in texts[unresolved]]
+
+    quarters[is_str] = unique_quarters[codes]
+    return quarters
+
+
+def compute_time_decay(quarters: np.ndarray) -> np.ndarray:
+    """批量计算时间衰减系数（季度数取值很少，对去重后的值调用 calculate_time_decay）"""
+    unique_quarters, codes = np.unique(quarters, return_inverse=True)
+    unique_decay = np.array([calculate_time_decay(q) for q in unique_quarters.tolist()], dtype=np.float64)
+    return unique_decay[codes.reshape(-1)]
+
+
+def classify_app_types(tags: pd.Series, tag_present: np.ndarray,
+                       classifier: AppTypeClassifier = None) -> Tuple[np.ndarray, np.ndarray]:
+    """批量识别应用类型，返回 (应用类型, 工具类型)"""
+    classifier = classifier or get_default_classifier()
+    normalized = np.full(len(tags), "", dtype=object)
+    is_str = tag_present & (_types(tags) == str)
+    if is_str.any():
+        normalized[is_str] = tags[is_str].astype(object).str.lower().to_numpy(dtype=object)
+    # 列表等非字符串标签较少，逐个处理
+    for row in np.flatnonzero(tag_present & ~is_str):
+        normalized[row] = normalize_tag(tags.iloc[row])
+    # 标签重复度很高，只对去重后的标签做匹配
+    codes, unique_tags = pd.factorize(pd.Series(normalized, dtype=object))
+
+    unique_app_types = np.empty(len(unique_tags), dtype=object)
+    unique_tool_types = np.empty(len(unique_tags), dtype=object)
+    for i, tag in enumerate(unique_tags):
+        unique_app_types[i], unique_tool_types[i] = classifier.classify_normalized(tag)
+
+    return unique_app_types[codes], unique_tool_types[codes]
+
+
+def _model_config_value(value: Any):
+    """与参考实现一致的模型配置取值，无法取值时返回 NaN（该指标不计入）"""
+    try:
+        if isinstance(value, list):
+            return len(value)
+        if isinstance(value, str):
+            return 1 if value.strip() else 0
+        return int(value) if value else 0
+    except Exception:
+        return np.nan
+
+
+def _model_config_length(value: Any) -> float:
+    """模型配置的强制检查使用 len()，不可取长度的值视为不满足"""
+    try:
+        return len(value) if value else 0
+    except TypeError:
+        return -1
+
+
+def model_config_arrays(values: pd.Series) -> Tuple[np.ndarray, np.ndarray]:
+    """批量计算模型配置的 (指标取值, 强制检查使用的长度)，按类型整列处理，其余类型逐个处理"""
+    count = len(values)
+    value = np.full(count, np.nan)
+    length = np.full(count, -1.0)
+    types = _types(values)
+
+    is_list = types == list
+    is_str = types == str
+    sized = is_list | is_str
+    if sized.any():
+        length[sized] = values[sized].map(len).to_numpy(dtype=np.float64)
+        value[is_list] = length[is_list]
+        value[is_str] = (values[is_str].astype(object).str.strip().str.len() > 0).to_numpy(dtype=np.float64)
+
+    is_none = types == type(None)
+    value[is_none] = 0
+    length[is_none] = 0
+
+    is_num = _is_number(types)
+    if is_num.any():
+        # 数值：为 0 时取 0；否则取整（NaN / 无穷大取整失败，不计入），长度检查不满足
+        numbers = values[is_num].astype(np.float64).to_numpy()
+        with np.errstate(invalid='ignore'):
+            value[is_num] = np.where(numbers == 0, 0, np.where(np.isfinite(numbers), np.trunc(numbers), np.nan))
+        length[is_num] = np.where(numbers == 0, 0, -1)
+
+    for row in np.flatnonzero(~(sized | is_none | is_num)):
+        value[row] = _model_config_value(values.iloc[row])
+        length[row] = _model_config_length(values.iloc[row])
+    return value, length
+
+
+def evaluate_catalog(apps: List[Dict], now: datetime = None) -> pd.DataFrame:
+    """批量检查整个应用目录
+
+    返回与输入顺序一致的结果表，passed 列即 check_basic_metrics 的判定结果，
+    reason 列给出未通过的原因。
+    """
+    now = now or get_reference_now()
+    count = len(apps)
+    is_dict = np.fromiter((isinstance(app, dict) for app in apps), dtype=bool, count=count)
+    columns, present = extract_columns(apps)
+
+    # 1. 发布时间 → 季度数与时间衰减
+    quarters = compute_quarters(columns['发布时间'], now)
+    decay = compute_time_decay(quarters)
+
+    # 2. 应用类型
+    app_types, tool_types = classify_app_types(columns['标签'], present['标签'])
+    type_index = pd.Index(APP_TYPES).get_indexer(app_types)
+
+    def thresholds_for(metric: str) -> np.ndarray:
+        return np.array([TYPE_THRESHOLDS[app_type][metric] for app_type in APP_TYPES],
+                        dtype=np.float64)[type_index]
+
+    table = pd.DataFrame({
+        "title": columns['title'].astype(object).where(present['title'], None),
+        "app_type": app_types,
+        "tool_type": tool_types,
+        "quarters": quarters,
+        "time_decay": decay,
+    })
+
+    # 3. 基础指标：时间加权并衰减后与阈值比较
+    basic_passed = np.zeros(count, dtype=np.int64)
+    for metric in BASIC_METRICS:
+        metric_present = present[metric]
+        value = safe_int_array(columns[metric]) / quarters * decay
+        table[metric] = np.where(metric_present, value, np.nan)
+        basic_passed += (metric_present & (value >= thresholds_for(metric))).astype(np.int64)
+
+    # 4. 其他指标：模型配置、知识库数量、组件数量
+    model_present = present['模型配置']
+    model_value, model_length = model_config_arrays(columns['模型配置'])
+
+    kb_present = present['知识库数量']
+    kb_value = safe_int_array(columns['知识库数量'])
+
+    components = columns['组件']
+    components_present = present['组件']
+    component_count_present = present['组件数量']
+    components_is_list = _types(components) == list
+    components_len = np.zeros(count, dtype=np.float64)
+    if components_is_list.any():
+        components_len[components_is_list] = components[components_is_list].map(len).to_numpy(dtype=np.float64)
+    component_count_value = safe_int_array(columns['组件数量'])
+    # 参考实现的指标循环：非列表的组件字段按数字解析
+    loop_components = np.where(
+        components_present,
+        np.where(components_is_list, components_len, safe_int_array(components)),
+        component_count_value
+    )
+
+    other_values = {
+        '模型配置': (model_present & ~np.isnan(model_value), model_value),
+        '知识库数量': (kb_present, kb_value),
+        # 组件数量指标只在存在“组件数量”字段时参与计数
+        '组件数量': (component_count_present, loop_components),
+    }
+    other_passed = np.zeros(count, dtype=np.int64)
+    for metric in OTHER_METRICS:
+        metric_present, value = other_values[metric]
+        value = np.where(metric_present, value, np.nan)
+        table[metric] = value
+        with np.errstate(invalid='ignore'):
+            other_passed += (metric_present & (value >= thresholds_for(metric))).astype(np.int64)
+
+    # 5. 各类型的强制条件
+    model_ok = model_present & (model_length >= thresholds_for('模型配置'))
+
+    is_tool = app_types == "工具型"
+    required_components = np.where(
+        components_present,
+        np.where(components_is_list, components_len, 0),
+        np.where(component_count_present, component_count_value, 0)
+    )
+    components_ok = ~is_tool | (required_components >= thresholds_for('组件数量'))
+
+    is_qa = app_types == "专业问答型"
+    kb_ok = ~is_qa | (np.where(kb_present, kb_value, 0) >= thresholds_for('知识库数量'))
+
+    basic_ok = basic_passed >= 1
+    other_ok = other_passed >= 3
+    passed = is_dict & basic_ok & other_ok & model_ok & components_ok & kb_ok
+
+    table["basic_metrics_passed"] = basic_passed
+    table["other_metrics_passed"] = other_passed
+    table["passed"] = passed
+
+    reason_columns = [
+        (~is_dict, "应用数据格式错误"),
+        (~model_ok, "模型配置不满足要求"),
+        (~components_ok, "工具型应用组件数量不满足要求"),
+        (~kb_ok, "专业问答型应用知识库数量不满足要求"),
+        (~basic_ok, "基础指标未达标"),
+        (~other_ok, "其他指标未全部达标"),
+    ]
+    reasons = np.full(count, "", dtype=object)
+    for mask, reason in reason_columns:
+        if mask.any():
+            reasons[mask] = np.where(reasons[mask] == "", reason, reasons[mask] + "；" + reason)
+    table["reason"] = reasons
+    return table
+
+
+def filter_catalog(apps: List[Dict], now: datetime = None) -> Tuple[List[Dict], pd.DataFrame]:
+    """批量过滤应用目录，返回 (通过的应用, 逐应用结果表)"""
+    table = evaluate_catalog(apps, now)
+    passed = table["passed"].to_numpy(dtype=bool)
+    filtered_apps = [app for app, ok in zip(apps, passed) if ok]
+    return filtered_apps, table
@@ -0,0 +1,117 @@
+"""
+LaQual - static_screening_index
+功能：静态指标筛选的增量索引
+作者：wang yan
+日期：2026-10-16
+
+索引存放在 SQLite 中，按 应用ID/URL + 筛选所用字段的哈希 记录上一次的判定结果，
+每日重新抓取后只需重新检查新增、变化或时间衰减输入（季度数）发生变化的应用。
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+
+DEFAULT_INDEX_PATH = os.getenv('LAQUAL_STATIC_INDEX') or os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "static_index", "decisions.sqlite")
+
+# check_basic_metrics 读取的全部字段，任一字段变化都需要重新检查
+SCREENING_FIELDS = ['发布时间', '标签', '浏览量', '使用量', '收藏量', '被复制',
+                    '模型配置', '知识库数量', '组件', '组件数量']
+
+# 判定逻辑本身变化时递增，使旧索引整体失效
+SCREENING_VERSION = 1
+
+
+def app_key(app: Any) -> Optional[str]:
+    """应用的稳定标识：优先使用 id，其次 URL；都没有时返回 None（不进入索引，每次都重新检查）"""
+    if not isinstance(app, dict):
+        return None
+    for field in ('id', 'app_id', 'url'):
+        value = app.get(field)
+        if value:
+            return f"{field}:{value}"
+    return None
+
+
+def input_hash(app: Dict[str, Any]) -> str:
+    """筛选输入字段的哈希（字段缺失与字段为空值视为不同）"""
+    values = {field: app[field] for field in SCREENING_FIELDS if field in app}
+    canonical = json.dumps(values, ensure_ascii=False, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha1(canonical.encode('utf-8')).hexdigest()
+
+
+def rules_fingerprint(thresholds: Dict[str, Any], classifier_config_file: str) -> str:
+    """阈值、应用类型规则和判定版本的指纹，任何一项变化时索引整体失效"""
+    digest = hashlib.sha1(f"v{SCREENING_VERSION}".encode('utf-8'))
+    digest.update(json.dumps(thresholds, ensure_ascii=False, sort_keys=True).encode('utf-8'))
+    try:
+        with open(classifier_config_file, 'rb') as f:
+            digest.update(f.read())
+    except OSError:
+        digest.update(b"<no classifier config>")
+    return digest.hexdigest()
+
+
+class ScreeningIndex:
+    def __init__(self, path: str = DEFAULT_INDEX_PATH, fingerprint: str = ""):
+        """打开（或创建）索引；fingerprint 与索引中记录的不一致时清空已有判定"""
+        self.path = path
+        self.fingerprint = fingerprint
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS decisions ("
+            "app_key TEXT PRIMARY KEY, input_hash TEXT NOT NULL, quarters REAL NOT NULL, "
+            "passed INTEGER NOT NULL, updated_at REAL NOT NULL)"
+        )
+        row = self._conn.execute("SELECT value FROM meta WHERE name = 'fingerprint'").fetchone()
+        self.invalidated = row is not None and row[0] != fingerprint
+        if row is None or self.invalidated:
+            self._conn.execute("DELETE FROM decisions")
+            self._conn.execute("INSERT OR REPLACE INTO meta (name, value) VALUES ('fingerprint', ?)",
+                               (fingerprint,))
+        self._conn.commit()
+
+    def load(self) -> Dict[str, Tuple[str, float, bool]]:
+        """读取全部判定：app_key → (输入哈希, 季度数, 是否通过)"""
+        with self._lock:
+            rows = self._conn.execute("SELECT app_key, input_hash, quarters, passed FROM decisions").fetchall()
+        return {key: (digest, quarters, bool(passed)) for key, digest, quarters, passed in rows}
+
+    def update(self, decisions: Dict[str, Tuple[str, float, bool]]):
+        """写入（覆盖）一批判定"""
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO decisions (app_key, input_hash, quarters, passed, updated_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                [(key, digest, quarters, int(passed), now) for key, (digest, quarters, passed) in decisions.items()]
+            )
+            self._conn.commit()
+
+    def prune(self, keep_keys) -> int:
+        """删除不在 keep_keys 中的应用（已下架的应用），返回删除条数"""
+        keep_keys = set(keep_keys)
+        with self._lock:
+            stale = [(key,) for (key,) in self._conn.execute("SELECT app_key FROM decisions")
+                     if key not in keep_keys]
+            self._conn.executemany("DELETE FROM decisions WHERE app_key = ?", stale)
+            self._conn.commit()
+        return len(stale)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM decisions").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
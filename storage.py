@@ -0,0 +1,216 @@
+"""
+LaQual - storage
+功能：按文件扩展名选择数据文件的读写格式
+作者：wang yan
+日期：2026-10-16
+
+应用目录、评估结果和指标文件支持 JSON（默认，缩进格式）、JSONL（可加 .gz / .zst 压缩）、
+Parquet、Arrow IPC（Feather），列式格式支持只读取需要的字段（列投影）。
+
+Parquet / Arrow 需要 pyarrow，.zst 需要 zstandard，均为可选依赖，只在读写对应格式时导入。
+"""
+
+import gzip
+import io
+import json
+import os
+from typing import Any, Dict, Iterable, List, Optional
+
+# 列式文件元数据中记录以 JSON 文本存储的列（嵌套值、混合类型或含显式 null 的字段）
+JSON_COLUMNS_KEY = b"laqual.json_columns"
+
+_COMPRESSION_SUFFIXES = {".gz": "gzip", ".zst": "zstd", ".zstd": "zstd"}
+_FORMAT_SUFFIXES = {
+    ".jsonl": "jsonl", ".ndjson": "jsonl",
+    ".parquet": "parquet", ".pq": "parquet",
+    ".arrow": "arrow", ".feather": "arrow", ".ipc": "arrow",
+}
+_NATIVE_TYPES = (str, int, float, bool)
+_MISSING = object()
+
+
+def _split_compression(path: str):
+    base, suffix = os.path.splitext(path.lower())
+    if suffix in _COMPRESSION_SUFFIXES:
+        return base, _COMPRESSION_SUFFIXES[suffix]
+    return path.lower(), None
+
+
+def file_format(path: str) -> str:
+    """由扩展名判断文件格式：json / jsonl / parquet / arrow"""
+    base, _ = _split_compression(path)
+    return _FORMAT_SUFFIXES.get(os.path.splitext(base)[1], "json")
+
+
+def is_columnar(path: str) -> bool:
+    """是否为列式格式（Parquet / Arrow）"""
+    return file_format(path) in ("parquet", "arrow")
+
+
+def _open_text(path: str, mode: str):
+    """按压缩后缀打开文本文件（mode 为 'r' 或 'w'）"""
+    _, compression = _split_compression(path)
+    if compression == "gzip":
+        return gzip.open(path, mode + "t", encoding="utf-8")
+    if compression == "zstd":
+        try:
+            import zstandard
+        except ImportError as e:
+            raise ImportError("读写 .zst 文件需要安装 zstandard（pip install zstandard）") from e
+        if mode == "r":
+            return io.TextIOWrapper(zstandard.ZstdDecompressor().stream_reader(open(path, "rb")), encoding="utf-8")
+        return io.TextIOWrapper(zstandard.ZstdCompressor(level=3).stream_writer(open(path, "wb")), encoding="utf-8")
+    return open(path, mode, encoding="utf-8-sig" if mode == "r" else "utf-8")
+
+
+def _import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.feather
+        import pyarrow.parquet
+    except ImportError as e:
+        raise ImportError("读写 Parquet / Arrow 文件需要安装 pyarrow（pip install pyarrow）") from e
+    return pyarrow
+
+
+def _project(record: Any, columns: Optional[List[str]]) -> Any:
+    if columns is None or not isinstance(record, dict):
+        return record
+    return {name: record[name] for name in columns if name in record}
+
+
+def _records_to_table(records: List[Dict[str, Any]]):
+    """记录列表 → Arrow 表；类型单一的标量列按原生类型存储，其余列存为 JSON 文本"""
+    pa = _import_pyarrow()
+    names = {}
+    for record in records:
+        if not isinstance(record, dict):
+            raise ValueError("列式格式只支持由对象组成的记录列表")
+        names.update(dict.fromkeys(record))
+
+    arrays, json_columns = [], []
+    for name in names:
+        values = [record.get(name, _MISSING) for record in records]
+        kinds = {type(value) for value in values if value is not _MISSING}
+        array = None
+        if len(kinds) == 1 and next(iter(kinds)) in _NATIVE_TYPES:
+            try:
+                array = pa.array([None if value is _MISSING else value for value in values])
+            except (pa.ArrowInvalid, OverflowError):
+                array = None
+        if array is None:
+            # 缺失字段存为 null，显式的 None 存为 "null"，读取时可以区分
+            json_columns.append(name)
+            array = pa.array([None if value is _MISSING else json.dumps(value, ensure_ascii=False)
+                              for value in values], type=pa.string())
+        arrays.append(array)
+
+    table = pa.Table.from_arrays(arrays, names=list(names))
+    return table.replace_schema_metadata({JSON_COLUMNS_KEY: json.dumps(json_columns).encode("utf-8")})
+
+
+def _table_to_records(table) -> List[Dict[str, Any]]:
+    """Arrow 表 → 记录列表（null 视为字段缺失）"""
+    metadata = table.schema.metadata or {}
+    json_columns = set(json.loads(metadata.get(JSON_COLUMNS_KEY, b"[]")))
+    columns = [(name, name in json_columns, table.column(name).to_pylist()) for name in table.column_names]
+    records = []
+    for row in range(table.num_rows):
+        record = {}
+        for name, is_json, values in columns:
+            value = values[row]
+            if value is not None:
+                record[name] = json.loads(value) if is_json else value
+        records.append(record)
+    return records
+
+
+def read_records(path: str, columns: List[str] = None, rows: List[int] = None) -> Any:
+    """读取记录列表
+
+    columns 指定时只返回这些字段（列式格式只读取对应的列）；
+    rows 指定时只返回这些行（按给定顺序）。JSON 文件的内容不是列表时原样返回。
+    """
+    fmt = file_format(path)
+    if fmt in ("parquet", "arrow"):
+        pa = _import_pyarrow()
+        schema = pa.parquet.read_schema(path) if fmt == "parquet" else pa.ipc.open_file(
+            pa.memory_map(path)).schema
+        selected = None if columns is None else [name for name in columns if name in schema.names]
+        if fmt == "parquet":
+            table = pa.parquet.read_table(path, columns=selected)
+        else:
+            table = pa.feather.read_table(path, columns=selected, memory_map=True)
+        if rows is not None:
+            table = table.take(pa.array(rows, type=pa.int64()))
+        return _table_to_records(table)
+
+    with _open_text(path, "r") as f:
+        if fmt == "jsonl":
+            records = [json.loads(line) for line in f if line.strip()]
+        else:
+            records = json.load(f)
+    if not isinstance(records, list):
+        return records
+    if rows is not None:
+        records = [records[row] for row in rows]
+    return [_project(record, columns) for record in records]
+
+
+def write_records(records: Iterable[Any], path: str, indent: int = 2):
+    """按扩展名写出记录列表（先写临时文件再替换，避免留下半个文件）"""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    fmt = file_format(path)
+    temp_file = f"{path}.tmp{os.path.splitext(path)[1]}"
+    if fmt in ("parquet", "arrow"):
+        pa = _import_pyarrow()
+        table = _records_to_table(list(records))
+        if fmt == "parquet":
+            pa.parquet.write_table(table, temp_file, compression="zstd")
+        else:
+            pa.feather.write_feather(table, temp_file, compression="zstd")
+    else:
+        with _open_text(temp_file, "w") as f:
+            if fmt == "jsonl":
+                for record in records:
+                    f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            else:
+                json.dump(records if isinstance(records, (list, dict)) else list(records), f,
+                          ensure_ascii=False, indent=indent)
+    os.replace(temp_file, path)
+
+
+def metrics_to_rows(all_metrics: Dict[str, Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """{标签: {指标名: 指标}} → 每个 (标签, 指标) 一行"""
+    return [
+        dict({"标签": tag, "指标": metric_name},
+             **(metric if isinstance(metric, dict) else {"描述": metric}))
+        for tag, tag_metrics in all_metrics.items()
+        for metric_name, metric in tag_metrics.items()
+    ]
+
+
+def rows_to_metrics(rows: List[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    """metrics_to_rows 的逆变换"""
+    all_metrics = {}
+    for row in rows:
+        metric = {key: value for key, value in row.items() if key not in ("标签", "指标")}
+        all_metrics.setdefault(row["标签"], {})[row["指标"]] = metric
+    return all_metrics
+
+
+def load_tag_metrics(path: str) -> Dict[str, Any]:
+    """读取指标文件：JSON 为原有的嵌套格式，其余格式为按行存储的 (标签, 指标)"""
+    if file_format(path) == "json":
+        return read_records(path)
+    return rows_to_metrics(read_records(path))
+
+
+def save_tag_metrics(all_metrics: Dict[str, Dict[str, Any]], path: str):
+    """写出 {标签: {指标名: 指标}}，格式由扩展名决定"""
+    if file_format(path) == "json":
+        write_records(all_metrics, path)
+    else:
+        write_records(metrics_to_rows(all_metrics), path)
@@ -0,0 +1,118 @@
+"""
+LaQual - structured_logging
+功能：所有模块共用的分级结构化日志
+作者：wang yan
+日期：2026-10-16
+
+JSON Lines / 文本两种格式，批量模式下对逐条目日志采样输出。
+
+环境变量：
+    LAQUAL_LOG_LEVEL        日志级别，默认 INFO（DEBUG 时输出逐指标的检查明细）
+    LAQUAL_LOG_FORMAT       json（默认，每行一个JSON对象）或 text
+    LAQUAL_LOG_MODE         normal（默认）或 batch：批量模式下逐条目日志每 N 条只输出 1 条
+    LAQUAL_LOG_SAMPLE_EVERY 批量模式的采样间隔 N，默认 1000
+"""
+
+import json
+import logging
+import os
+import sys
+import threading
+from datetime import datetime
+from typing import Any, Dict
+
+ROOT_LOGGER_NAME = "laqual"
+
+_configured = False
+_configure_lock = threading.Lock()
+
+
+class JsonFormatter(logging.Formatter):
+    """每条日志输出为一行JSON：时间、级别、模块、消息及结构化字段"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage()
+        }
+        entry.update(getattr(record, "fields", None) or {})
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """便于人工阅读的单行文本，结构化字段以 key=value 附在消息后"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        message = f"{record.levelname[0]} {record.name}: {record.getMessage()}"
+        extra = getattr(record, "fields", None)
+        if extra:
+            message += " " + " ".join(f"{key}={value}" for key, value in extra.items())
+        if record.exc_info:
+            message += "\n" + self.formatException(record.exc_info)
+        return message
+
+
+class ItemSampler(logging.Filter):
+    """批量模式：逐条目日志（extra 中 item=True）每个模块每 every 条只放行 1 条，WARNING 及以上不受影响"""
+
+    def __init__(self, every: int):
+        super().__init__()
+        self.every = max(1, every)
+        self.counts = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if not getattr(record, "item", False) or record.levelno >= logging.WARNING:
+            return True
+        with self._lock:
+            count = self.counts.get(record.name, 0)
+            self.counts[record.name] = count + 1
+        if count % self.every:
+            return False
+        record.fields = dict(getattr(record, "fields", None) or {}, sampled=f"1/{self.every}")
+        return True
+
+
+def configure_logging(level: str = None, fmt: str = None, mode: str = None,
+                      sample_every: int = None, stream=None):
+    """配置 laqual 日志（未指定的参数取环境变量）；可重复调用以切换配置"""
+    global _configured
+    level = (level or os.getenv('LAQUAL_LOG_LEVEL') or "INFO").upper()
+    fmt = (fmt or os.getenv('LAQUAL_LOG_FORMAT') or "json").lower()
+    mode = (mode or os.getenv('LAQUAL_LOG_MODE') or "normal").lower()
+    sample_every = sample_every or int(os.getenv('LAQUAL_LOG_SAMPLE_EVERY') or 1000)
+
+    with _configure_lock:
+        logger = logging.getLogger(ROOT_LOGGER_NAME)
+        for handler in list(logger.handlers):
+            logger.removeHandler(handler)
+
+        handler = logging.StreamHandler(stream or sys.stdout)
+        handler.setFormatter(TextFormatter() if fmt == "text" else JsonFormatter())
+        if mode == "batch":
+            handler.addFilter(ItemSampler(sample_every))
+        logger.addHandler(handler)
+        logger.setLevel(level)
+        logger.propagate = False
+        _configured = True
+
+
+def get_logger(name: str) -> logging.Logger:
+    """获取模块日志器（首次调用时按环境变量完成配置）"""
+    if not _configured:
+        configure_logging()
+    return logging.getLogger(f"{ROOT_LOGGER_NAME}.{name}")
+
+
+def fields(**values: Any) -> Dict[str, Any]:
+    """作为 extra 传入，附加结构化字段：logger.info("...", extra=fields(tag=tag))"""
+    return {"fields": values}
+
+
+def item(**values: Any) -> Dict[str, Any]:
+    """作为 extra 传入，标记逐条目（逐应用 / 逐问题）日志，批量模式下会被采样"""
+    return {"item": True, "fields": values}
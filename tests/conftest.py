@@ -0,0 +1,11 @@
+"""
+LaQual - conftest
+功能：测试配置，将仓库根目录加入模块搜索路径
+作者：wang yan
+日期：2026-10-17
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,75 @@
+"""
+LaQual - test_evaluation_journal
+功能：检查评估断点日志的续跑键与中断后的读取
+作者：wang yan
+日期：2026-10-17
+"""
+
+import json
+
+from Response_quality_evaluation import EvaluationJournal
+
+TASK = {
+    "app_index": 0,
+    "app_name": "法律助手",
+    "app_url": "https://example.com/app/0",
+    "tag": "法律咨询",
+    "metric_name": "准确性",
+    "question_name": "问题1",
+    "question": "租赁合同中押金如何扣除？",
+    "response": "押金的扣除应以实际损失为限。",
+    "metric_criteria": {"描述": "回答是否准确", "评分标准": "1-10分"},
+}
+
+
+def test_key_is_stable_and_ignores_unrelated_fields():
+    key = EvaluationJournal.make_key(TASK)
+    assert EvaluationJournal.make_key(dict(TASK)) == key
+    assert EvaluationJournal.make_key(dict(TASK, app_data={"浏览量": 10})) == key
+
+
+def test_key_changes_with_content():
+    # 名称不变、内容重新生成后不能复用旧的评估
+    key = EvaluationJournal.make_key(TASK)
+    for field, value in [("question", "押金可以全部扣除吗？"), ("response", "押金不退。"),
+                         ("metric_criteria", {"描述": "回答是否完整"})]:
+        assert EvaluationJournal.make_key(dict(TASK, **{field: value})) != key
+
+
+def test_key_changes_with_identity():
+    key = EvaluationJournal.make_key(TASK)
+    for field, value in [("app_index", 1), ("app_url", "https://example.com/app/1"),
+                         ("tag", "合同审查"), ("metric_name", "完整性"), ("question_name", "问题2")]:
+        assert EvaluationJournal.make_key(dict(TASK, **{field: value})) != key
+
+
+def test_resume_after_interruption(tmp_path):
+    path = str(tmp_path / "journal" / "batch.jsonl")
+    key = EvaluationJournal.make_key(TASK)
+    journal = EvaluationJournal(path)
+    journal.record(key, {"score": 8})
+
+    # 模拟中断：最后一条记录只写了一半
+    with open(path, "a", encoding="utf-8") as f:
+        f.write('{"key": "half')
+
+    resumed = EvaluationJournal(path)
+    assert resumed.get(key) == {"score": 8}
+    other = EvaluationJournal.make_key(dict(TASK, question_name="问题2"))
+    resumed.record(other, {"score": 6})
+
+    with open(path, encoding="utf-8") as f:
+        lines = f.read().splitlines()
+    assert json.loads(lines[-1]) == {"key": other, "detail": {"score": 6}}
+    assert EvaluationJournal(path).completed == {key: {"score": 8}, other: {"score": 6}}
+
+
+def test_complete_rotates_journal(tmp_path):
+    path = str(tmp_path / "batch.jsonl")
+    journal = EvaluationJournal(path)
+    journal.record(EvaluationJournal.make_key(TASK), {"score": 8})
+    journal.complete()
+
+    assert journal.completed == {}
+    assert (tmp_path / "batch.jsonl.done").exists()
+    assert EvaluationJournal(path).completed == {}
@@ -0,0 +1,71 @@
+"""
+LaQual - test_iter_apps
+功能：检查 iter_apps 在任意分块边界下的逐个解析结果与整体解析一致
+作者：wang yan
+日期：2026-10-17
+"""
+
+import json
+
+import pytest
+
+from Static_indicator_evaluation import iter_apps
+
+# 覆盖分块截断时前半段也能解析成功的标量（小数、指数、负数、true/false/null）以及转义字符
+APPS = [
+    {"title": "应用1", "浏览量": 1.5, "使用量": 1e5, "收藏量": -12, "被复制": 0},
+    12345,
+    -0.25,
+    2.5e-3,
+    True,
+    False,
+    None,
+    "带\"引号\"和\\反斜杠的标题，以及 ] 和 , 字符",
+    {"组件": ["搜索", {"嵌套": [1, 2.0, [3e2]]}], "模型配置": []},
+    [],
+    {},
+]
+
+
+def write(tmp_path, text, name="apps.json"):
+    path = tmp_path / name
+    path.write_text(text, encoding="utf-8")
+    return str(path)
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 5, 7, 16, 1 << 20])
+@pytest.mark.parametrize("separators", [(",", ":"), (", ", ": "), (" ,\n\t", " :\r\n")],
+                         ids=["compact", "spaced", "whitespace"])
+def test_array_any_chunk_size(tmp_path, chunk_size, separators):
+    path = write(tmp_path, "\n  " + json.dumps(APPS, ensure_ascii=False, separators=separators) + "\n")
+    assert list(iter_apps(path, chunk_size=chunk_size)) == APPS
+
+
+@pytest.mark.parametrize("chunk_size", [1, 4, 1 << 20])
+def test_array_ending_with_number(tmp_path, chunk_size):
+    # 文件末尾的数字之后没有分隔符时也不能被截断
+    path = write(tmp_path, "[1, 22.75, 333e1]")
+    assert list(iter_apps(path, chunk_size=chunk_size)) == [1, 22.75, 3330.0]
+
+
+def test_jsonl_with_bom_and_blank_lines(tmp_path):
+    lines = "\n".join(json.dumps(app, ensure_ascii=False) for app in APPS[:3])
+    path = tmp_path / "apps.jsonl"
+    path.write_bytes(b"\xef\xbb\xbf" + ("\n" + lines + "\n\n").encode("utf-8"))
+    assert list(iter_apps(str(path), chunk_size=3)) == APPS[:3]
+
+
+@pytest.mark.parametrize("text", ["", "  \n", "[]", "[ \n ]"])
+def test_empty_inputs(tmp_path, text):
+    assert list(iter_apps(write(tmp_path, text))) == []
+
+
+@pytest.mark.parametrize("text", ["[1, 2", "[{\"title\": \"应用\"}", "[1, 2,"])
+def test_unterminated_array_raises(tmp_path, text):
+    with pytest.raises(ValueError):
+        list(iter_apps(write(tmp_path, text), chunk_size=2))
+
+
+def test_truncated_element_raises(tmp_path):
+    with pytest.raises(json.JSONDecodeError):
+        list(iter_apps(write(tmp_path, "[1, {\"title\": "), chunk_size=4))
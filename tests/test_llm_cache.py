@@ -0,0 +1,113 @@
+"""
+LaQual - test_llm_cache
+功能：检查LLM响应缓存的缓存键与淘汰策略
+作者：wang yan
+日期：2026-10-17
+"""
+
+import pytest
+
+import llm_cache
+from llm_cache import LLMCache
+
+PAYLOAD = {
+    "model": "Qwen/Qwen2.5-7B-Instruct",
+    "messages": [{"role": "user", "content": "为“法律咨询”标签生成评估指标"}],
+    "temperature": 0.7,
+    "max_tokens": 512,
+}
+
+
+class Clock:
+    now = 1000.0
+
+    def advance(self, seconds: float = 1.0):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """可控的时钟，只在调用 advance 时前进"""
+    clock = Clock()
+    monkeypatch.setattr(llm_cache.time, "time", lambda: clock.now)
+    return clock
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = LLMCache(str(tmp_path / "responses.sqlite"), max_entries=None, evict_interval=10 ** 6)
+    yield cache
+    cache.close()
+
+
+def test_key_ignores_field_order_and_stream_options():
+    key = LLMCache.make_key(PAYLOAD)
+    reordered = dict(reversed(list(PAYLOAD.items())))
+    streamed = dict(PAYLOAD, stream=True, stream_options={"include_usage": True})
+    assert LLMCache.make_key(reordered) == key
+    assert LLMCache.make_key(streamed) == key
+
+
+@pytest.mark.parametrize("field, value", [
+    ("model", "deepseek-ai/DeepSeek-V3"),
+    ("messages", [{"role": "user", "content": "为“写作润色”标签生成评估指标"}]),
+    ("temperature", 0.0),
+    ("max_tokens", 1024),
+    ("n", 3),
+])
+def test_key_changes_with_semantic_fields(field, value):
+    assert LLMCache.make_key(dict(PAYLOAD, **{field: value})) != LLMCache.make_key(PAYLOAD)
+
+
+def test_put_get_roundtrip(cache):
+    key = LLMCache.make_key(PAYLOAD)
+    assert cache.get(key) is None
+    cache.put(key, {"content": "指标：准确性"})
+    assert cache.get(key) == {"content": "指标：准确性"}
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 1
+
+
+def test_evicts_least_recently_accessed(cache, clock):
+    cache.max_entries = 2
+    for key in ["a", "b", "c"]:
+        cache.put(key, {"content": key})
+        clock.advance()
+    # 读取 a 后 b 成为最久未访问的条目
+    assert cache.get("a") == {"content": "a"}
+    cache.evict()
+    assert cache.get("b") is None
+    assert cache.get("a") == {"content": "a"}
+    assert cache.get("c") == {"content": "c"}
+    assert cache.stats()["entries"] == 2
+
+
+def test_evicts_every_evict_interval_puts(tmp_path, clock):
+    cache = LLMCache(str(tmp_path / "responses.sqlite"), max_entries=3, evict_interval=4)
+    for index in range(4):
+        cache.put(str(index), {"content": index})
+        clock.advance()
+    assert cache.stats()["entries"] == 3
+    cache.put("4", {"content": 4})
+    assert cache.stats()["entries"] == 4
+    cache.close()
+
+
+def test_expired_entries(cache, clock):
+    cache.max_age_seconds = 10
+    cache.put("old", {"content": "old"})
+    clock.advance(6)
+    assert cache.get("old") == {"content": "old"}
+    clock.advance(5)
+    cache.put("new", {"content": "new"})
+    # 过期按写入时间计算，读取不会延长有效期
+    assert cache.get("old") is None
+    assert cache.get("new") == {"content": "new"}
+    cache.evict()
+    assert cache.stats()["entries"] == 1
+
+
+def test_disabled_cache_bypasses_storage(tmp_path):
+    cache = LLMCache(str(tmp_path / "responses.sqlite"), enabled=False)
+    cache.put("a", {"content": "a"})
+    assert cache.get("a") is None
+    assert not (tmp_path / "responses.sqlite").exists()
@@ -0,0 +1,141 @@
+"""
+LaQual - test_pipeline
+功能：检查流水线按指纹判断阶段与分区是否需要重跑
+作者：wang yan
+日期：2026-10-17
+"""
+
+import json
+import os
+
+import pytest
+
+from pipeline import Pipeline, PipelineState, Stage
+
+
+class Calls:
+    """记录阶段 / 分区的实际运行"""
+
+    def __init__(self):
+        self.calls = []
+
+
+@pytest.fixture
+def files(tmp_path):
+    source = tmp_path / "source.txt"
+    source.write_text("1\n2\n3\n", encoding="utf-8")
+    return {"source": str(source), "total": str(tmp_path / "total.txt"), "state_dir": str(tmp_path / "state")}
+
+
+def sum_pipeline(files, counter, version="1", config=None):
+    """单阶段流水线：把输入文件中的数字求和写入输出文件"""
+    def run():
+        counter.calls.append("sum")
+        with open(files["source"], encoding="utf-8") as f:
+            total = sum(int(line) for line in f if line.strip())
+        with open(files["total"], "w", encoding="utf-8") as f:
+            f.write(str(total))
+
+    stage = Stage("sum", inputs=[files["source"]], outputs=[files["total"]], version=version,
+                  config=config or {}, run=run)
+    return Pipeline([stage], files["state_dir"])
+
+
+def test_unchanged_stage_is_skipped(files):
+    counter = Calls()
+    assert sum_pipeline(files, counter).run() == {"sum": {"status": "ran"}}
+    assert sum_pipeline(files, counter).run() == {"sum": {"status": "skipped"}}
+    assert counter.calls == ["sum"]
+
+
+@pytest.mark.parametrize("change", ["input", "version", "config", "deleted_output"])
+def test_stage_reruns_when_stale(files, change):
+    counter = Calls()
+    sum_pipeline(files, counter).run()
+    version, config = "1", None
+    if change == "input":
+        with open(files["source"], "a", encoding="utf-8") as f:
+            f.write("4\n")
+    elif change == "version":
+        version = "2"
+    elif change == "config":
+        config = {"engine": "scalar"}
+    else:
+        os.remove(files["total"])
+
+    assert sum_pipeline(files, counter, version, config).run()["sum"]["status"] == "ran"
+    assert counter.calls == ["sum", "sum"]
+
+
+def test_modified_output_is_not_overwritten(files):
+    counter = Calls()
+    sum_pipeline(files, counter).run()
+    with open(files["source"], "a", encoding="utf-8") as f:
+        f.write("4\n")
+    with open(files["total"], "w", encoding="utf-8") as f:
+        f.write("手工修改")
+
+    summary = sum_pipeline(files, counter).run()
+    assert summary["sum"] == {"status": "outputs_modified", "modified": [files["total"]]}
+    with open(files["total"], encoding="utf-8") as f:
+        assert f.read() == "手工修改"
+
+    assert sum_pipeline(files, counter).run(force=True)["sum"]["status"] == "ran"
+    with open(files["total"], encoding="utf-8") as f:
+        assert f.read() == "10"
+
+
+def test_dry_run_does_not_record_state(files):
+    counter = Calls()
+    assert sum_pipeline(files, counter).run(dry_run=True) == {"sum": {"status": "planned"}}
+    assert counter.calls == []
+    assert PipelineState(files["state_dir"]).load("sum") == {"fingerprint": None, "partitions": {}}
+
+
+def partitioned_pipeline(tmp_path, groups, counter, failing=()):
+    source = tmp_path / "groups.json"
+    output = tmp_path / "lengths.json"
+
+    def run_partition(key, words):
+        counter.calls.append(key)
+        return None if key in failing else len(words)
+
+    def assemble(results):
+        output.write_text(json.dumps(results, ensure_ascii=False), encoding="utf-8")
+
+    source.write_text(json.dumps(groups, ensure_ascii=False), encoding="utf-8")
+    stage = Stage("lengths", inputs=[str(source)], outputs=[str(output)],
+                  partitions=lambda: json.loads(source.read_text(encoding="utf-8")),
+                  run_partition=run_partition, assemble=assemble)
+    return Pipeline([stage], str(tmp_path / "state")), output
+
+
+def test_only_changed_partitions_rerun(tmp_path):
+    counter = Calls()
+    groups = {"法律": ["a", "b"], "写作": ["c"], "编程": ["d", "e", "f"]}
+    pipeline, output = partitioned_pipeline(tmp_path, groups, counter)
+    pipeline.run()
+    assert sorted(counter.calls) == ["写作", "法律", "编程"]
+
+    counter.calls.clear()
+    groups = {"法律": ["a", "b"], "写作": ["c", "g"], "翻译": ["h"]}
+    pipeline, output = partitioned_pipeline(tmp_path, groups, counter)
+    summary = pipeline.run()["lengths"]
+    assert sorted(counter.calls) == ["写作", "翻译"]
+    assert summary["removed"] == ["编程"]
+    assert json.loads(output.read_text(encoding="utf-8")) == {"法律": 2, "写作": 2, "翻译": 1}
+
+
+def test_failed_partition_is_retried(tmp_path):
+    counter = Calls()
+    groups = {"法律": ["a"], "写作": ["b", "c"]}
+    pipeline, output = partitioned_pipeline(tmp_path, groups, counter, failing={"写作"})
+    assert pipeline.run()["lengths"]["failed"] == ["写作"]
+    assert json.loads(output.read_text(encoding="utf-8")) == {"法律": 1}
+
+    # 存在失败分区时阶段指纹未记录，下次运行只重跑失败的分区
+    counter.calls.clear()
+    pipeline, output = partitioned_pipeline(tmp_path, groups, counter)
+    assert pipeline.run()["lengths"]["failed"] == []
+    assert counter.calls == ["写作"]
+    assert json.loads(output.read_text(encoding="utf-8")) == {"法律": 1, "写作": 2}
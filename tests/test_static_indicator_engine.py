@@ -0,0 +1,112 @@
+"""
+LaQual - test_static_indicator_engine
+功能：检查批量静态指标引擎与逐应用参考实现的判定一致
+作者：wang yan
+日期：2026-10-17
+"""
+
+import math
+import random
+from datetime import datetime
+
+import pytest
+
+from Static_indicator_evaluation import check_basic_metrics, set_reference_now
+from static_indicator_engine import evaluate_catalog
+
+REFERENCE_NOW = datetime(2025, 6, 15)
+
+TAGS = ["法律咨询", "写作润色", "编程助手", "智能翻译", "旅行规划", "心理辅导", "知识问答", "", None, ["法律", "问答"]]
+PUBLISH_TIMES = ["", None, "2024-03-01", "2023/11/20 10:00:00", "2099-01-01", "0001-01-01", "昨天", 20240301]
+# 数值字段的取值覆盖字符串数字、带单位的字符串、空值、列表以及 NaN / 无穷大等边界情况
+NUMBERS = [0, 3, 250, 5000, 120000, 2.7, -5, True, "1200", "1.2万", "12,345", "", "-", ".", "abc",
+           None, [], [1, 2], float("nan"), float("inf"), float("-inf"), "1" * 400]
+MODEL_CONFIGS = [["Qwen"], ["Qwen", "DeepSeek"], [], "", "Qwen", "  ", None, 0, 2, float("inf"), {"a": 1}]
+
+
+@pytest.fixture(autouse=True)
+def reference_now():
+    set_reference_now(REFERENCE_NOW)
+    yield
+    set_reference_now(None)
+
+
+def random_app(rng: random.Random) -> dict:
+    app = {
+        "title": f"应用{rng.randint(0, 10 ** 6)}",
+        "标签": rng.choice(TAGS),
+        "发布时间": rng.choice(PUBLISH_TIMES),
+        "模型配置": rng.choice(MODEL_CONFIGS),
+    }
+    for field in ["浏览量", "使用量", "收藏量", "被复制", "知识库数量"]:
+        if rng.random() < 0.9:
+            app[field] = rng.choice(NUMBERS)
+    component_style = rng.random()
+    if component_style < 0.4:
+        app["组件"] = rng.choice([["搜索"] * rng.randint(0, 4), rng.choice(NUMBERS)])
+    if component_style > 0.3:
+        app["组件数量"] = rng.choice(NUMBERS)
+    return app
+
+
+def assert_same_decisions(apps):
+    expected = [check_basic_metrics(app) for app in apps]
+    actual = evaluate_catalog(apps, REFERENCE_NOW)["passed"].tolist()
+    mismatches = [(app, want) for app, want, got in zip(apps, expected, actual) if want != got]
+    assert not mismatches, mismatches[:5]
+
+
+def test_random_catalog_matches_scalar():
+    rng = random.Random(20251016)
+    assert_same_decisions([random_app(rng) for _ in range(3000)])
+
+
+def test_passing_apps_match_scalar():
+    # 随机目录中通过的应用较少，单独构造一批大多能通过的应用
+    rng = random.Random(7)
+    apps = []
+    for _ in range(500):
+        apps.append({
+            "标签": rng.choice(TAGS[:7]),
+            "发布时间": f"2024-{rng.randint(1, 12):02d}-01",
+            "浏览量": rng.randint(0, 200000),
+            "使用量": str(rng.randint(0, 20000)),
+            "收藏量": rng.randint(0, 500),
+            "被复制": rng.randint(0, 300),
+            "模型配置": ["Qwen", "DeepSeek"][:rng.randint(1, 2)],
+            "知识库数量": rng.randint(0, 3),
+            "组件数量": rng.randint(0, 4),
+        })
+        if rng.random() < 0.5:
+            apps[-1]["组件"] = ["搜索"] * rng.randint(0, 4)
+    assert sum(check_basic_metrics(app) for app in apps) > 0
+    assert_same_decisions(apps)
+
+
+@pytest.mark.parametrize("tag", ["写作润色", "法律咨询", "编程助手"])
+@pytest.mark.parametrize("value", [float("inf"), float("-inf"), float("nan"), "1" * 400],
+                         ids=["inf", "-inf", "nan", "long-digits"])
+def test_non_finite_knowledge_base_count(tag, value):
+    app = {
+        "标签": tag,
+        "发布时间": "2025-05-01",
+        "浏览量": 100000,
+        "使用量": 100000,
+        "模型配置": ["Qwen", "DeepSeek"],
+        "知识库数量": value,
+        "组件数量": 3,
+    }
+    assert_same_decisions([app, dict(app, 知识库数量=3)])
+
+
+def test_non_dict_apps_fail():
+    table = evaluate_catalog([None, "app", {"模型配置": ["Qwen"]}], REFERENCE_NOW)
+    assert table["passed"].tolist() == [False, False, False]
+    assert table["reason"][0].startswith("应用数据格式错误")
+
+
+def test_time_decay_matches_scalar():
+    table = evaluate_catalog([{"发布时间": "2020-02-01"}, {"发布时间": "2025-06-01"}], REFERENCE_NOW)
+    assert table["quarters"].tolist() == [64 / 3, 1.0]
+    assert math.isclose(table["time_decay"][0], 0.99 ** (64 / 3 - 1))
+    assert table["time_decay"][1] == 1.0